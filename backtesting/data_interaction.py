@@ -1,16 +1,40 @@
 import pandas as pd
 import numpy as np
 from datetime import datetime
+from feature_store import Feature_Store
+from market_data import Market_Data
+from stock_data_schema import numeric_stock_data
 
 def str_to_date_obj(date_string:str):
     return(datetime.strptime(date_string, "%Y-%m-%d"))
 
+def _price_var_wanted(price_var, std_dev_day_range='all', reg_day_range='all', price_vars_to_exclude=None):
+    """checks a price var (level 0 of the column names) against the price var filters of select_data_subset"""
+    # exclude price vars
+    if price_vars_to_exclude != None and price_var in price_vars_to_exclude:
+        return(False)
+
+    # filter std dev day ranges
+    if std_dev_day_range != 'all':
+        if price_var.startswith('Std_Dev') and not price_var.endswith(tuple(str(x) for x in std_dev_day_range)):
+            return(False)
+
+    # filter regression day ranges
+    if reg_day_range != 'all':
+        is_reg_col = (price_var.split('_')[0] == 'Intercept' or
+                      (len(price_var.split('_')) > 1 and price_var.split('_')[-2] == 'Coeff'))
+        if is_reg_col and not any(str(a) in price_var for a in reg_day_range):
+            return(False)
+
+    return(True)
+
+
 def select_data_subset(input_dataframe, std_dev_day_range='all', reg_day_range='all', ticker_subset='all', price_vars_to_exclude=None, start_date=None, sort_cols = True):
     """
     Selects a subset of stock data based on a variety of factors.
 
     Args:
-        input_dataframe (pandas dataframe, required): DataFrame with stock data.
+        input_dataframe (pandas dataframe or Feature_Store, required): DataFrame with stock data. If it's a Feature_Store the filters are pushed down so only the selected data is read from disk.
         std_dev_day_range (str, list, optional): Leave as 'all' to include everything, give an int or a list of ints to select only std_devs over that/those periods. Defaults to 'all'.
         reg_day_range (list, optional): Leave as 'all' to include everything, give an int or a list of ints to select only reg values (intercept and coeffs) over that/those periods. Defaults to 'all'.
         ticker_subset (list, optional): Leave as 'all' to include all tickers, or give a list of ticker(s) to keep. Defaults to 'all'.
@@ -18,9 +42,20 @@ def select_data_subset(input_dataframe, std_dev_day_range='all', reg_day_range='
         start_date (str, optional): The date before which you don't want data, in the format 'YYYY-MM-DD'. Defaults to None.
         sort_cols (bool, optional): Set to true if you want to sort the columns alphabetically, first by Prive Var, then by ticker Defaults to True.
     Returns:
-        pandas dataframe: Filtered DataFrame based on the specified criteria.
+        pandas dataframe: Filtered DataFrame based on the specified criteria. Numbers are always numeric, see stock_data_schema.numeric_stock_data, and
+            numeric columns keep their dtype. A Feature_Store comes back in the compact dtypes it's stored in.
     """
 
+    # reads only the wanted price vars, tickers and years from disk
+    if isinstance(input_dataframe, Feature_Store):
+        return_df = input_dataframe.load(
+            price_vars=[x for x in input_dataframe.price_vars if _price_var_wanted(x, std_dev_day_range, reg_day_range, price_vars_to_exclude)],
+            tickers=None if ticker_subset == 'all' else ticker_subset,
+            start_date=start_date)
+        if sort_cols:
+            return_df = return_df.sort_index(axis=1,level=[0,1])
+        return(return_df)
+
     # filter date
     if start_date != None:
         return_df = input_dataframe[input_dataframe.index > start_date]
@@ -34,31 +69,9 @@ def select_data_subset(input_dataframe, std_dev_day_range='all', reg_day_range='
         # print(return_cols)
         return_cols = list(x for x in return_cols if x[1] in (ticker_subset+['']) )
     
-    # exclude price vars
-    if price_vars_to_exclude != None:
-        return_cols = list({x for x in return_cols if x[0] not in price_vars_to_exclude})
-    
-    # filter std dev day ranges
-    if std_dev_day_range != 'all':
-        std_dev_day_range = tuple(str(x) for x in std_dev_day_range)
-        return_cols = list(
-            set(return_cols)
-            - set( list(x for x in return_cols if ( x[0].startswith('Std_Dev') and (not (x[0].endswith(std_dev_day_range))) )) )
-            )
-
-
-    # filter regression day ranges
-    if reg_day_range != 'all':
-        print()
-        bad_reg_cols = [
-            x for x in return_cols 
-            if (x[0].split('_')[0] == 'Intercept' or 
-                (len(x[0].split('_')) > 1 and x[0].split('_')[-2] == 'Coeff') )
-                ]
-
-        bad_reg_cols = {x for x in bad_reg_cols if not any(str(a) in x[0] for a in reg_day_range)}
-        return_cols = list(set(return_cols) - set(bad_reg_cols))
-
+    # filter price vars, each price var is only checked once
+    wanted = {x: _price_var_wanted(x, std_dev_day_range, reg_day_range, price_vars_to_exclude) for x in return_df.columns.get_level_values(0).unique()}
+    return_cols = list(x for x in return_cols if wanted[x[0]])
 
     
     if not((ticker_subset == 'all') and (price_vars_to_exclude == None) and (std_dev_day_range=='all') and (reg_day_range=='all')):
@@ -68,7 +81,8 @@ def select_data_subset(input_dataframe, std_dev_day_range='all', reg_day_range='
     if sort_cols:
         return_df = return_df.sort_index(axis=1,level=[0,1])
 
-    return(return_df)
+    # object columns (eg. from an older file) are made numeric, everything else keeps the dtype it came in with
+    return(numeric_stock_data(return_df))
 
 
 
@@ -114,17 +128,24 @@ def add_lin_reg_prediction(df, reg_range, predict_target_day=0, new_multiindex_c
 
     # intercept
     return_df = df.xs(intercept_col, axis=1,level=0)
+    # worked out in float64 (the int Dates_Numeric column upcasts anyway) and stored in the features' dtype
+    features_dtype = return_df.dtypes.iloc[0] if return_df.shape[1] and return_df.dtypes.iloc[0] != object else np.float64
 
     # plus coefficient* value for each coeficient value pair (for multivar regressions)
     for p_col in predictor_cols:
         return_df = return_df + (df.xs(p_col,axis=1,level=0).values *df.xs(coeff_cols_dict[p_col], axis=1, level =0))
     
+    # only data that wasn't loaded through the compact schema can still have object columns
+    if any(x == object for x in return_df.dtypes):
+        return_df = return_df.apply(pd.to_numeric, errors='coerce')
+    return_df = return_df.astype(features_dtype)
+
     if new_multiindex_col_name == None:
-        return(return_df.apply(pd.to_numeric, errors='coerce'))
+        return(return_df)
     else: 
         new_columns = pd.MultiIndex.from_product([[new_multiindex_col_name], return_df.columns])
         return_df.columns= new_columns
-        return(return_df.apply(pd.to_numeric, errors='coerce'))
+        return(return_df)
     
 
 
@@ -157,15 +178,17 @@ def add_price_diff_metric(df, actual_val_col, theo_val_col, std_dev_col, new_mul
 
 
 class Company_Data_Getter:
-    def __init__(self, company_data, stock_data):
+    def __init__(self, company_data, stock_data, market_data=None):
         """helper object to get data on companies
 
         Args:
             company_data (dataframe): dataframe containing data on companies that doesn't change over time eg. sector
             stock_data (dataframe): 3d datafram containing data on companies that changes over time eg. market cap
+            market_data (Market_Data, optional): arrays of stock_data that stock data lookups go through, made from stock_data if not given. Defaults to None.
         """
         self.company_data = company_data
         self.stock_data = stock_data
+        self.market_data = market_data if market_data is not None else Market_Data(stock_data)
         
         self.large_countries = {
             "United States": "United States", "China": "China", "Canada": "Canada", "Israel": "Israel", "United Kingdom": "United Kingdom", "Singapore": "Singapore", "Hong Kong": "Hong Kong","Cayman Islands": "Cayman Islands", "Bermuda": "Bermuda",
@@ -208,27 +231,96 @@ class Company_Data_Getter:
                 sector = self.company_data[self.company_data['Industry'] == industry]['Sector'].iloc[0]
                 # Map industry to "Sector: Other"
                 self.small_industries[industry] = f"{sector}: Other"
+
+        # integer codes for each categorical attribute, one per row of company_data (-1 for missing data), and the
+        # category each code stands for. Lookups and filters work on these instead of going ticker by ticker
+        self.tickers = self.company_data.index.drop_duplicates()
+        company_rows = self.company_data.loc[~self.company_data.index.duplicated()]
+        attribute_values = {column: company_rows[column] for column in ['Sector', 'Industry', 'Country', 'Exchange']}
+        attribute_values['Region'] = company_rows['Country'].map(self._region_of_country)
+        attribute_values['Industry_Category'] = company_rows['Industry'].map(lambda industry: self.small_industries.get(industry, industry))
+        self._codes = {}
+        self._categories = {}
+        for attribute, values in attribute_values.items():
+            self._codes[attribute], self._categories[attribute] = pd.factorize(values)
+        self._exclusion_masks = {}
                 
                 
 
+    def _region_of_country(self, country):
+        if country in self.large_countries:
+            return self.large_countries[country]
+        return self.country_to_region.get(country, "Uncategorized Region")
+
+    def ticker_rows(self, tickers):
+        """row of each ticker in company_data, -1 for tickers it doesn't have"""
+        return self.tickers.get_indexer(tickers)
+
+    def _get_categorical(self, attribute, tickers):
+        """values of a categorical attribute for tickers, NaN where there's no data, as a series if tickers is a series and an index otherwise"""
+        rows = self.ticker_rows(tickers)
+        codes = np.where(rows >= 0, self._codes[attribute][rows], -1)
+        values = np.asarray(self._categories[attribute], dtype=object).take(codes, mode='clip')
+        values[codes < 0] = np.nan
+        if isinstance(tickers, pd.Series):
+            return pd.Series(values, index=tickers.index, name=tickers.name)
+        return pd.Index(values)
+
+    def exclusion_mask(self, attribute, to_exclude):
+        """boolean array over the tickers of company_data, True where attribute is in to_exclude or is missing. Kept for each exclusion list
+
+        Args:
+            attribute (str): one of 'Sector', 'Industry', 'Country', 'Exchange', 'Region' or 'Industry_Category'
+            to_exclude (list): values to exclude eg. ['Finance', 'Energy']
+        """
+        key = (attribute, tuple(to_exclude))
+        if key not in self._exclusion_masks:
+            excluded_categories = np.asarray(self._categories[attribute].isin(to_exclude))
+            codes = self._codes[attribute]
+            self._exclusion_masks[key] = (codes < 0) | excluded_categories[np.maximum(codes, 0)]
+        return self._exclusion_masks[key]
+
+    def keep_mask(self, tickers, avoid_sectors_filter=[], avoid_industries_filter=[], avoid_countries_filter=[]):
+        """boolean array over tickers, False for the ones best_on_date's avoid filters drop (including missing data for a filter that's used)"""
+        rows = self.ticker_rows(tickers)
+        keep = np.ones(len(rows), dtype=bool)
+        for attribute, to_exclude in [('Sector', avoid_sectors_filter), ('Industry', avoid_industries_filter), ('Country', avoid_countries_filter)]:
+            if not to_exclude in [[],None]:
+                keep &= (rows >= 0) & ~self.exclusion_mask(attribute, to_exclude)[rows]
+        return keep
+
+    def get_attributes(self, tickers, columns=['Name', 'Sector', 'Industry', 'Country']):
+        """dataframe of company data columns for each ticker in one join, NaN for tickers without company data. Indexed like tickers"""
+        attributes = self.company_data.loc[~self.company_data.index.duplicated(), columns].reindex(tickers)
+        attributes.index = tickers.index if isinstance(tickers, pd.Series) else pd.RangeIndex(len(attributes))
+        return attributes
+
+    def get_size_categories_on_dates(self, tickers, dates):
+        """array of each ticker's size category on the matching date, gathered from the market data arrays"""
+        return self.market_data.gather('Size_Category', dates, tickers)
+
+    def get_market_caps_on_dates(self, tickers, dates):
+        """array of each ticker's market cap on the matching date, gathered from the market data arrays"""
+        return self.market_data.gather('Market_Cap', dates, tickers)
+
     # methods for series
     def get_name(self, tickers):
         return tickers.map(lambda ticker: self._safe_get_company_data(ticker, 'Name'))
         
     def get_sector(self, tickers):
-        return tickers.map(lambda ticker: self._safe_get_company_data(ticker, 'Sector'))
+        return self._get_categorical('Sector', tickers)
 
     def get_industry(self, tickers):
-        return tickers.map(lambda ticker: self._safe_get_company_data(ticker, 'Industry'))
+        return self._get_categorical('Industry', tickers)
 
     def get_country(self, tickers):
-        return tickers.map(lambda ticker: self._safe_get_company_data(ticker, 'Country'))
+        return self._get_categorical('Country', tickers)
 
     def get_ipo_year(self, tickers):
         return tickers.map(lambda ticker: self._safe_get_company_data(ticker, 'IPO_Year'))
 
     def get_exchange(self, tickers):
-        return tickers.map(lambda ticker: self._safe_get_company_data(ticker, 'Exchange'))
+        return self._get_categorical('Exchange', tickers)
 
     def get_size_category(self, tickers, dates):
         return [self._safe_get_stock_data(date, ('Size_Category', ticker)) for ticker, date in zip(tickers, dates)]
@@ -239,11 +331,12 @@ class Company_Data_Getter:
 
     def get_country_region(self, tickers):
         """Returns a dictionary of regions for a list of tickers."""
-        return {ticker: self.get_country_region_single(ticker) for ticker in tickers}
+        regions = self._get_categorical('Region', pd.Index(tickers)).fillna("Uncategorized Region")
+        return dict(zip(tickers, regions))
     
     def get_industry_category(self, tickers):
         """Returns a dictionary of categorized industries for a list of tickers."""
-        return {ticker: self.get_industry_category_single(ticker) for ticker in tickers}
+        return dict(zip(tickers, self._get_categorical('Industry_Category', pd.Index(tickers))))
 
 
     # Methods for individual values
@@ -303,7 +396,4 @@ class Company_Data_Getter:
             return np.nan
 
     def _safe_get_stock_data(self, date, column_tuple):
-        try:
-            return self.stock_data.at[date, column_tuple]
-        except (KeyError, IndexError):
-            return np.nan
+        return self.market_data.get(date, column_tuple)
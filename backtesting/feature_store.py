@@ -0,0 +1,180 @@
+import os
+import json
+import pandas as pd
+import numpy as np
+from stock_data_schema import compact_stock_data
+
+
+class Feature_Store:
+    def __init__(self, root):
+        """on-disk store of stock data split up by price var and by year, so only what's needed gets read
+
+        Each price var (eg. 'Adj_Close', 'Intercept_30') gets a folder with one parquet file per year.
+        The files are in long format (Date, Ticker, Value), sorted by ticker then date, with only the
+        days that have data. Filtering on tickers and dates is pushed down to parquet, so row groups
+        that can't match are never read. General columns like ('Dates_Numeric', '') use '' as the ticker.
+
+        Args:
+            root (str): folder the store lives in, made by write() if it doesn't exist yet
+        """
+        self.root = root
+        self.manifest_path = os.path.join(root, 'manifest.json')
+        self.dates_path = os.path.join(root, 'dates.parquet')
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as manifest_file:
+                self.manifest = json.load(manifest_file)
+        else:
+            self.manifest = {'price_vars': {}}
+
+    def __repr__(self):
+        return f"Feature_Store(root='{self.root}', price_vars={len(self.price_vars)})"
+
+    @property
+    def price_vars(self):
+        """list of the price vars in the store eg. ['Adj_Close', 'Dates_Numeric', 'Intercept_5', ...]"""
+        return(list(self.manifest['price_vars']))
+
+    def tickers(self, price_var):
+        """list of the tickers with data for price_var"""
+        return(self.manifest['price_vars'][price_var]['tickers'])
+
+    def dates(self):
+        """every trading day in the store, including days no ticker has data for"""
+        return(pd.DatetimeIndex(pd.read_parquet(self.dates_path)['Date'], name=None))
+
+    def _partition_path(self, price_var, year):
+        return(os.path.join(self.root, price_var, str(year) + '.parquet'))
+
+    def _write_partition(self, price_var, year, wide_slice, row_group_size):
+        """writes one year of one price var (dates x tickers) as a long Date/Ticker/Value file"""
+        # numbers (including nullable ints) are written as floats, anything else (eg. Size_Category) as strings
+        is_numeric = all(pd.api.types.is_numeric_dtype(x) for x in wide_slice.dtypes)
+        values = wide_slice.to_numpy(dtype=np.float64, na_value=np.nan) if is_numeric else wide_slice.to_numpy(dtype=object)
+        if is_numeric:
+            has_data = ~np.isnan(values)
+        else:
+            has_data = pd.notna(values)
+
+        # nonzero on the transpose walks ticker by ticker, so the rows come out sorted by ticker then date
+        ticker_numbers, date_numbers = np.nonzero(has_data.T)
+        long_df = pd.DataFrame({
+            'Date': wide_slice.index.to_numpy()[date_numbers],
+            'Ticker': np.asarray(wide_slice.columns, dtype=object)[ticker_numbers],
+            'Value': values[date_numbers, ticker_numbers],
+        })
+        if not is_numeric:
+            long_df['Value'] = long_df['Value'].astype(str)
+
+        os.makedirs(os.path.join(self.root, price_var), exist_ok=True)
+        long_df.to_parquet(self._partition_path(price_var, year), index=False, row_group_size=row_group_size)
+
+    def _save_manifest(self):
+        with open(self.manifest_path, 'w') as manifest_file:
+            json.dump(self.manifest, manifest_file)
+
+    def write(self, stock_data, row_group_size=50000):
+        """writes a multi-index column stock data frame (eg. the output of combine.ipynb) into the store
+
+        Args:
+            stock_data (dataframe): data with (price var, ticker) columns and a sorted date index
+            row_group_size (int, optional): rows per parquet row group, smaller means finer skipping when filtering by ticker. Defaults to 50000.
+        """
+        os.makedirs(self.root, exist_ok=True)
+        years = stock_data.index.year
+
+        for price_var in stock_data.columns.get_level_values(0).unique():
+            var_data = stock_data.xs(price_var, level=0, axis=1)
+            written_years = []
+            for year in np.unique(years):
+                self._write_partition(price_var, year, var_data.loc[years == year], row_group_size)
+                written_years.append(int(year))
+            self.manifest['price_vars'][price_var] = {'years': written_years, 'tickers': sorted(var_data.columns)}
+
+        pd.DataFrame({'Date': stock_data.index}).to_parquet(self.dates_path, index=False)
+        self._save_manifest()
+
+    def append(self, new_rows, row_group_size=50000):
+        """adds new trading days (eg. from incremental_update.new_feature_rows) by rewriting only the years they fall in
+
+        Args:
+            new_rows (dataframe): rows after the last day in the store, with the same (price var, ticker) column layout
+            row_group_size (int, optional): rows per parquet row group. Defaults to 50000.
+        """
+        dates = self.dates()
+        new_rows = new_rows[new_rows.index > dates[-1]]
+        if new_rows.empty:
+            return
+        all_dates = dates.append(new_rows.index)
+        new_years = np.unique(new_rows.index.year)
+
+        for price_var in new_rows.columns.get_level_values(0).unique():
+            var_rows = new_rows.xs(price_var, level=0, axis=1)
+            if price_var not in self.manifest['price_vars']:
+                self.manifest['price_vars'][price_var] = {'years': [], 'tickers': []}
+            var_info = self.manifest['price_vars'][price_var]
+            for year in new_years:
+                year_rows = var_rows.loc[var_rows.index.year == year]
+                if int(year) in var_info['years']:
+                    stored = self.load([price_var], start_date=None, years=[year]).xs(price_var, level=0, axis=1)
+                    stored = stored[stored.index.year == year]
+                    year_rows = pd.concat([stored, year_rows])
+                else:
+                    var_info['years'].append(int(year))
+                self._write_partition(price_var, year, year_rows, row_group_size)
+            var_info['tickers'] = sorted(set(var_info['tickers']) | set(var_rows.columns))
+
+        pd.DataFrame({'Date': all_dates}).to_parquet(self.dates_path, index=False)
+        self._save_manifest()
+
+    def load(self, price_vars=None, tickers=None, start_date=None, end_date=None, years=None):
+        """reads part of the store back into the usual multi-index column format
+
+        Args:
+            price_vars (list, optional): price vars to read, leave as None for all of them. Defaults to None.
+            tickers (list, optional): tickers to read, leave as None for all of them. General ('') columns are always included. Defaults to None.
+            start_date (str, optional): only days after this date, 'YYYY-MM-DD' (same as select_data_subset). Defaults to None.
+            end_date (str, optional): only days on or before this date, 'YYYY-MM-DD'. Defaults to None.
+            years (list, optional): only read these year partitions. Defaults to None.
+
+        Returns:
+            pandas dataframe: (price var, ticker) columns indexed by every trading day in the date range, in the compact dtypes of stock_data_schema
+        """
+        if price_vars is None:
+            price_vars = self.price_vars
+        dates = self.dates()
+        if start_date is not None:
+            dates = dates[dates > start_date]
+        if end_date is not None:
+            dates = dates[dates <= end_date]
+        if years is not None:
+            dates = dates[dates.year.isin(years)]
+        wanted_years = set(dates.year)
+
+        # pushed down to parquet so row groups without these tickers/dates are skipped
+        filters = []
+        if tickers is not None:
+            filters.append(('Ticker', 'in', list(tickers) + ['']))
+        if start_date is not None:
+            filters.append(('Date', '>', pd.Timestamp(start_date)))
+        if end_date is not None:
+            filters.append(('Date', '<=', pd.Timestamp(end_date)))
+
+        frames = {}
+        for price_var in price_vars:
+            var_years = [year for year in self.manifest['price_vars'][price_var]['years'] if year in wanted_years]
+            parts = [pd.read_parquet(self._partition_path(price_var, year), filters=filters or None) for year in var_years]
+            if parts:
+                long_df = pd.concat(parts, ignore_index=True)
+            else:
+                long_df = pd.DataFrame({'Date': pd.DatetimeIndex([]), 'Ticker': [], 'Value': []})
+
+            var_tickers = self.tickers(price_var)
+            if tickers is not None:
+                var_tickers = [x for x in var_tickers if x in set(tickers) or x == '']
+            frames[price_var] = long_df.pivot(index='Date', columns='Ticker', values='Value').reindex(index=dates, columns=var_tickers)
+
+        if not frames:
+            return(pd.DataFrame(index=dates))
+        return_df = pd.concat(frames, axis=1)
+        return_df.columns.names = [None, None]
+        return(compact_stock_data(return_df))
@@ -0,0 +1,65 @@
+import os
+import sys
+import json
+import subprocess
+
+# seconds a fresh python process may take to import one module, pandas alone is about half of it
+default_budget = 1.0
+# heavy libraries that should only load when the function needing them is called
+heavy_modules = ['quantstats', 'matplotlib', 'seaborn', 'scipy', 'statsmodels', 'patsy']
+
+backtesting_dir = os.path.dirname(os.path.abspath(__file__))
+stock_price_data_dir = os.path.join(backtesting_dir, '..', 'data', 'stock_price_data')
+# (folder, module) pairs checked by default, the modules that pool workers and short jobs import
+default_modules = [(backtesting_dir, module) for module in ['portfolio_core', 'market_data', 'feature_store', 'data_interaction', 'trading_history',
+                                                               'stock_picking', 'trading_classes', 'performance_analytics', 'simulation']] + \
+                  [(stock_price_data_dir, module) for module in ['rolling_regression', 'combine', 'incremental_update', 'new_processing_multiprocess_progress_bar_v3']]
+
+_child_code = """
+import sys, time, json
+start = time.perf_counter()
+import {module}
+print(json.dumps({{'seconds': time.perf_counter() - start, 'modules': sorted(sys.modules)}}))
+"""
+
+
+def time_import(folder, module):
+    """imports module in a new python process started in folder
+
+    Returns:
+        dict: 'seconds' to import it and 'heavy', the heavy_modules it loaded
+    """
+    result = subprocess.run([sys.executable, '-c', _child_code.format(module=module)], cwd=folder, capture_output=True, text=True, check=True)
+    child = json.loads(result.stdout.strip().splitlines()[-1])
+    loaded = set(child['modules'])
+    return({'seconds': child['seconds'], 'heavy': [x for x in heavy_modules if x in loaded]})
+
+
+def check_import_budget(modules=None, budget=default_budget, repeats=3):
+    """times each module's import in a fresh process and checks it against the budget
+
+    Args:
+        modules (list, optional): (folder, module name) pairs. Defaults to default_modules.
+        budget (float, optional): most seconds an import may take. Defaults to default_budget.
+        repeats (int, optional): imports are timed this many times and the fastest is kept, the first one can be slowed by a cold disk. Defaults to 3.
+
+    Returns:
+        list: one (module, seconds, heavy modules loaded, passed) tuple per module
+    """
+    results = []
+    for folder, module in (modules or default_modules):
+        timings = [time_import(folder, module) for _ in range(repeats)]
+        seconds = min(timing['seconds'] for timing in timings)
+        heavy = timings[0]['heavy']
+        results.append((module, seconds, heavy, seconds <= budget and not heavy))
+    return(results)
+
+
+if __name__ == "__main__":
+    # the same check as test_import_budget.py, with the timings printed
+    results = check_import_budget()
+    for module, seconds, heavy, passed in results:
+        print(f"{'ok  ' if passed else 'FAIL'} {module:<45} {seconds:.3f}s" + (f"  loads {', '.join(heavy)}" if heavy else ''))
+    if not all(passed for _, _, _, passed in results):
+        print(f"over the {default_budget}s import budget or loads a heavy module at import time")
+        sys.exit(1)
@@ -0,0 +1,162 @@
+import time
+import contextlib
+import functools
+import importlib
+import tracemalloc
+import pandas as pd
+
+# (module, class or None for a module level function, function name, position of the date argument or None)
+# the date argument marks the start of a new simulated day, so the records can be split up by day
+instrumented_functions = [
+    ('simulation', None, 'trade_day', 1),
+    ('simulation', None, 'pick_schedule', None),
+    ('simulation', None, 'best_over_range', None),
+    ('stock_picking', None, 'best_on_date', None),
+    ('stock_picking', None, 'best_over_range', None),
+    ('stock_picking', 'Stock_Screener', 'mask', None),
+    ('stock_picking', 'Stock_Screener', 'top_codes', None),
+    ('trading_classes', 'Portfolio', 'positions_to_close_with_reasons', None),
+    ('trading_classes', 'Portfolio', 'open_position', None),
+    ('trading_classes', 'Portfolio', 'close_position', None),
+    ('trading_classes', 'Portfolio', 'get_portfolio_value', None),
+    ('trading_classes', 'Portfolio', 'add_value_snapshot', None),
+    ('trading_classes', 'Position', '__refresh__', None),
+    ('trading_history', 'Trading_History', 'enter_position', None),
+    ('trading_history', 'Trading_History', 'exit_position', None),
+    ('trading_history', 'Trading_History', 'add_analytics', None),
+]
+
+enabled = False
+_state = {'day': None, 'track_allocations': False, 'started': None, 'stopped': None, 'originals': []}
+# (day, phase) -> [calls, seconds, seconds not spent in other instrumented calls, net bytes allocated]
+_records = {}
+# time spent in instrumented calls made from inside the call at each level of nesting
+_child_seconds = []
+
+
+def _record(phase, seconds, self_seconds, allocated):
+    record = _records.get((_state['day'], phase))
+    if record is None:
+        record = _records[(_state['day'], phase)] = [0, 0.0, 0.0, 0]
+    record[0] += 1
+    record[1] += seconds
+    record[2] += self_seconds
+    record[3] += allocated
+
+
+def _wrap(function, phase, day_arg):
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if day_arg is not None:
+            _state['day'] = kwargs['date'] if 'date' in kwargs else args[day_arg]
+        start_bytes = tracemalloc.get_traced_memory()[0] if _state['track_allocations'] else 0
+        _child_seconds.append(0.0)
+        start = time.perf_counter()
+        try:
+            return(function(*args, **kwargs))
+        finally:
+            seconds = time.perf_counter() - start
+            self_seconds = seconds - _child_seconds.pop()
+            if _child_seconds:
+                _child_seconds[-1] += seconds
+            allocated = tracemalloc.get_traced_memory()[0] - start_bytes if _state['track_allocations'] else 0
+            _record(phase, seconds, self_seconds, allocated)
+    return(wrapper)
+
+
+def enable(track_allocations=False):
+    """starts recording calls to the instrumented_functions
+
+    The functions are swapped for timing wrappers here and put back by disable(), so nothing is
+    added to the backtest while instrumentation is off. Only affects the current process, pool
+    workers need to call it themselves.
+
+    Args:
+        track_allocations (bool, optional): also record the net bytes allocated by each phase using tracemalloc, this slows the run down a lot. Defaults to False.
+    """
+    global enabled
+    if enabled:
+        return
+    for module_name, class_name, function_name, day_arg in instrumented_functions:
+        module = importlib.import_module(module_name)
+        owner = getattr(module, class_name) if class_name else module
+        original = owner.__dict__[function_name] if class_name else getattr(module, function_name)
+        phase = (class_name or module_name) + '.' + function_name
+        setattr(owner, function_name, _wrap(original, phase, day_arg))
+        _state['originals'].append((owner, function_name, original))
+
+    _state['track_allocations'] = track_allocations
+    if track_allocations and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    if _state['started'] is None:
+        _state['started'] = time.perf_counter()
+    _state['stopped'] = None
+    enabled = True
+
+
+def disable():
+    """puts the original functions back, the records are kept until reset()"""
+    global enabled
+    for owner, function_name, original in reversed(_state['originals']):
+        setattr(owner, function_name, original)
+    _state['originals'] = []
+    if _state['track_allocations'] and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    _state['track_allocations'] = False
+    _state['stopped'] = time.perf_counter()
+    enabled = False
+
+
+def reset():
+    """forgets everything recorded so far"""
+    _records.clear()
+    _state['day'] = None
+    _state['started'] = time.perf_counter() if enabled else None
+    _state['stopped'] = None
+
+
+def set_day(date):
+    """marks the start of a simulated day, for loops that don't go through simulation.trade_day"""
+    _state['day'] = date
+
+
+def day_table():
+    """dataframe of the records for each simulated day and phase: Calls, Seconds, Self_Seconds and Bytes, indexed by (Date, Phase)"""
+    return_df = pd.DataFrame([[day, phase] + record for (day, phase), record in _records.items()],
+                             columns=['Date', 'Phase', 'Calls', 'Seconds', 'Self_Seconds', 'Bytes'])
+    return(return_df.set_index(['Date', 'Phase']).sort_index())
+
+
+def summary():
+    """dataframe with one row per phase over the whole run
+
+    Seconds includes time spent in instrumented calls made from inside the phase (eg. open_position
+    inside trade_day), Self_Seconds doesn't, so Self_Seconds adds up to the instrumented time.
+    Share is Self_Seconds as a fraction of the time between enable() and disable() (or now).
+    """
+    per_day = day_table()
+    return_df = per_day.groupby(level='Phase').sum()
+    return_df['Mean_ms'] = return_df['Seconds'] / return_df['Calls'] * 1000
+    run_seconds = (_state['stopped'] or time.perf_counter()) - _state['started'] if _state['started'] is not None else float('nan')
+    return_df['Share'] = return_df['Self_Seconds'] / run_seconds
+    return_df['Days'] = per_day.reset_index().groupby('Phase')['Date'].nunique()
+    return(return_df[['Calls', 'Days', 'Seconds', 'Self_Seconds', 'Mean_ms', 'Share', 'Bytes']].sort_values('Self_Seconds', ascending=False))
+
+
+@contextlib.contextmanager
+def instrumented(track_allocations=False, print_summary=True):
+    """with instrumentation.instrumented(): ... records everything run inside the block and prints the summary at the end
+
+    Args:
+        track_allocations (bool, optional): see enable(). Defaults to False.
+        print_summary (bool, optional): print summary() when the block ends, it can still be got from summary() after. Defaults to True.
+    """
+    reset()
+    enable(track_allocations=track_allocations)
+    try:
+        yield
+    finally:
+        disable()
+        if print_summary:
+            with pd.option_context('display.max_columns', None, 'display.width', 200):
+                print(summary())
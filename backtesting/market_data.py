@@ -0,0 +1,208 @@
+from multiprocessing import shared_memory
+import pandas as pd
+import numpy as np
+
+# size categories in the order of their integer codes, -1 is used for missing data
+size_category_names = ['mega', 'large', 'mid', 'small', 'micro']
+
+
+class Market_Data:
+    def __init__(self, stock_data, variables=None):
+        """dense date x ticker arrays of stock data with integer indexing, built once and shared
+
+        stock_data.at[date, (var, ticker)] on the wide multi-index frame hashes two column levels
+        every call. This keeps each price var as a contiguous float array (dates x tickers) and
+        Size_Category as int8 codes, plus date -> row and ticker -> column maps, so a lookup is a
+        dict hit and an array index. Pass one Market_Data to every Portfolio that uses the same data.
+
+        Args:
+            stock_data (dataframe): stock data with (price var, ticker) columns, must have Adj_Close
+            variables (list, optional): price vars to build arrays for now, eg. ['Adj_Close', 'Theo_30', 'Std_Dev_30', 'Price_Diff_30', 'Market_Cap'].
+                Others are built the first time they're used. Defaults to None.
+        """
+        self.stock_data = stock_data
+        self._set_calendar(stock_data.index, list(stock_data.xs('Adj_Close', axis=1, level=0).columns))
+        self.price_vars = set(stock_data.columns.get_level_values(0))
+        self._arrays = {}
+        self._size_category_codes = None
+        self._shared_handles = []
+
+        for var in (variables or []):
+            if var == 'Size_Category':
+                self.size_category_codes()
+            else:
+                self.array(var)
+
+    def _set_calendar(self, dates, tickers):
+        self.dates = dates
+        self.tickers = tickers
+        self.date_rows = {date: row for row, date in enumerate(self.dates)}
+        self.ticker_cols = {ticker: col for col, ticker in enumerate(self.tickers)}
+        # calendar days since 1970-01-01 for each row, for working out how long positions are held
+        self.day_numbers = self.dates.values.astype('datetime64[D]').astype(np.int64)
+
+    def share(self, variables):
+        """copies arrays into shared memory once so pool workers can attach to them instead of each getting a copy
+
+        Args:
+            variables (list): price vars to share, 'Size_Category' shares the codes
+
+        Returns:
+            tuple: (handles, spec) the spec is a small picklable dict for Market_Data.attach in the workers.
+                Call release_shared(handles) when the pool is done
+        """
+        # every array is built before any shared memory is made, so a missing var (eg. a typo in a config) can't leave segments behind
+        arrays = {var: self.size_category_codes() if var == 'Size_Category' else self.array(var) for var in variables}
+        handles = []
+        spec = {'dates': self.dates.values, 'tickers': list(self.tickers), 'arrays': {}}
+        try:
+            for var, array in arrays.items():
+                shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+                handles.append(shm)
+                np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+                spec['arrays'][var] = {'name': shm.name, 'shape': array.shape, 'dtype': array.dtype.str}
+        except BaseException:
+            self.release_shared(handles)
+            raise
+        return(handles, spec)
+
+    @classmethod
+    def attach(cls, spec):
+        """read only Market_Data over the arrays shared by share(), without a stock_data dataframe. Only the shared vars are available"""
+        market_data = cls.__new__(cls)
+        market_data.stock_data = None
+        market_data._set_calendar(pd.DatetimeIndex(spec['dates']), spec['tickers'])
+        market_data.price_vars = set(spec['arrays'])
+        market_data._arrays = {}
+        market_data._size_category_codes = None
+        market_data._shared_handles = []
+        for var, array_spec in spec['arrays'].items():
+            shm = shared_memory.SharedMemory(name=array_spec['name'])
+            array = np.ndarray(array_spec['shape'], dtype=np.dtype(array_spec['dtype']), buffer=shm.buf)
+            array.flags.writeable = False
+            market_data._shared_handles.append(shm)
+            if var == 'Size_Category':
+                market_data._size_category_codes = array
+            else:
+                market_data._arrays[var] = array
+        return(market_data)
+
+    @classmethod
+    def from_row(cls, stock_data, date, variables):
+        """Market_Data of just one date and the given price vars, read straight from that row of stock_data
+
+        For looking at a single date (eg. best_on_date without a screener) without building dates x tickers
+        arrays of the whole frame. Raises KeyError if the date or one of the vars isn't in the data.
+        """
+        row = stock_data.index.get_loc(pd.Timestamp(date))
+        # a one row view, taking the columns out of it doesn't copy them for every date
+        day = stock_data.iloc[row:row+1]
+        var_levels, ticker_levels = stock_data.columns.levels[0], stock_data.columns.levels[1]
+        var_codes, ticker_codes = stock_data.columns.codes[0], stock_data.columns.codes[1]
+        adj_close_positions = np.flatnonzero(var_codes == var_levels.get_loc('Adj_Close'))
+        # ticker level code -> market data column, -1 for tickers without Adj_Close
+        col_of_ticker_code = np.full(len(ticker_levels), -1, dtype=np.int64)
+        col_of_ticker_code[ticker_codes[adj_close_positions]] = np.arange(len(adj_close_positions))
+        tickers = list(ticker_levels[ticker_codes[adj_close_positions]])
+
+        market_data = cls.__new__(cls)
+        market_data.stock_data = None
+        market_data._set_calendar(stock_data.index[[row]], tickers)
+        market_data.price_vars = set(variables)
+        market_data._arrays = {}
+        market_data._size_category_codes = None
+        market_data._shared_handles = []
+        for var in variables:
+            positions = np.flatnonzero(var_codes == var_levels.get_loc(var))
+            if len(positions) == 0:
+                raise KeyError(var)
+            cols = col_of_ticker_code[ticker_codes[positions]]
+            found = cols >= 0
+            values = day.iloc[0, positions[found]]
+            if var == 'Size_Category':
+                codes = np.full((1, len(tickers)), -1, dtype=np.int8)
+                codes[0, cols[found]] = pd.Categorical(values.to_numpy(dtype=object), categories=size_category_names).codes
+                market_data._size_category_codes = codes
+            else:
+                array = np.full((1, len(tickers)), np.nan)
+                array[0, cols[found]] = values.to_numpy(dtype=np.float64, na_value=np.nan)
+                market_data._arrays[var] = array
+        return(market_data)
+
+    @staticmethod
+    def release_shared(handles):
+        """frees the shared memory made by share()"""
+        for shm in handles:
+            shm.close()
+            shm.unlink()
+
+    def __repr__(self):
+        return f"Market_Data(dates={len(self.dates)}, tickers={len(self.tickers)}, arrays={sorted(self._arrays)})"
+
+    def row(self, date):
+        """row number of a date, raises KeyError if it isn't a trading day in the data"""
+        try:
+            return(self.date_rows[date])
+        except (KeyError, TypeError):
+            return(self.date_rows[pd.Timestamp(date)])
+
+    def col(self, ticker):
+        """column number of a ticker, raises KeyError if it isn't in the data"""
+        return(self.ticker_cols[ticker])
+
+    def array(self, var):
+        """dates x tickers float array of a price var, built and kept the first time it's asked for"""
+        if var not in self._arrays:
+            if self.stock_data is None:
+                raise KeyError(var)
+            var_data = self.stock_data.xs(var, axis=1, level=0).reindex(columns=self.tickers)
+            self._arrays[var] = np.ascontiguousarray(var_data.to_numpy(dtype=np.float64, na_value=np.nan))
+        return(self._arrays[var])
+
+    def size_category_codes(self):
+        """dates x tickers int8 array of Size_Category codes, see size_category_names. -1 where there's no data"""
+        if self._size_category_codes is None:
+            if self.stock_data is None:
+                raise KeyError('Size_Category')
+            var_data = self.stock_data.xs('Size_Category', axis=1, level=0).reindex(columns=self.tickers)
+            if all(isinstance(x, pd.CategoricalDtype) and list(x.categories) == size_category_names for x in var_data.dtypes):
+                # compact layout, the columns already hold the codes
+                codes = np.column_stack([var_data[col].cat.codes.to_numpy() for col in var_data.columns]) if len(var_data.columns) else np.empty(var_data.shape)
+            else:
+                codes = pd.Categorical(var_data.to_numpy(dtype=object).ravel(), categories=size_category_names).codes.reshape(var_data.shape)
+            self._size_category_codes = np.ascontiguousarray(codes.astype(np.int8))
+        return(self._size_category_codes)
+
+    def value(self, var, date, ticker):
+        """one value of a price var, same as stock_data.at[date, (var, ticker)] but raises KeyError for unknown dates, tickers or vars"""
+        if var not in self.price_vars:
+            raise KeyError((var, ticker))
+        if var == 'Size_Category':
+            code = self.size_category_codes()[self.row(date), self.col(ticker)]
+            return(size_category_names[code] if code >= 0 else np.nan)
+        return(self.array(var)[self.row(date), self.col(ticker)])
+
+    def gather(self, var, dates, tickers):
+        """values of a price var for many (date, ticker) pairs at once, NaN where the date, ticker or data is missing
+
+        Args:
+            var (str): price var eg. 'Market_Cap'. 'Size_Category' gives category names
+            dates (array like): dates, same length as tickers
+            tickers (array like): tickers
+        """
+        rows = self.dates.get_indexer(pd.DatetimeIndex(dates))
+        cols = pd.Index(self.tickers).get_indexer(tickers)
+        found = (rows >= 0) & (cols >= 0)
+        if var == 'Size_Category':
+            codes = np.where(found, self.size_category_codes()[rows, cols], -1)
+            values = np.asarray(size_category_names + [np.nan], dtype=object)[codes]
+        else:
+            values = np.where(found, self.array(var)[rows, cols], np.nan)
+        return(values)
+
+    def get(self, date, column_tuple):
+        """stock_data.at[date, column_tuple] through the arrays, NaN if the date, ticker or var isn't there"""
+        try:
+            return(self.value(column_tuple[0], date, column_tuple[1]))
+        except (KeyError, IndexError, ValueError):
+            return(np.nan)
@@ -1,5 +1,163 @@
 import pandas as pd
-import quantstats as qs
+import numpy as np
+
+# names of the columns made by make_stats_dataframe, in order. The first three are percentages
+stats_column_names = ["Annualized Return (CAGR)", "Volatility (Standard Deviation)", "Max Drawdown", "Alpha", "Beta", "Sharpe Ratio", "Sortino Ratio"]
+# names of the columns made by returns_stats, in the same order
+returns_stat_names = ['CAGR', 'Volatility', 'Max_Drawdown', 'Alpha', 'Beta', 'Sharpe', 'Sortino']
+
+
+def _clean_returns(returns):
+    """returns as a float dataframe with inf turned into NaN, a series becomes one column"""
+    if isinstance(returns, pd.Series):
+        returns = returns.to_frame(returns.name if returns.name is not None else 'portfolio')
+    return(returns.astype('float64').replace([np.inf, -np.inf], np.nan))
+
+
+def _paired_benchmark(returns, benchmark_returns):
+    """benchmark lined up with every column of returns, NaN on the days either one is missing, and the returns with the same days blanked out"""
+    if isinstance(benchmark_returns, pd.DataFrame):
+        benchmark_returns = benchmark_returns.iloc[:, 0]
+    benchmark = benchmark_returns.astype('float64').replace([np.inf, -np.inf], np.nan).reindex(returns.index).to_numpy()
+    values = returns.to_numpy()
+    paired = ~np.isnan(values) & ~np.isnan(benchmark)[:, None]
+    return(np.where(paired, values, np.nan), np.where(paired, benchmark[:, None], np.nan))
+
+
+def returns_stats(returns, benchmark_returns=None, periods=252):
+    """CAGR, volatility, max drawdown, alpha, beta, sharpe and sortino for every column of a returns dataframe at once
+
+    Same definitions as the quantstats functions make_stats_dataframe used to call, worked out with
+    numpy over the whole matrix instead of one column and one stat at a time. Missing days are skipped
+    in each column like the old .dropna() per column, and alpha/beta use the days both the column and
+    the benchmark have data for.
+
+    Args:
+        returns (dataframe): dates x portfolios of day-to-day returns as decimals, a series is treated as one column
+        benchmark_returns (series, optional): day-to-day returns of the benchmark, alpha and beta are NaN without it. Defaults to None.
+        periods (int, optional): trading days in a year. Defaults to 252.
+
+    Returns:
+        dataframe: one row per column of returns, columns are returns_stat_names. Values are decimals (not percentages)
+    """
+    returns = _clean_returns(returns)
+    values = returns.to_numpy()
+    observed = ~np.isnan(values)
+    count = observed.sum(axis=0)
+    filled = np.where(observed, values, 0.0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = filled.sum(axis=0) / count
+        std = np.sqrt((np.where(observed, values - mean, 0.0) ** 2).sum(axis=0) / (count - 1))
+        downside = np.sqrt((np.minimum(filled, 0) ** 2).sum(axis=0) / count)
+
+        # wealth starts at 1 the day before the first return, so a loss on the first day counts as a drawdown
+        wealth = np.cumprod(1 + filled, axis=0)
+        peak = np.maximum(np.maximum.accumulate(wealth, axis=0), 1)
+        max_drawdown = np.where(count > 0, (wealth / peak).min(axis=0, initial=np.inf) - 1, 0.0)
+        total = wealth[-1] if len(wealth) else np.ones(values.shape[1])
+        cagr = np.where(total < 0, np.nan, np.abs(total) ** (periods / count) - 1)
+
+        stats = {
+            'CAGR': cagr,
+            'Volatility': std * np.sqrt(periods),
+            'Max_Drawdown': max_drawdown,
+            'Alpha': np.full(values.shape[1], np.nan),
+            'Beta': np.full(values.shape[1], np.nan),
+            'Sharpe': np.where(std > 0, mean / std, np.nan) * np.sqrt(periods),
+            'Sortino': np.where(downside > 0, mean / downside, np.nan) * np.sqrt(periods),
+        }
+
+        if benchmark_returns is not None:
+            paired_values, paired_benchmark = _paired_benchmark(returns, benchmark_returns)
+            pairs = (~np.isnan(paired_values)).sum(axis=0)
+            mean_values = np.nansum(paired_values, axis=0) / pairs
+            mean_benchmark = np.nansum(paired_benchmark, axis=0) / pairs
+            covariance = np.nansum((paired_values - mean_values) * (paired_benchmark - mean_benchmark), axis=0) / (pairs - 1)
+            benchmark_variance = np.nansum((paired_benchmark - mean_benchmark) ** 2, axis=0) / (pairs - 1)
+            beta = np.where(benchmark_variance != 0, covariance / benchmark_variance, np.nan)
+            # quantstats.stats.greeks fills undefined alpha and beta with 0
+            stats['Beta'] = np.nan_to_num(beta, nan=0.0)
+            stats['Alpha'] = np.nan_to_num((mean_values - beta * mean_benchmark) * periods, nan=0.0)
+
+    return(pd.DataFrame(stats, index=returns.columns, columns=returns_stat_names))
+
+
+def _windows(frame, window, min_periods):
+    if window is None:
+        return(frame.expanding(min_periods=min_periods))
+    return(frame.rolling(window, min_periods=min_periods))
+
+
+def window_stats(returns, window=252, benchmark_returns=None, periods=252, min_periods=None):
+    """rolling (or expanding) versions of the returns_stats stats for every column of a returns dataframe at once
+
+    Each stat is one pandas rolling/expanding pass over the whole dataframe, eg. 252 day sharpe and
+    drawdown for 500 portfolios is a handful of passes, not 500 x days quantstats calls.
+
+    Args:
+        returns (dataframe): dates x portfolios of day-to-day returns as decimals
+        window (int, optional): number of days in each window, None for expanding windows from the first day. Defaults to 252.
+        benchmark_returns (series, optional): day-to-day returns of the benchmark, needed for Alpha and Beta. Defaults to None.
+        periods (int, optional): trading days in a year. Defaults to 252.
+        min_periods (int, optional): fewest days with data a window needs, NaN before that. Defaults to window (2 for expanding).
+
+    Returns:
+        dict: {stat name: dates x portfolios dataframe} with CAGR, Volatility, Sharpe, Sortino and Drawdown (from the highest
+            value in the window, including the value the day before it starts), plus Alpha and Beta with a benchmark and
+            Max_Drawdown for expanding windows. Alpha and Beta are left NaN where they're undefined
+    """
+    returns = _clean_returns(returns)
+    if min_periods is None:
+        min_periods = 2 if window is None else window
+
+    windows = _windows(returns, window, min_periods)
+    count = windows.count()
+    mean = windows.mean()
+    std = windows.std()
+    downside = np.sqrt(_windows(returns.clip(upper=0) ** 2, window, min_periods).sum() / count)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # compounded growth over the window from summed log returns, NaN once a window holds a loss of 100% or more
+        log_growth = _windows(np.log1p(returns.where(returns > -1)), window, min_periods).sum()
+    stats = {
+        'CAGR': np.exp(log_growth * periods / count) - 1,
+        'Volatility': std * np.sqrt(periods),
+        'Sharpe': mean / std.where(std > 0) * np.sqrt(periods),
+        'Sortino': mean / downside.where(downside > 0) * np.sqrt(periods),
+    }
+
+    # a row of 1s for the starting value, so the peak of a window includes the value before its first day
+    wealth = (1 + returns.fillna(0)).cumprod()
+    with_start = pd.concat([pd.DataFrame(1.0, index=[None], columns=returns.columns), wealth])
+    peak = (with_start.cummax() if window is None else with_start.rolling(window + 1, min_periods=1).max()).iloc[1:]
+    peak.index = returns.index
+    stats['Drawdown'] = wealth / peak - 1
+    if window is None:
+        stats['Max_Drawdown'] = stats['Drawdown'].cummin()
+
+    if benchmark_returns is not None:
+        paired_values, paired_benchmark = _paired_benchmark(returns, benchmark_returns)
+        paired_values = pd.DataFrame(paired_values, index=returns.index, columns=returns.columns)
+        paired_benchmark = pd.DataFrame(paired_benchmark, index=returns.index, columns=returns.columns)
+        pairs = _windows(paired_values, window, min_periods).count()
+        mean_values = _windows(paired_values, window, min_periods).mean()
+        mean_benchmark = _windows(paired_benchmark, window, min_periods).mean()
+        # sample covariance and variance from the means of the products
+        covariance = (_windows(paired_values * paired_benchmark, window, min_periods).mean() - mean_values * mean_benchmark) * pairs / (pairs - 1)
+        benchmark_variance = (_windows(paired_benchmark ** 2, window, min_periods).mean() - mean_benchmark ** 2) * pairs / (pairs - 1)
+        stats['Beta'] = covariance / benchmark_variance.where(benchmark_variance > 0)
+        stats['Alpha'] = (mean_values - stats['Beta'] * mean_benchmark) * periods
+
+    return(stats)
+
+
+def _format_stats(stats, decimals):
+    """returns_stats output in the make_stats_dataframe layout: percentages for the first three and rounded"""
+    stats_df = stats.copy()
+    stats_df[['CAGR', 'Volatility', 'Max_Drawdown']] *= 100
+    stats_df.columns = stats_column_names
+    return(stats_df.round(decimals))
+
 
 def make_stats_dataframe(returns, benchmark_returns, portfolio_name="portfolio", decimals=3):
     """Outputs a DataFrame of statistics for a single portfolio.
@@ -13,50 +171,41 @@ def make_stats_dataframe(returns, benchmark_returns, portfolio_name="portfolio",
     Returns:
         pd.DataFrame: DataFrame with a single row of statistics for the portfolio.
     """
-    # Create a dictionary to store the statistics
-    stats = {}
-
-    # Calculate and store statistics
-    stats["Annualized Return (CAGR)"] = round(qs.stats.cagr(returns) * 100, decimals)
-    stats["Volatility (Standard Deviation)"] = round(qs.stats.volatility(returns) * 100, decimals)
-    stats["Max Drawdown"] = round(qs.stats.max_drawdown(returns) * 100, decimals)
-    
-    # Alpha and Beta
-    greeks = qs.stats.greeks(returns, benchmark_returns)
-    stats["Alpha"] = round(greeks['alpha'], decimals)
-    stats["Beta"] = round(greeks['beta'], decimals)
-    
-    # Sharpe and Sortino Ratios
-    stats["Sharpe Ratio"] = round(qs.stats.sharpe(returns), decimals)
-    stats["Sortino Ratio"] = round(qs.stats.sortino(returns), decimals)
-    
-    # Convert the stats dictionary to a DataFrame
-    stats_df = pd.DataFrame(stats, index=[portfolio_name])
-    
-    return stats_df
+    if isinstance(returns, pd.DataFrame):
+        returns = returns.iloc[:, 0]
+    stats = returns_stats(returns.dropna().to_frame(portfolio_name), benchmark_returns.dropna())
+    return(_format_stats(stats, decimals))
 
 
 def make_mulit_stats_dataframe(source_df,benchmark_col_name,portfolio_returns_col_names_list,decimals=3):
-    """uses make_stats_dataframe() to make dataframe with stats on multiple portfolios' performance
+    """dataframe with stats on multiple portfolios' performance, all worked out in one returns_stats call
 
     Args:
-        source_df (datafreame): a dataframe with columns for different portfolios and a benchmark where the values are they day-to-day returns as decimals  
+        source_df (datafreame): a dataframe with columns for different portfolios and a benchmark where the values are they day-to-day returns as decimals
         benchmark_col_name (string): name of the column with benchmark data
         portfolio_returns_col_names_list (list of strings): list of strings of the column names for the portfolio returns
         decimals (int, optional): _description_. Defaults to 3.
     """
-    return_df = make_stats_dataframe(source_df.loc[:,benchmark_col_name].dropna(),
-                                      source_df.loc[:,benchmark_col_name].dropna(),
-                                      portfolio_name=benchmark_col_name)
-    for portfolio_returns_col_name in portfolio_returns_col_names_list:
-        return_df = pd.concat([
-            make_stats_dataframe(
-                source_df.loc[:,portfolio_returns_col_name].dropna(),
-                source_df.loc[:,benchmark_col_name].dropna(),
-                portfolio_name=portfolio_returns_col_name)
-                
-            ,return_df], axis=0)
-    
-        return_df.index.name = 'Portfolio_Name'
-
-    return(return_df)
\ No newline at end of file
+    # same row order as before: the portfolios last to first, then the benchmark
+    columns = list(reversed(portfolio_returns_col_names_list)) + [benchmark_col_name]
+    stats = returns_stats(source_df.loc[:, columns], source_df.loc[:, benchmark_col_name].dropna())
+    return_df = _format_stats(stats, decimals)
+    return_df.index.name = 'Portfolio_Name'
+    return(return_df)
+
+
+def check_stats_parity(returns, benchmark_returns, decimals=3):
+    """compares make_stats_dataframe against the quantstats functions it replaced for one portfolio, needs quantstats installed
+
+    Returns:
+        dataframe: both versions of the stats, one row each
+    """
+    import quantstats as qs
+    returns = returns.dropna()
+    benchmark_returns = benchmark_returns.dropna()
+    greeks = qs.stats.greeks(returns, benchmark_returns)
+    quantstats_stats = pd.DataFrame([[qs.stats.cagr(returns) * 100, qs.stats.volatility(returns) * 100, qs.stats.max_drawdown(returns) * 100,
+                                      greeks['alpha'], greeks['beta'], qs.stats.sharpe(returns), qs.stats.sortino(returns)]],
+                                    index=['quantstats'], columns=stats_column_names).round(decimals)
+    new_stats = make_stats_dataframe(returns, benchmark_returns, portfolio_name='returns_stats', decimals=decimals)
+    return(pd.concat([quantstats_stats, new_stats]))
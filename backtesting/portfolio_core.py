@@ -0,0 +1,176 @@
+import numpy as np
+
+# reason codes returned by Portfolio_Core.exit_signals, exit_reason_names[code] is the readable version
+no_exit = 0
+too_old_exit = 1
+stop_loss_exit = 2
+take_profit_exit = 3
+exit_reason_names = ['none', 'old', 'stop-loss', 'take-profit']
+
+
+class Portfolio_Core:
+    def __init__(self, cash: float, adj_close, day_numbers, capacity=32):
+        """array-backed bookkeeping for the open positions of a portfolio
+
+        Each open position lives in a slot of a set of preallocated numpy arrays. Closed slots go on
+        a free-list and get reused, and the arrays double in size if every slot is taken, so opening
+        and closing positions never reallocates a dataframe.
+
+        Args:
+            cash (float): starting amount of cash in account
+            adj_close (np.ndarray): 2d array (dates x tickers) of share prices
+            day_numbers (np.ndarray): 1d array with the number of calendar days since 1970-01-01 for each row of adj_close
+            capacity (int, optional): number of slots to start with. Defaults to 32.
+        """
+        self.cash = float(cash)
+        self.adj_close = adj_close
+        self.day_numbers = day_numbers
+
+        self.capacity = 0
+        self.ticker_col = np.empty(0, dtype=np.int64)
+        self.shares = np.empty(0)
+        self.cost_basis = np.empty(0)
+        self.open_row = np.empty(0, dtype=np.int64)
+        self.initial_theo = np.empty(0)
+        self.value = np.empty(0)
+        self.high_water_price = np.empty(0)
+        self.high_water_row = np.empty(0, dtype=np.int64)
+        self.low_water_price = np.empty(0)
+        self.low_water_row = np.empty(0, dtype=np.int64)
+        self.open_sequence = np.empty(0, dtype=np.int64)
+        self.active = np.empty(0, dtype=bool)
+        self._free_slots = []
+        self._next_sequence = 0
+        # open slots in the order they were opened and the row they were last marked at, None when out of date
+        self._active_slots = None
+        self._marked_row = None
+        self._grow(capacity)
+
+    def _grow(self, new_capacity):
+        """resizes every slot array to new_capacity and puts the new slots on the free-list"""
+        old_capacity = self.capacity
+        for name in ['ticker_col', 'shares', 'cost_basis', 'open_row', 'initial_theo', 'value', 'high_water_price',
+                     'high_water_row', 'low_water_price', 'low_water_row', 'open_sequence', 'active']:
+            old = getattr(self, name)
+            new = np.zeros(new_capacity, dtype=old.dtype)
+            new[:old_capacity] = old
+            setattr(self, name, new)
+        self.capacity = new_capacity
+        # popped from the end, so the lowest free slot is used first
+        self._free_slots.extend(range(new_capacity - 1, old_capacity - 1, -1))
+
+    def open(self, ticker_col, shares, row, total_cost, initial_theo=np.nan):
+        """takes total_cost out of cash and records the position, returns its slot number
+
+        Args:
+            ticker_col (int): column of the ticker in adj_close
+            shares (float): number of shares bought
+            row (int): row of the opening date in adj_close
+            total_cost (float): cash spent, including trading costs
+            initial_theo (float, optional): theoretical share price on the opening date. Defaults to NaN.
+        """
+        if not self._free_slots:
+            self._grow(max(2 * self.capacity, 1))
+        slot = self._free_slots.pop()
+
+        share_price = self.adj_close[row, ticker_col]
+        self.ticker_col[slot] = ticker_col
+        self.shares[slot] = shares
+        self.cost_basis[slot] = shares * share_price
+        self.open_row[slot] = row
+        self.initial_theo[slot] = initial_theo
+        self.value[slot] = shares * share_price
+        self.high_water_price[slot] = share_price
+        self.high_water_row[slot] = row
+        self.low_water_price[slot] = share_price
+        self.low_water_row[slot] = row
+        self.open_sequence[slot] = self._next_sequence
+        self.active[slot] = True
+        self._next_sequence += 1
+        self._active_slots = None
+        # the new position is already valued at row, so a mark at the same row can still be skipped
+        if row != self._marked_row:
+            self._marked_row = None
+
+        self.cash -= total_cost
+        return(slot)
+
+    def close(self, slot, proceeds):
+        """adds proceeds (sale value after trading costs) to cash and frees the slot"""
+        self.cash += proceeds
+        self.active[slot] = False
+        self._free_slots.append(slot)
+        self._active_slots = None
+
+    def active_slots(self):
+        """slot numbers of the open positions, in the order they were opened"""
+        if self._active_slots is None:
+            slots = np.flatnonzero(self.active)
+            self._active_slots = slots[np.argsort(self.open_sequence[slots], kind='stable')]
+        return(self._active_slots)
+
+    def mark(self, row):
+        """values every open position at the prices on row and updates the high and low water marks
+
+        Returns:
+            np.ndarray: slot numbers of the open positions, in the order they were opened
+        """
+        slots = self.active_slots()
+        if row == self._marked_row:
+            return(slots)
+        share_prices = self.adj_close[row, self.ticker_col[slots]]
+        self.value[slots] = self.shares[slots] * share_prices
+
+        higher = share_prices > self.high_water_price[slots]
+        self.high_water_price[slots[higher]] = share_prices[higher]
+        self.high_water_row[slots[higher]] = row
+
+        lower = share_prices < self.low_water_price[slots]
+        self.low_water_price[slots[lower]] = share_prices[lower]
+        self.low_water_row[slots[lower]] = row
+        self._marked_row = row
+        return(slots)
+
+    def exit_signals(self, row, stop_loss_threshold, take_profit_threshold, too_old):
+        """checks every open position against the exit rules at once using the prices on row
+
+        Args:
+            row (int): row of the current date in adj_close
+            stop_loss_threshold (float): (position's market value / position's cost basis) falls below this, we liquidate
+            take_profit_threshold (float or str): (position's market value / position's cost basis) goes above this, we liquidate.
+                'initial_theo' liquidates once the share price reaches the theoretical price on the opening date
+            too_old (int): positions held this many calendar days are liquidated, -1 turns this off
+
+        Returns:
+            tuple of np.ndarray: (slots to close in the order they were opened, reason code for each). When
+                several rules apply the reason is the first of too old, stop-loss, take-profit
+        """
+        slots = self.mark(row)
+        value_ratio = self.value[slots] / self.cost_basis[slots]
+        reasons = np.full(len(slots), no_exit, dtype=np.int8)
+
+        # lowest priority first so the more important reasons overwrite it
+        if take_profit_threshold == 'initial_theo':
+            share_prices = self.adj_close[row, self.ticker_col[slots]]
+            reasons[share_prices >= self.initial_theo[slots]] = take_profit_exit
+        else:
+            reasons[value_ratio >= take_profit_threshold] = take_profit_exit
+        reasons[value_ratio <= stop_loss_threshold] = stop_loss_exit
+        if too_old != -1:
+            reasons[self.days_old(slots, row) >= too_old] = too_old_exit
+
+        to_close = reasons != no_exit
+        return(slots[to_close], reasons[to_close])
+
+    def days_old(self, slots, row):
+        """calendar days between opening each slot's position and row"""
+        return(self.day_numbers[row] - self.day_numbers[self.open_row[slots]])
+
+    def exposure(self):
+        """value of the open positions as of the last mark"""
+        return(self.value[self.active].sum())
+
+    def total_value(self, row):
+        """cash plus the value of every open position at the prices on row"""
+        slots = self.mark(row)
+        return(self.cash + self.value[slots].sum())
@@ -0,0 +1,378 @@
+import os
+import json
+import pickle
+import hashlib
+import itertools
+import multiprocessing
+import pandas as pd
+import numpy as np
+from market_data import Market_Data
+from data_interaction import Company_Data_Getter
+from stock_picking import Stock_Screener, best_over_range
+from trading_classes import Portfolio
+
+# settings for one simulated portfolio, a sweep's grid overrides any of these
+default_config = {
+    'cash': 100000,
+    'theo_var': 'Theo_30',
+    'std_dev_var': 'Std_Dev_30',
+    'price_diff_var': 'Price_Diff_30',
+    'stop_loss_threshold': .5,
+    'take_profit_threshold': 4,
+    'too_old': 366,
+    # number of tickers picked each day and the fraction of cash put into each new position
+    'how_many': 1,
+    'position_fraction': .1,
+    # best_on_date filters
+    'abs_val': True,
+    'max_or_min': 'max',
+    'extreme_filter_value': 50,
+    'min_trading_volume': 10000,
+    'min_trading_volume_value': 10000,
+    'min_share_price': None,
+    'max_share_price': None,
+    'size_categories': ['mega', 'large', 'mid', 'small', 'micro'],
+    'min_market_cap': 1,
+    'avoid_sectors_filter': [],
+    'avoid_industries_filter': [],
+    'avoid_countries_filter': [],
+    'some_if_not_enough': True,
+}
+
+# config keys that decide the picks, configs that agree on all of them share one pick schedule
+screen_config_keys = ['price_diff_var', 'how_many', 'abs_val', 'max_or_min', 'extreme_filter_value', 'min_trading_volume', 'min_trading_volume_value', 'min_share_price',
+                      'max_share_price', 'size_categories', 'min_market_cap', 'avoid_sectors_filter', 'avoid_industries_filter', 'avoid_countries_filter', 'some_if_not_enough']
+
+# price vars every simulation needs, on top of the theo, std dev and price diff vars of the configs
+base_price_vars = ['Adj_Close', 'Market_Cap', 'Volume', 'Volume_Value', 'Size_Category']
+
+# file in a sweep's checkpoint_dir with the dates and data the checkpoints were run on
+sweep_manifest_file_name = 'sweep.json'
+
+# set in each sweep worker process by _init_sweep_worker
+_worker_state = {}
+
+
+def parameter_grid(grid):
+    """list of configs for every combination of the values in grid
+
+    Args:
+        grid (dict): {config key: list of values to try} eg. {'stop_loss_threshold': [.5, .8], 'too_old': [90, 366]}
+
+    Returns:
+        list: default_config updated with each combination
+    """
+    keys = list(grid)
+    return([dict(default_config, **dict(zip(keys, values))) for values in itertools.product(*[grid[key] for key in keys])])
+
+
+def config_key(config):
+    """short hash that names a config in checkpoints and result tables"""
+    return(hashlib.sha1(json.dumps(config, sort_keys=True, default=str).encode()).hexdigest()[:12])
+
+
+def simulation_dates(market_data, start_date=None, end_date=None):
+    """trading days from start_date to end_date (both included), None for the start or end of the data"""
+    dates = market_data.dates
+    in_range = np.ones(len(dates), dtype=bool)
+    if start_date is not None:
+        in_range &= dates >= pd.Timestamp(start_date)
+    if end_date is not None:
+        in_range &= dates <= pd.Timestamp(end_date)
+    return(dates[in_range])
+
+
+def pick_schedule(screener, config, start_date=None, end_date=None, company_data_getter_obj=None):
+    """best_over_range for a config: date x rank dataframe of ticker codes, -1 for no pick"""
+    schedule, _ = best_over_range(screener.stock_data, start_date, end_date, config['price_diff_var'], abs_val=config['abs_val'], how_many=config['how_many'],
+                                  max_or_min=config['max_or_min'], extreme_filter_value=config['extreme_filter_value'], min_trading_volume=config['min_trading_volume'],
+                                  min_trading_volume_value=config['min_trading_volume_value'], min_share_price=config['min_share_price'], max_share_price=config['max_share_price'],
+                                  size_categories=config['size_categories'], min_market_cap=config['min_market_cap'], avoid_sectors_filter=config['avoid_sectors_filter'],
+                                  avoid_industries_filter=config['avoid_industries_filter'], avoid_countries_filter=config['avoid_countries_filter'],
+                                  company_data_getter_obj=company_data_getter_obj, some_if_not_enough=config['some_if_not_enough'], screener=screener)
+    return(schedule)
+
+
+def day_prices(market_data, date, price_vars):
+    """the row of a trading day and that day's row of each price var's array, to look up once and share between portfolios
+
+    Returns:
+        dict: 'row' the row number of date, and {price var: 1d array over the market data tickers} for Adj_Close and each of price_vars
+    """
+    row = market_data.row(date)
+    day = {'row': row}
+    for var in ['Adj_Close'] + list(price_vars):
+        day[var] = market_data.array(var)[row]
+    return(day)
+
+
+def trade_day(portfolio, date, picks, config, record_value=True, day=None):
+    """one day of the strategy: sell what the exit rules say to, buy today's picks that aren't held yet, then record the value
+
+    Args:
+        portfolio (Portfolio): portfolio to trade
+        date (timestamp): trading day
+        picks (array like): ticker codes (market data columns) picked for today, best first, -1 for no pick
+        config (dict): see default_config
+        record_value (bool, optional): add the day's value to the portfolio's historical_performance. Defaults to True.
+        day (dict, optional): day_prices of date with the config's price_diff_var, looked up here if not given. Defaults to None.
+
+    Returns:
+        float: the portfolio's value at the end of the day if record_value, otherwise None
+    """
+    if day is None:
+        day = day_prices(portfolio.market_data, date, [config['price_diff_var']])
+    portfolio.close_positions(portfolio.positions_to_close(date), date)
+    held = set(portfolio.position_ticker_list())
+    share_prices = day['Adj_Close']
+    indicators = day[config['price_diff_var']]
+    for code in picks:
+        if code < 0:
+            continue
+        ticker = portfolio.market_data.tickers[code]
+        share_price = share_prices[code]
+        if ticker in held or not share_price > 0:
+            continue
+        shares = int(portfolio.get_cash() * config['position_fraction'] / share_price)
+        if shares > 0:
+            portfolio.open_position(date, ticker, shares, indicator=indicators[code])
+            held.add(ticker)
+    if record_value:
+        return(portfolio.add_value_snapshot(date))
+
+
+def run_portfolio(market_data, config, start_date=None, end_date=None, company_data=None, screener=None, trading_history_obj=None, portfolio_name=None, company_data_getter_obj=None):
+    """simulates one portfolio over the trading days from start_date to end_date
+
+    Args:
+        market_data (Market_Data): market data to trade on, eg. Market_Data(stock_data) or one attached to shared memory
+        config (dict): see default_config, missing keys get the default
+        start_date (str, optional): first trading day 'YYYY-MM-DD'. Defaults to None.
+        end_date (str, optional): last trading day 'YYYY-MM-DD'. Defaults to None.
+        company_data (dataframe, optional): data on companies, needed for the sector, industry and country filters. Defaults to None.
+        screener (Stock_Screener, optional): screener over market_data, pass one in to reuse its masks between runs. Defaults to None.
+        trading_history_obj (Trading_History, optional): records the trades if given. Defaults to None.
+        portfolio_name (str, optional): defaults to the config's key.
+        company_data_getter_obj (Company_Data_Getter, optional): made from company_data if not given. Defaults to None.
+
+    Returns:
+        Portfolio: the portfolio at the end of the simulation, its historical_performance has the value on each day
+    """
+    config = dict(default_config, **config)
+    if screener is None:
+        screener = Stock_Screener(market_data.stock_data, market_data=market_data)
+    if company_data_getter_obj is None and company_data is not None:
+        company_data_getter_obj = Company_Data_Getter(company_data, market_data.stock_data, market_data=market_data)
+
+    dates = simulation_dates(market_data, start_date, end_date)
+    schedule = pick_schedule(screener, config, dates[0], dates[-1], company_data_getter_obj=company_data_getter_obj).to_numpy()
+    portfolio = Portfolio(config['cash'], dates[0], market_data.stock_data, config['theo_var'], config['std_dev_var'], config['price_diff_var'], company_data,
+                          stop_loss_threshold=config['stop_loss_threshold'], take_profit_threshold=config['take_profit_threshold'], too_old=config['too_old'],
+                          trading_history_obj=trading_history_obj, portfolio_name=portfolio_name or config_key(config), market_data=market_data)
+    for day, date in enumerate(dates):
+        trade_day(portfolio, date, schedule[day], config)
+    return(portfolio)
+
+
+def run_portfolios_together(market_data, configs, start_date=None, end_date=None, company_data=None, screener=None, portfolio_names=None, trading_history_objs=None, company_data_getter_obj=None):
+    """simulates several portfolios side by side, advancing all of them one day at a time
+
+    The picks are screened once for each distinct set of screen_config_keys and shared by every
+    portfolio using them, all the portfolios trade on the same market data arrays, each day's row of
+    prices is looked up once and handed to every portfolio, and each day's values go straight into
+    one dates x portfolios array.
+
+    Args:
+        market_data (Market_Data): market data to trade on
+        configs (list): configs, see default_config, missing keys get the default
+        start_date (str, optional): first trading day 'YYYY-MM-DD'. Defaults to None.
+        end_date (str, optional): last trading day 'YYYY-MM-DD'. Defaults to None.
+        company_data (dataframe, optional): data on companies, needed for the sector, industry and country filters. Defaults to None.
+        screener (Stock_Screener, optional): screener over market_data. Defaults to None.
+        portfolio_names (list, optional): a name for each config, defaults to the config keys.
+        trading_history_objs (list, optional): a Trading_History (or None) for each config to record its trades in. Defaults to None.
+        company_data_getter_obj (Company_Data_Getter, optional): made from company_data if not given. Defaults to None.
+
+    Returns:
+        tuple: (portfolios, performance) the Portfolio for each config and a dataframe of their values (dates x portfolio names)
+    """
+    configs = [dict(default_config, **config) for config in configs]
+    portfolio_names = portfolio_names or [config_key(config) for config in configs]
+    trading_history_objs = trading_history_objs or [None] * len(configs)
+    if screener is None:
+        screener = Stock_Screener(market_data.stock_data, market_data=market_data)
+    if company_data_getter_obj is None and company_data is not None:
+        company_data_getter_obj = Company_Data_Getter(company_data, market_data.stock_data, market_data=market_data)
+    dates = simulation_dates(market_data, start_date, end_date)
+
+    schedules = {}
+    portfolio_schedules = []
+    for config in configs:
+        screen = json.dumps([config[key] for key in screen_config_keys], default=str)
+        if screen not in schedules:
+            schedules[screen] = pick_schedule(screener, config, dates[0], dates[-1], company_data_getter_obj=company_data_getter_obj).to_numpy()
+        portfolio_schedules.append(schedules[screen])
+
+    portfolios = [Portfolio(config['cash'], dates[0], market_data.stock_data, config['theo_var'], config['std_dev_var'], config['price_diff_var'], company_data,
+                            stop_loss_threshold=config['stop_loss_threshold'], take_profit_threshold=config['take_profit_threshold'], too_old=config['too_old'],
+                            trading_history_obj=trading_history_obj, portfolio_name=portfolio_name, market_data=market_data)
+                  for config, portfolio_name, trading_history_obj in zip(configs, portfolio_names, trading_history_objs)]
+
+    price_diff_vars = list(dict.fromkeys(config['price_diff_var'] for config in configs))
+    values = np.full((len(dates), len(portfolios)), np.nan)
+    for day_number, date in enumerate(dates):
+        day = day_prices(market_data, date, price_diff_vars)
+        for i, portfolio in enumerate(portfolios):
+            values[day_number, i] = trade_day(portfolio, date, portfolio_schedules[i][day_number], configs[i], day=day)
+
+    performance = pd.DataFrame(values, index=pd.Index(dates, name='Date'), columns=portfolio_names)
+    return(portfolios, performance)
+
+
+def _init_sweep_worker(spec, company_data, start_date, end_date):
+    """Pool initializer: attaches to the shared market data once per worker process"""
+    market_data = Market_Data.attach(spec)
+    _worker_state['market_data'] = market_data
+    _worker_state['screener'] = Stock_Screener(None, market_data=market_data)
+    _worker_state['company_data'] = company_data
+    _worker_state['company_data_getter'] = None if company_data is None else Company_Data_Getter(company_data, None, market_data=market_data)
+    _worker_state['dates'] = (start_date, end_date)
+
+
+def _run_config_in_worker(config):
+    """runs one config in a sweep worker, returns (config key, config, value on each day)"""
+    start_date, end_date = _worker_state['dates']
+    portfolio = run_portfolio(_worker_state['market_data'], config, start_date, end_date, company_data=_worker_state['company_data'], screener=_worker_state['screener'],
+                              company_data_getter_obj=_worker_state['company_data_getter'])
+    # masks for other filter settings aren't likely to be reused, don't let them pile up
+    if len(_worker_state['screener']._masks) > 4:
+        _worker_state['screener'].clear_cache()
+    key = config_key(config)
+    return(key, config, portfolio.historical_performance[portfolio.portfolio_name].rename(key))
+
+
+def _stats_for_result(performance, benchmark_returns):
+    """make_stats_dataframe for one portfolio's daily values"""
+    # only loaded when stats are wanted
+    from performance_analytics import make_stats_dataframe
+    returns = performance.astype('float64').pct_change().dropna()
+    return(make_stats_dataframe(returns, benchmark_returns.reindex(returns.index), portfolio_name=performance.name))
+
+
+def _save_checkpoint(checkpoint_dir, key, result):
+    # written to a temporary file first so an interrupted write never leaves a half checkpoint
+    path = os.path.join(checkpoint_dir, key + '.pkl')
+    with open(path + '.tmp', 'wb') as checkpoint_file:
+        pickle.dump(result, checkpoint_file)
+    os.replace(path + '.tmp', path)
+
+
+def _sweep_fingerprint(market_data, start_date, end_date):
+    """what a checkpoint depends on besides its config: the trading days simulated and the data they came from"""
+    dates = simulation_dates(market_data, start_date, end_date)
+    day = lambda date: str(date.date()) if date is not None else None
+    return({'start_date': day(dates[0] if len(dates) else None), 'end_date': day(dates[-1] if len(dates) else None),
+            'n_dates': len(market_data.dates), 'first_date': day(market_data.dates[0]), 'last_date': day(market_data.dates[-1]),
+            'tickers': hashlib.sha1(json.dumps([str(x) for x in market_data.tickers]).encode()).hexdigest()[:12]})
+
+
+def _check_sweep_manifest(checkpoint_dir, fingerprint):
+    """writes the sweep's fingerprint to a new checkpoint_dir, or raises ValueError if the checkpoints already there are from a different sweep"""
+    path = os.path.join(checkpoint_dir, sweep_manifest_file_name)
+    if os.path.exists(path):
+        with open(path) as manifest_file:
+            saved = json.load(manifest_file)
+        if saved != fingerprint:
+            raise ValueError(f"checkpoint_dir {checkpoint_dir} has checkpoints of a sweep on other dates or data ({saved}), not {fingerprint}. Use another folder or empty it")
+        return
+    if any(file_name.endswith('.pkl') for file_name in os.listdir(checkpoint_dir)):
+        raise ValueError(f"checkpoint_dir {checkpoint_dir} has checkpoints without a {sweep_manifest_file_name}, so they can't be checked against this sweep. Use another folder or empty it")
+    with open(path, 'w') as manifest_file:
+        json.dump(fingerprint, manifest_file)
+
+
+def _load_checkpoints(checkpoint_dir):
+    results = {}
+    for file_name in os.listdir(checkpoint_dir):
+        if file_name.endswith('.pkl'):
+            with open(os.path.join(checkpoint_dir, file_name), 'rb') as checkpoint_file:
+                results[file_name[:-len('.pkl')]] = pickle.load(checkpoint_file)
+    return(results)
+
+
+def run_sweep(stock_data, configs, start_date=None, end_date=None, company_data=None, benchmark_returns=None, checkpoint_dir=None, n_processes=None, market_data=None):
+    """runs a portfolio simulation for every config in a process pool and collects the results into one table
+
+    The market data arrays are put in shared memory once and every worker attaches to them read only,
+    so the workers don't each get a copy of stock_data. Each finished config is saved to checkpoint_dir
+    as it comes in, and configs that already have a checkpoint are skipped, so an interrupted sweep
+    picks up where it left off when run again. The checkpoints are only used for the same dates and
+    data: checkpoint_dir keeps the simulated date range and a fingerprint of the data (its dates and
+    tickers) in sweep.json, and resuming with different ones raises a ValueError.
+
+    Args:
+        stock_data (dataframe): stock data with (price var, ticker) columns
+        configs (list or dict): list of configs, or a grid for parameter_grid eg. {'too_old': [90, 366], 'theo_var': ['Theo_30', 'Theo_60']}
+        start_date (str, optional): first trading day 'YYYY-MM-DD'. Defaults to None.
+        end_date (str, optional): last trading day 'YYYY-MM-DD'. Defaults to None.
+        company_data (dataframe, optional): data on companies, needed for the sector, industry and country filters. Defaults to None.
+        benchmark_returns (series, optional): daily benchmark returns indexed by date. If given each config gets make_stats_dataframe stats. Defaults to None.
+        checkpoint_dir (str, optional): folder to save finished configs in, one per sweep. Defaults to None (no checkpoints).
+        n_processes (int, optional): worker processes, 1 runs everything in this process. Defaults to None (every core).
+        market_data (Market_Data, optional): Market_Data of stock_data if there already is one. Defaults to None.
+
+    Returns:
+        tuple: (results, performance). results has a row per config key with the config and its stats,
+            performance has the value of every config's portfolio on each day (dates x config keys)
+    """
+    if isinstance(configs, dict):
+        configs = parameter_grid(configs)
+    configs = [dict(default_config, **config) for config in configs]
+    if market_data is None:
+        market_data = Market_Data(stock_data)
+
+    results = {}
+    if checkpoint_dir is not None:
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        _check_sweep_manifest(checkpoint_dir, _sweep_fingerprint(market_data, start_date, end_date))
+        results = _load_checkpoints(checkpoint_dir)
+    to_run = [config for config in configs if config_key(config) not in results]
+
+    # checkpoints saved by a run without benchmark_returns have no stats, they're worked out now and saved again
+    if benchmark_returns is not None:
+        for key in {config_key(config) for config in configs} - {config_key(config) for config in to_run}:
+            if results[key].get('stats') is None:
+                results[key]['stats'] = _stats_for_result(results[key]['historical_performance'], benchmark_returns)
+                if checkpoint_dir is not None:
+                    _save_checkpoint(checkpoint_dir, key, results[key])
+
+    def collect(key, config, performance):
+        stats = _stats_for_result(performance, benchmark_returns) if benchmark_returns is not None else None
+        results[key] = {'config': config, 'historical_performance': performance, 'stats': stats}
+        if checkpoint_dir is not None:
+            _save_checkpoint(checkpoint_dir, key, results[key])
+
+    if to_run:
+        price_vars = set(base_price_vars)
+        for config in to_run:
+            price_vars.update([config['theo_var'], config['std_dev_var'], config['price_diff_var']])
+        handles, spec = market_data.share(sorted(price_vars))
+        try:
+            if n_processes == 1:
+                _init_sweep_worker(spec, company_data, start_date, end_date)
+                for config in to_run:
+                    collect(*_run_config_in_worker(config))
+            else:
+                with multiprocessing.Pool(n_processes, initializer=_init_sweep_worker, initargs=(spec, company_data, start_date, end_date)) as pool:
+                    for key, config, performance in pool.imap_unordered(_run_config_in_worker, to_run):
+                        collect(key, config, performance)
+        finally:
+            _worker_state.clear()
+            Market_Data.release_shared(handles)
+
+    keys = [config_key(config) for config in configs]
+    results_table = pd.DataFrame([{key: str(value) if isinstance(value, list) else value for key, value in results[x]['config'].items()} for x in keys], index=pd.Index(keys, name='Config_Key'))
+    if benchmark_returns is not None:
+        results_table = results_table.join(pd.concat([results[x]['stats'] for x in keys]))
+    performance = pd.concat([results[x]['historical_performance'] for x in keys], axis=1)
+    return(results_table, performance)
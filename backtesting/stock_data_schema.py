@@ -0,0 +1,114 @@
+import numpy as np
+import pandas as pd
+from market_data import size_category_names
+
+# Compact layout of the processed stock data (the output of combine.ipynb and what the loaders return)
+#
+#   price var                                   dtype                       notes
+#   Size_Category                               category (int8 codes)       categories in size_category_names order, NaN where there's no market cap
+#   Volume                                      Int64 (nullable integer)    split adjusted volumes go past the uint32 range
+#   ('Dates_Numeric', '')                       int32                       days since 2000-01-01, no missing values
+#   everything else (Adj_Close, Market_Cap,     float32                     about 7 significant figures, prices and regression
+#   Volume_Value, Intercept_N, Std_Dev_N,                                   features are nowhere near needing more. Market_Data
+#   <coefficient>_Coeff_N, Theo_N, ...)                                     still does its arithmetic in float64
+#
+# Compared to float64 and object strings this is a bit under half the memory of the full universe.
+size_category_dtype = pd.CategoricalDtype(size_category_names)
+special_price_var_dtypes = {
+    'Size_Category': size_category_dtype,
+    'Volume': pd.Int64Dtype(),
+    'Dates_Numeric': np.dtype('int32'),
+}
+default_float_dtype = np.dtype('float32')
+
+
+def price_var_dtype(price_var, ticker='x'):
+    """dtype of a (price var, ticker) column in the compact layout. Regression coefficient columns named after a general column (eg. Dates_Numeric_Coeff_5) are floats"""
+    if price_var == 'Dates_Numeric' and ticker != '':
+        return(default_float_dtype)
+    return(special_price_var_dtypes.get(price_var, default_float_dtype))
+
+
+def _to_dtype(var_data, dtype):
+    """one price var's columns (dates x tickers) converted to dtype, strings that aren't numbers become NaN like pd.to_numeric(errors='coerce')"""
+    if isinstance(dtype, pd.CategoricalDtype):
+        values = var_data.to_numpy(dtype=object)
+        codes = pd.Categorical(values.ravel(), dtype=dtype).codes.reshape(values.shape)
+        return(pd.DataFrame({col: pd.Categorical.from_codes(codes[:, i], dtype=dtype) for i, col in enumerate(var_data.columns)}, index=var_data.index))
+    if any(x == object for x in var_data.dtypes):
+        var_data = var_data.apply(pd.to_numeric, errors='coerce')
+    if pd.api.types.is_extension_array_dtype(dtype):
+        # nullable ints: floats are rounded first, astype refuses values like 1234.0000001
+        return(var_data.astype('float64').round().astype(dtype))
+    if dtype.kind == 'f':
+        return(pd.DataFrame(var_data.to_numpy(dtype=dtype, na_value=np.nan), index=var_data.index, columns=var_data.columns))
+    return(var_data.astype(dtype))
+
+
+def _convert_columns(stock_data, positions, wanted):
+    """stock_data with the columns at positions converted to their wanted dtypes, the rest untouched and in the same order"""
+    # converted one price var at a time so each one is a single block
+    price_vars = stock_data.columns.get_level_values(0)
+    groups = {}
+    for i in positions:
+        groups.setdefault((price_vars[i], str(wanted[i])), []).append(i)
+    to_convert = set(positions)
+    kept = [i for i in range(stock_data.shape[1]) if i not in to_convert]
+    pieces = [stock_data.iloc[:, kept]] if kept else []
+    order = list(kept)
+    for group_positions in groups.values():
+        part = _to_dtype(stock_data.iloc[:, group_positions], wanted[group_positions[0]])
+        pieces.append(part.set_axis(stock_data.columns[group_positions], axis=1))
+        order += group_positions
+
+    # back in the original column order
+    return(pd.concat(pieces, axis=1).iloc[:, np.argsort(order, kind='stable')])
+
+
+def compact_stock_data(stock_data):
+    """converts stock data with (price var, ticker) columns to the compact layout at the top of this file
+
+    Price vars that already have the right dtype are left alone (no copy), so it's cheap to call on
+    data that's already compact. Column order is kept.
+
+    Args:
+        stock_data (dataframe): stock data, eg. read from an older float64/object pickle or parquet
+
+    Returns:
+        dataframe: the same data in the compact dtypes
+    """
+    if stock_data.shape[1] == 0:
+        return(stock_data)
+    dtypes = stock_data.dtypes.to_numpy()
+    wanted = [price_var_dtype(price_var, ticker) for price_var, ticker in zip(stock_data.columns.get_level_values(0), stock_data.columns.get_level_values(1))]
+    to_convert = [i for i in range(len(wanted)) if dtypes[i] != wanted[i]]
+    if not to_convert:
+        return(stock_data)
+    return(_convert_columns(stock_data, to_convert, wanted))
+
+
+def numeric_stock_data(stock_data):
+    """makes the number columns of stock data that came in as objects (eg. strings in an older file) float64, without touching any other column
+
+    Strings that aren't numbers become NaN. Size_Category is left as it is and numeric columns keep their
+    dtype (float64 stays float64). If nothing needs converting stock_data itself is returned.
+    """
+    dtypes = stock_data.dtypes.to_numpy()
+    price_vars = stock_data.columns.get_level_values(0)
+    to_convert = [i for i in range(len(dtypes)) if dtypes[i] == object and price_vars[i] != 'Size_Category']
+    if not to_convert:
+        return(stock_data)
+    return(_convert_columns(stock_data, to_convert, [np.dtype('float64')] * len(dtypes)))
+
+
+def schema_report(stock_data):
+    """dataframe with one row per price var: its dtype(s), the compact dtype, whether they match and the MB it takes up"""
+    memory = stock_data.memory_usage(deep=True, index=False)
+    rows = []
+    for price_var in stock_data.columns.get_level_values(0).unique():
+        var_cols = stock_data.columns.get_level_values(0) == price_var
+        var_dtypes = sorted({str(x) for x in stock_data.dtypes[var_cols]})
+        wanted = sorted({str(price_var_dtype(price_var, ticker)) for ticker in stock_data.columns[var_cols].get_level_values(1)})
+        rows.append({'Price_Var': price_var, 'Dtypes': ', '.join(var_dtypes), 'Compact_Dtype': ', '.join(wanted),
+                     'Compact': var_dtypes == wanted, 'MB': memory[var_cols].sum() / 1e6})
+    return(pd.DataFrame(rows).set_index('Price_Var'))
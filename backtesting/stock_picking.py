@@ -1,8 +1,165 @@
 import pandas as pd
 import warnings
 import numpy as np
+from market_data import Market_Data, size_category_names
 
-def best_on_date(stock_data,date:str,metric:str,date_already_xs_unstack_transposed=False,abs_val:bool=True,how_many:int=1, max_or_min = 'max',extreme_filter_value=50, min_trading_volume=10000, min_trading_volume_value=10000, min_share_price = None, max_share_price = None,size_categories=['mega','large','mid','small','micro'], min_market_cap=1, avoid_sectors_filter=[], avoid_industries_filter=[], avoid_countries_filter=[], company_data_getter_obj=None,some_if_not_enough=True):
+# rows of keys sorted at once by Stock_Screener.top_codes, bounds the memory used for all dates at once
+default_rows_per_block = 512
+
+class Stock_Screener:
+    def __init__(self, stock_data, market_data=None):
+        """picks the best tickers on any date, or every date at once, with the filters of best_on_date
+
+        Each set of filters (volume, volume value, market cap, size category, share price bounds and
+        the extreme value filter) is worked out once for every date as a boolean dates x tickers mask
+        and kept, as are the company data filters (one value per ticker). Picking the top tickers on a
+        date is then a row of the mask and an argpartition of the metric.
+
+        Ties are broken the same way as best_on_date: the ticker that comes first in
+        stock_data.xs(date).unstack() wins, so the columns here are kept in that order.
+
+        Args:
+            stock_data (dataframe): stock data with (price var, ticker) columns. Can be None if market_data is given,
+                ties then go to the ticker that sorts first (the usual unstack order)
+            market_data (Market_Data, optional): arrays of stock_data, eg. the one a Portfolio uses. Defaults to None.
+        """
+        self.stock_data = stock_data
+        self.market_data = market_data if market_data is not None else Market_Data(stock_data)
+        if stock_data is None:
+            unstacked_tickers = pd.Index(sorted(self.market_data.tickers))
+        else:
+            # the columns of stock_data.xs(date).unstack(), without taking a row of the whole frame
+            unstacked_tickers = stock_data.columns.remove_unused_levels().levels[1]
+        # self._order[screener column] = market data column
+        self._order = np.argsort(unstacked_tickers.get_indexer(self.market_data.tickers), kind='stable')
+        self.tickers = np.asarray(self.market_data.tickers, dtype=object)[self._order]
+        self._masks = {}
+        self._ticker_masks = {}
+        self._keys = {}
+
+    def __repr__(self):
+        return f"Stock_Screener(dates={len(self.market_data.dates)}, tickers={len(self.tickers)}, masks={len(self._masks)})"
+
+    def clear_cache(self):
+        """forgets the masks and sort keys kept so far, to free memory"""
+        self._masks = {}
+        self._ticker_masks = {}
+        self._keys = {}
+
+    def _array(self, var):
+        return(self.market_data.array(var)[:, self._order])
+
+    def mask(self, metric, extreme_filter_value=50, min_trading_volume=10000, min_trading_volume_value=10000, min_share_price=None, max_share_price=None,
+             size_categories=['mega','large','mid','small','micro'], min_market_cap=1):
+        """dates x tickers boolean array of the tickers that pass the filters on each date, see best_on_date for the args"""
+        key = (metric, extreme_filter_value, min_trading_volume, min_trading_volume_value, min_share_price, max_share_price, tuple(size_categories), min_market_cap)
+        if key not in self._masks:
+            metric_values = self._array(metric)
+            adj_close = self._array('Adj_Close')
+            # NaN fails every comparison, which drops missing data the same way the dataframe filters do
+            mask = ~np.isnan(adj_close) & ~np.isnan(metric_values)
+            if extreme_filter_value != None:
+                mask &= np.abs(metric_values) < extreme_filter_value
+            if min_share_price != None:
+                mask &= adj_close >= min_share_price
+            if max_share_price != None:
+                mask &= adj_close <= max_share_price
+            mask &= self._array('Market_Cap') > min_market_cap
+            wanted_codes = [size_category_names.index(x) for x in size_categories if x in size_category_names]
+            mask &= np.isin(self.market_data.size_category_codes()[:, self._order], wanted_codes)
+            mask &= self._array('Volume') > min_trading_volume
+            mask &= self._array('Volume_Value') > min_trading_volume_value
+            self._masks[key] = mask
+        return(self._masks[key])
+
+    def ticker_mask(self, avoid_sectors_filter=[], avoid_industries_filter=[], avoid_countries_filter=[], company_data_getter_obj=None):
+        """boolean array of the tickers that pass the sector, industry and country filters. Tickers with missing data for a filter used are dropped"""
+        key = (id(company_data_getter_obj), tuple(avoid_sectors_filter or []), tuple(avoid_industries_filter or []), tuple(avoid_countries_filter or []))
+        if key not in self._ticker_masks:
+            if company_data_getter_obj is None:
+                self._ticker_masks[key] = np.ones(len(self.tickers), dtype=bool)
+            else:
+                self._ticker_masks[key] = company_data_getter_obj.keep_mask(pd.Index(self.tickers), avoid_sectors_filter=avoid_sectors_filter,
+                                                                            avoid_industries_filter=avoid_industries_filter, avoid_countries_filter=avoid_countries_filter)
+        return(self._ticker_masks[key])
+
+    def _sort_keys(self, metric, abs_val, max_or_min):
+        """dates x tickers array that sorts best first (smallest), the metric or its absolute value, negated for 'max'"""
+        key = (metric, abs_val, max_or_min)
+        if key not in self._keys:
+            values = self._array(metric)
+            if abs_val:
+                values = np.abs(values)
+            self._keys[key] = -values if max_or_min == 'max' else values
+        return(self._keys[key])
+
+    def top_codes(self, rows, how_many, metric, abs_val=True, max_or_min='max', rows_per_block=default_rows_per_block, **filters):
+        """the best tickers on each of rows, as market data column numbers
+
+        Args:
+            rows (array like): row numbers of the dates in stock_data
+            how_many (int): number of tickers to pick on each date
+            metric (str): the name of the column to be used for evaluation
+            abs_val (bool, optional): rank on the absolute value of the metric. Defaults to True.
+            max_or_min (str, optional): 'max' or 'min'. Defaults to 'max'.
+            rows_per_block (int, optional): rows ranked at once. Defaults to 512.
+            **filters: any of the filter args of mask and ticker_mask
+
+        Returns:
+            tuple of np.ndarray: (codes, counts). codes is rows x how_many, best first, with -1 where fewer
+                than how_many tickers pass the filters. counts is how many tickers pass on each row
+        """
+        mask_args = {x: filters.pop(x) for x in list(filters) if x not in ('avoid_sectors_filter', 'avoid_industries_filter', 'avoid_countries_filter', 'company_data_getter_obj')}
+        mask = self.mask(metric, **mask_args)
+        ticker_mask = self.ticker_mask(**filters)
+        sort_keys = self._sort_keys(metric, abs_val, max_or_min)
+
+        rows = np.asarray(rows, dtype=np.int64)
+        codes = np.full((len(rows), how_many), -1, dtype=np.int64)
+        counts = np.zeros(len(rows), dtype=np.int64)
+        if how_many <= 0 or len(self.tickers) == 0:
+            return(codes, counts)
+        k = min(how_many, len(self.tickers))
+
+        for start in range(0, len(rows), rows_per_block):
+            block_rows = rows[start:start+rows_per_block]
+            passing = mask[block_rows] & ticker_mask
+            # NaN sorts after everything, including a metric of +/-inf
+            keys = np.where(passing, sort_keys[block_rows], np.nan)
+            counts[start:start+len(block_rows)] = passing.sum(axis=1)
+
+            # unordered best k of each row, then best first with ties going to the lower column
+            top = np.argpartition(keys, k-1, axis=1)[:, :k]
+            top_keys = np.take_along_axis(keys, top, axis=1)
+            kth = top_keys.max(axis=1, keepdims=True)
+            # if a key equal to the kth best was left out, argpartition may not have picked the lowest columns of the tie
+            ambiguous = ~np.isnan(kth[:, 0]) & ((keys == kth).sum(axis=1) > (top_keys == kth).sum(axis=1))
+            for i in np.flatnonzero(ambiguous):
+                top[i] = np.argsort(keys[i], kind='stable')[:k]
+                top_keys[i] = keys[i, top[i]]
+            order = np.lexsort((top, top_keys), axis=1)
+            top = np.take_along_axis(top, order, axis=1)
+            top_keys = np.take_along_axis(top_keys, order, axis=1)
+
+            block_codes = np.where(np.isnan(top_keys), -1, self._order[top])
+            codes[start:start+len(block_rows), :k] = block_codes
+        return(codes, counts)
+
+    def exact_count_order(self, date, codes, metric, abs_val=True, max_or_min='max'):
+        """orders the tickers in codes the way nlargest/nsmallest does when there are exactly as many as asked for
+
+        pandas sorts with an unstable sort in that case, so tied values can come out in a different order
+        than top_codes puts them in. This runs the same pandas call on just the picked tickers.
+        """
+        columns = np.sort(np.argsort(self._order)[codes])
+        values = self.market_data.array(metric)[self.market_data.row(date), self._order[columns]]
+        picked = pd.Series(np.abs(values) if abs_val else values, index=self.tickers[columns])
+        if max_or_min == 'max':
+            return(picked.nlargest(len(picked)).index.tolist())
+        return(picked.nsmallest(len(picked)).index.tolist())
+
+
+def best_on_date(stock_data,date:str,metric:str,date_already_xs_unstack_transposed=False,abs_val:bool=True,how_many:int=1, max_or_min = 'max',extreme_filter_value=50, min_trading_volume=10000, min_trading_volume_value=10000, min_share_price = None, max_share_price = None,size_categories=['mega','large','mid','small','micro'], min_market_cap=1, avoid_sectors_filter=[], avoid_industries_filter=[], avoid_countries_filter=[], company_data_getter_obj=None,some_if_not_enough=True, screener=None):
     """gets the ticker(s) of the best stock or stocks on a specific
     date according to the numerical value of either a specific metric,
     or the absolute value of a specific metric. If there is not enough tickers with data then the
@@ -25,23 +182,41 @@ def best_on_date(stock_data,date:str,metric:str,date_already_xs_unstack_transpos
         avoid_countries_filter (list, optional) list of strings representing any countries to avoid, eg ['Bermuda', 'China']. Defaults to [].
         company_data_getter_obj (obj, optional): pass in company data getter object if you're filtering by something company attributes eg. sector or country. Defaults to None.
         some_if_not_enough (bool, optional) If there are not as many tickers, that fit the criteria, as you want, give all that do. Set to false to give none (empty list) Defaults to True.
+        screener (Stock_Screener, optional): screener made from stock_data to pick with. Pass the same one to every call on the same data so the masks are
+            only built once, make a new one after changing stock_data. Leave as None to screen just this date's row. Defaults to None.
     """
-    
-    
+    if not date_already_xs_unstack_transposed:
+        if screener is None:
+            # only this date's row of the vars the filters use, instead of masks for every date
+            screener = Stock_Screener(stock_data, market_data=Market_Data.from_row(stock_data, date, list(dict.fromkeys([metric, 'Adj_Close', 'Market_Cap', 'Size_Category', 'Volume', 'Volume_Value']))))
+        codes, counts = screener.top_codes([screener.market_data.row(date)], how_many, metric, abs_val=abs_val, max_or_min=max_or_min,
+                                           extreme_filter_value=extreme_filter_value, min_trading_volume=min_trading_volume, min_trading_volume_value=min_trading_volume_value,
+                                           min_share_price=min_share_price, max_share_price=max_share_price, size_categories=size_categories, min_market_cap=min_market_cap,
+                                           avoid_sectors_filter=avoid_sectors_filter, avoid_industries_filter=avoid_industries_filter, avoid_countries_filter=avoid_countries_filter,
+                                           company_data_getter_obj=company_data_getter_obj)
+        if counts[0]<how_many:
+            warningString = f"Warning: not enough data on {date} to run best_on_date. There is only {counts[0]} non-NaN values in {metric} but you want the top {how_many}. Returning {None}"
+            print(warningString)
+            warnings.warn(warningString)
+            if not some_if_not_enough:
+                return([])
+        elif counts[0]==how_many and max_or_min in ['max', 'min']:
+            return(screener.exact_count_order(date, codes[0], metric, abs_val, max_or_min))
+        elif max_or_min in ['max', 'min']:
+            return([screener.market_data.tickers[x] for x in codes[0]])
+        return(None)
 
-    # takes a slice of dataframe for current date with .xs(date)
-    # unstack if because .xs puts it in long format
-    # transpose so tickers are the index column
-    if date_already_xs_unstack_transposed:
-        date_slice = stock_data.copy()
-    else:
-        date_slice = stock_data.xs(date).unstack().transpose()
+    # stock_data is already a slice of the dataframe for the current date, .xs(date).unstack().transpose()
+    # so the tickers are the index column
+    date_slice = stock_data.copy()
 
 
-    with warnings.catch_warnings():
-        warnings.simplefilter("ignore", category=RuntimeWarning)
-        warnings.simplefilter("ignore", category=FutureWarning)
-        date_slice[metric] = pd.to_numeric(date_slice[metric], errors='coerce')
+    # a row of the wide frame mixes numbers and size categories so the slice comes back as objects
+    if not pd.api.types.is_numeric_dtype(date_slice[metric]):
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", category=RuntimeWarning)
+            warnings.simplefilter("ignore", category=FutureWarning)
+            date_slice[metric] = pd.to_numeric(date_slice[metric], errors='coerce')
     
     # print('before extremes excluded:')
     # display(date_slice) #### DEBUGGING
@@ -150,3 +325,84 @@ def best_on_date(stock_data,date:str,metric:str,date_already_xs_unstack_transpos
                 # gets the id (Tickers) of the 2 highest value for price_diff_var
                 min_tickers = date_slice.nsmallest(how_many,[metric]).index.tolist()
             return(min_tickers)
+
+
+
+def best_over_range(stock_data, start_date, end_date, metric:str, abs_val:bool=True, how_many:int=1, max_or_min='max', extreme_filter_value=50, min_trading_volume=10000, min_trading_volume_value=10000, min_share_price=None, max_share_price=None, size_categories=['mega','large','mid','small','micro'], min_market_cap=1, avoid_sectors_filter=[], avoid_industries_filter=[], avoid_countries_filter=[], company_data_getter_obj=None, some_if_not_enough=True, screener=None):
+    """best_on_date for every trading day from start_date to end_date in one go, so a strategy can work out all its picks before simulating
+
+    Takes the same filter args as best_on_date and picks the same tickers on each date, but gives them
+    back as integer ticker codes, with -1 for no pick.
+
+    Args:
+        stock_data (pd.DataFrame): the dataframe to use for reference
+        start_date (str): first date, 'YYYY-MM-DD'. None starts at the first date in stock_data
+        end_date (str): last date, 'YYYY-MM-DD'. None goes to the last date in stock_data
+        metric (str): the name of the column to be used for evaluation
+        some_if_not_enough (bool, optional): on dates without how_many tickers that fit the criteria, give all that do.
+            Set to False to give none (a row of -1). best_on_date returns None on those dates either way. Defaults to True.
+        screener (Stock_Screener, optional): screener made from stock_data to pick with. Defaults to None.
+        the rest are the same as best_on_date
+
+    Returns:
+        tuple: (schedule, tickers). schedule is a dataframe indexed by date with a column for each rank (0 is the best)
+            holding ticker codes, tickers[code] is the ticker. None if max_or_min isn't 'max' or 'min'
+    """
+    if max_or_min not in ['max', 'min']:
+        return(None)
+    if screener is None:
+        screener = Stock_Screener(stock_data)
+    dates = screener.market_data.dates
+    in_range = np.ones(len(dates), dtype=bool)
+    if start_date is not None:
+        in_range &= dates >= pd.Timestamp(start_date)
+    if end_date is not None:
+        in_range &= dates <= pd.Timestamp(end_date)
+    rows = np.flatnonzero(in_range)
+
+    codes, counts = screener.top_codes(rows, how_many, metric, abs_val=abs_val, max_or_min=max_or_min,
+                                       extreme_filter_value=extreme_filter_value, min_trading_volume=min_trading_volume, min_trading_volume_value=min_trading_volume_value,
+                                       min_share_price=min_share_price, max_share_price=max_share_price, size_categories=size_categories, min_market_cap=min_market_cap,
+                                       avoid_sectors_filter=avoid_sectors_filter, avoid_industries_filter=avoid_industries_filter, avoid_countries_filter=avoid_countries_filter,
+                                       company_data_getter_obj=company_data_getter_obj)
+
+    not_enough = counts < how_many
+    if not_enough.any():
+        warningString = f"Warning: not enough data to run best_over_range on {not_enough.sum()} of {len(rows)} dates (first {dates[rows[not_enough][0]].date()}) for the top {how_many} of {metric}"
+        print(warningString)
+        warnings.warn(warningString)
+        if not some_if_not_enough:
+            codes[not_enough] = -1
+
+    # best_on_date orders picks with exactly how_many candidates the way pandas does, which can swap ties
+    for i in np.flatnonzero(counts == how_many):
+        ordered = screener.exact_count_order(dates[rows[i]], codes[i], metric, abs_val, max_or_min)
+        codes[i] = [screener.market_data.col(x) for x in ordered]
+
+    schedule = pd.DataFrame(codes, index=dates[rows], columns=range(how_many))
+    schedule.index.name = 'Date'
+    return(schedule, np.asarray(screener.market_data.tickers, dtype=object))
+
+
+def check_best_on_date_parity(stock_data, dates, metric, **kwargs):
+    """runs best_on_date through the screener and on the .xs(date).unstack().transpose() slice for each date
+
+    Args:
+        stock_data (dataframe): stock data with (price var, ticker) columns
+        dates (list): dates to check
+        metric (str): the name of the column to be used for evaluation
+        **kwargs: any other args of best_on_date
+
+    Returns:
+        list: (date, screener result, slice result) for each date where they're different
+    """
+    screener = Stock_Screener(stock_data)
+    mismatches = []
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        for date in dates:
+            from_screener = best_on_date(stock_data, date, metric, screener=screener, **kwargs)
+            from_slice = best_on_date(stock_data.xs(date).unstack().transpose(), date, metric, date_already_xs_unstack_transposed=True, **kwargs)
+            if from_screener != from_slice:
+                mismatches.append((date, from_screener, from_slice))
+    return(mismatches)
@@ -0,0 +1,9 @@
+import import_budget
+
+
+def test_imports_within_budget():
+    # every module pool workers and short jobs import, each in a fresh process
+    results = import_budget.check_import_budget()
+    assert len(results) == len(import_budget.default_modules)
+    failed = [(module, round(seconds, 3), heavy) for module, seconds, heavy, passed in results if not passed]
+    assert not failed, f"over the {import_budget.default_budget}s import budget or loads a heavy module at import time: {failed}"
@@ -1,10 +1,22 @@
 import pandas as pd
+import numpy as np
 import datetime
 import inspect
 import trading_history
+import portfolio_core
+from market_data import Market_Data
+
+# estimated trading costs as a fraction of the trade's value, by size category
+trading_costs_dict = {
+    'micro': 0.02,
+    'small': 0.01,
+    'mid': 0.005,
+    'large': 0.002,
+    'mega': 0.001
+}
 
 class Position:
-    def __init__(self, date_opened, ticker, shares, stock_data, theo_var, std_dev_var, price_diff_var, company_data, stop_loss_threshold, take_profit_threshold, too_old=366):
+    def __init__(self, date_opened, ticker, shares, stock_data, theo_var, std_dev_var, price_diff_var, company_data, stop_loss_threshold, take_profit_threshold, too_old=366, market_data=None):
         """docstring for position
 
         Args:
@@ -19,6 +31,7 @@ class Position:
             stop_loss_threshold (float): (position's market value / position's cost basis) falls below this, we liquidate
             take_profit_threshold (float): (position's market value / position's cost basis) goes above this, we liquidate
             too_old (int): if a position has been held this many days and not been sold, it is sold. set to -1 if you don't want this feature
+            market_data (Market_Data, optional): arrays of stock_data to look values up in, pass the portfolio's so it isn't built again. Defaults to None.
 
         """
         self.date_opened = date_opened
@@ -28,21 +41,25 @@ class Position:
         self.theo_var = theo_var
         self.std_dev_var = std_dev_var
         self.price_diff_var = price_diff_var
-        self.cost_basis = shares*stock_data.at[date_opened,('Adj_Close',ticker)]
+        self.market_data = market_data if market_data is not None else Market_Data(stock_data)
+        self._col = self.market_data.col(ticker)
+        opened_row = self.market_data.row(date_opened)
+        share_price = self.market_data.array('Adj_Close')[opened_row, self._col]
+        self.cost_basis = shares*share_price
         self.stop_loss_threshold = stop_loss_threshold
         self.take_profit_threshold = take_profit_threshold
         self.too_old = too_old
-        self._current_value = shares*stock_data.at[date_opened,('Adj_Close',ticker)]
-        self._current_theo = shares*stock_data.at[date_opened,(theo_var,ticker)]
-        self._current_std_dev = shares*stock_data.at[date_opened,(std_dev_var,ticker)]
-        self._current_price_diff = stock_data.at[date_opened,(price_diff_var,ticker)]
+        self._current_value = shares*share_price
+        self._current_theo = shares*self.market_data.array(theo_var)[opened_row, self._col]
+        self._current_std_dev = shares*self.market_data.array(std_dev_var)[opened_row, self._col]
+        self._current_price_diff = self.market_data.array(price_diff_var)[opened_row, self._col]
         self._last_date_checked = date_opened
         # TODO make methods- get_trading_cost that is a function of data from company_data
         self.company_data = company_data
         self.position_name = ticker + '_' + (date_opened.strftime("%Y-%m-%d"))
-        self.initial_theo = self.stock_data.at[date_opened,(self.theo_var,self.ticker)]
-        self.high_water_mark = {'date':self.date_opened, 'share_price':self.cost_basis}
-        self.low_water_mark = {'date':self.date_opened, 'share_price':self.cost_basis}
+        self.initial_theo = self.market_data.array(theo_var)[opened_row, self._col]
+        self.high_water_mark = {'date':self.date_opened, 'share_price':share_price}
+        self.low_water_mark = {'date':self.date_opened, 'share_price':share_price}
 
 
     def __repr__(self):
@@ -75,11 +92,12 @@ class Position:
     
     def __refresh__(self,current_date):
         self._last_date_checked = current_date
-        self._current_value = self.shares*self.stock_data.at[current_date,('Adj_Close',self.ticker)]
-        self._current_share_price = self.stock_data.at[current_date,('Adj_Close',self.ticker)]
-        self._current_theo = self.stock_data.at[current_date,(self.theo_var, self.ticker)]
-        self._current_std_dev = self.stock_data.at[current_date,(self.theo_var, self.ticker)]
-        self._current_price_diff = self.stock_data.at[current_date,(self.price_diff_var, self.ticker)]
+        row = self.market_data.row(current_date)
+        self._current_share_price = self.market_data.array('Adj_Close')[row, self._col]
+        self._current_value = self.shares*self._current_share_price
+        self._current_theo = self.market_data.array(self.theo_var)[row, self._col]
+        self._current_std_dev = self.market_data.array(self.std_dev_var)[row, self._col]
+        self._current_price_diff = self.market_data.array(self.price_diff_var)[row, self._col]
         if self._current_share_price>self.high_water_mark['share_price']:
             self.high_water_mark['share_price'] = self._current_share_price
             self.high_water_mark['date'] = current_date
@@ -112,29 +130,20 @@ class Position:
     
     def get_trading_cost(self, current_date):
         # estimated trading costs
-        trading_costs_dict = {
-        'micro': 0.02,
-        'small': 0.01,
-        'mid': 0.005,
-        'large': 0.002,
-        'mega': 0.001
-        }
-
-        return(trading_costs_dict[
-            self.stock_data.at[current_date,('Size_Category',self.ticker)]])
+        return(trading_costs_dict[self.market_data.value('Size_Category', current_date, self.ticker)])
     
     #TODO: change this so it returns a tuple: either (False, None) or (True, 'Reason') where 'Reason' is 'old {details}', 'stop-loss {stop loss details}', 'take-profit {take profit details}'
     def is_it_time_to_sell(self,date):
         # too old
-        if (self.days_old != -1) and (self.days_old(date)>=self.too_old):
+        if (self.too_old != -1) and (self.days_old(date)>=self.too_old):
             return(True)
         # stop-loss
         elif (self.get_current_value(date)/self.cost_basis)<=self.stop_loss_threshold:
             return(True)
         # take-profit
         elif self.take_profit_threshold=='initial_theo':
-            # if value is above what our theoretical value was when we bought in
-            return(self.get_current_value(date)>=self.initial_theo)
+            # if share price is above what our theoretical value was when we bought in
+            return(self.get_current_share_price(date)>=self.initial_theo)
         
         elif (self.get_current_value(date)/self.cost_basis)>=self.take_profit_threshold:
             return(True)
@@ -145,19 +154,20 @@ class Position:
 
 
 class Portfolio:
-    def __init__(self, cash: float, date, stock_data, theo_var, std_dev_var, price_diff_var, company_data, stop_loss_threshold=.5, take_profit_threshold=4, too_old = 366, trading_history_obj:trading_history.Trading_History = None, portfolio_name=None):
+    def __init__(self, cash: float, date, stock_data, theo_var, std_dev_var, price_diff_var, company_data, stop_loss_threshold=.5, take_profit_threshold=4, too_old = 366, trading_history_obj:trading_history.Trading_History = None, portfolio_name=None, market_data=None):
         """create portfolio object
 
+        Positions are kept in a Portfolio_Core (preallocated numpy arrays), the methods here look up
+        dates and tickers and pass the work on to it.
+
         Args:
             cash (float): starting amount of cash in account
             date (_type_): starting date
+            market_data (Market_Data, optional): arrays of stock_data, pass the same one to every portfolio on the same data so it's only built once.
+                stock_data can be None if this is given (eg. in a worker process attached to shared market data). Defaults to None.
             # IGNOREtrading_cost (float, optional): cost of trading- each time we transact, we lose this amount. Defaults to 0.005.
         """
-        self.position_df = pd.DataFrame(columns=['Ticker', 'Position_Obj', 'Exposure', 'Value', 'Date_Opened', 'Days_Old'])
         self.starting_capital = cash
-        # Ensure 'Value' is explicitly set to float type
-        self.position_df.loc['cash_position'] = ['N/A', 'N/A', 'N/A', float(cash), date, 0]  # Cast cash to float
-        self.position_df = self.position_df.astype({'Value': 'float64'})  # Ensure Value column remains float
         self._last_date_checked = date
         # self.trading_cost = trading_cost
         self.stock_data = stock_data
@@ -170,13 +180,28 @@ class Portfolio:
         self.take_profit_threshold = take_profit_threshold
         self.too_old_days = too_old
 
-        ###########################################
-        # self.historical_performance = pd.DataFrame(columns=[self.portfolio_name,'Date'])
-        ########'''ADDED date as column for debugging purposes!!!!'''######
-        self.historical_performance = pd.DataFrame(columns=[self.portfolio_name])
-
-
-        self.historical_performance.index.name = 'Date'
+        # positions are stored as rows and columns of the market data arrays
+        if market_data is None:
+            market_data = Market_Data(stock_data, variables=['Adj_Close', theo_var, 'Size_Category'])
+        self.market_data = market_data
+        self._tickers = market_data.tickers
+        self._ticker_cols = market_data.ticker_cols
+        self._core = portfolio_core.Portfolio_Core(cash=cash, adj_close=market_data.array('Adj_Close'), day_numbers=market_data.day_numbers)
+
+        # position name (eg. NVDA_1999-01-22) -> slot in self._core, in the order they were opened, and back
+        self._position_slots = {}
+        self._slot_names = {}
+        # slot -> position id in the trading history
+        self._trade_ids = {}
+
+        # daily snapshots, one row for each trading day in the market data, filled in by add_value_snapshot
+        # historical_performance and snapshot_df are built from these when asked for
+        n_dates = len(market_data.dates)
+        self._snapshot_taken = np.zeros(n_dates, dtype=bool)
+        self._snapshot_equity = np.full(n_dates, np.nan)
+        self._snapshot_cash = np.full(n_dates, np.nan)
+        self._snapshot_exposure = np.full(n_dates, np.nan)
+        self._snapshot_position_count = np.zeros(n_dates, dtype=np.int64)
 
         if (trading_history_obj!= None):
             self.trading_history_obj = trading_history_obj
@@ -190,24 +215,57 @@ class Portfolio:
     def __repr__(self):
         returnString = self.portfolio_name + ":\n" + self.to_string(self._last_date_checked) + '\n' + str(self._last_date_checked)
         return returnString
-        
+
+    def _row(self, date):
+        """row number of a date in the market data"""
+        return(self.market_data.row(date))
+
+    def get_trading_cost(self, date, ticker):
+        """estimated trading cost of ticker on date as a fraction of the trade's value"""
+        return(trading_costs_dict[self.market_data.value('Size_Category', date, ticker)])
+
     def get_cash(self):
         """returns size of cash_position
         """
-        return(self.position_df.at['cash_position','Value'])
+        return(self._core.cash)
 
     def get_exposure(self):
-        exposure = self.position_df['Value'].iloc[1:].sum()
+        exposure = self._core.exposure()
         return(exposure)
 
     def position_count(self):
-        return(len(self.position_df.index)-1)
+        return(len(self._position_slots))
     
     def position_ticker_list(self):
-        return(self.position_df['Ticker'].to_list()[1:]) ##??
+        return([self._tickers[self._core.ticker_col[slot]] for slot in self._position_slots.values()])
 
     def get_position_name_list(self):
-        return(self.position_df.index.to_list()[1:])
+        return(list(self._position_slots))
+
+    @property
+    def position_df(self):
+        """dataframe of the cash and open positions, one row each, as of the last refresh. Built when asked for"""
+        position_df = pd.DataFrame(columns=['Ticker', 'Position_Obj', 'Exposure', 'Value', 'Date_Opened', 'Days_Old'])
+        position_df.loc['cash_position'] = ['N/A', 'N/A', 'N/A', float(self._core.cash), self._last_date_checked, 0]
+        last_row = self._row(self._last_date_checked)
+        for position_name, slot in self._position_slots.items():
+            position_df.loc[position_name] = [self._tickers[self._core.ticker_col[slot]], self._make_position_obj(slot), self._core.shares[slot],
+                                              self._core.value[slot], self.market_data.dates[self._core.open_row[slot]], self._core.days_old(slot, last_row)]
+        return(position_df.astype({'Value': 'float64'}))
+
+    def _make_position_obj(self, slot):
+        """builds a Position object for an open position, for looking at it. Trading doesn't use these"""
+        position = Position(date_opened=self.market_data.dates[self._core.open_row[slot]], ticker=self._tickers[self._core.ticker_col[slot]], shares=self._core.shares[slot],
+                            stock_data=self.stock_data, theo_var=self.theo_var, std_dev_var=self.std_dev_var, price_diff_var=self.price_diff_var, company_data=self.company_data,
+                            take_profit_threshold=self.take_profit_threshold, stop_loss_threshold=self.stop_loss_threshold, too_old=self.too_old_days,
+                            market_data=self.market_data)
+        position.__refresh__(self._last_date_checked)
+        position.high_water_mark = self._water_mark(self._core.high_water_row[slot], self._core.high_water_price[slot])
+        position.low_water_mark = self._water_mark(self._core.low_water_row[slot], self._core.low_water_price[slot])
+        return(position)
+
+    def _water_mark(self, row, share_price):
+        return({'date': self.market_data.dates[row], 'share_price': share_price})
     
     def open_position(self, date_opened, ticker, shares, indicator=None):
         """_summary_
@@ -216,39 +274,44 @@ class Portfolio:
             date_opened (_type_): _description_
             ticker (_type_): _description_
             shares (_type_): _description_
-        """ + inspect.getdoc(Position.__init__)
-
-        position = Position(date_opened=date_opened, ticker=ticker, shares=shares, stock_data=self.stock_data, theo_var=self.theo_var, std_dev_var=self.std_dev_var, price_diff_var=self.price_diff_var,company_data=self.company_data,
-                            take_profit_threshold=self.take_profit_threshold,stop_loss_threshold=self.stop_loss_threshold,too_old=self.too_old_days)
+        """
+        row = self._row(date_opened)
+        share_price = self._core.adj_close[row, self._ticker_cols[ticker]]
+        cost_basis = shares*share_price
+        trading_cost = self.get_trading_cost(date_opened, ticker)
 
-        # Assuming position has attributes `cost_basis`, `get_ticker()`, and `date_opened`
         if shares==0:
             print(f"Can't buy 0 shares. Failed to buy {shares} of {ticker}")
-        elif position.cost_basis*(1+position.get_trading_cost(date_opened)) > self.get_cash():
+        elif cost_basis*(1+trading_cost) > self.get_cash():
             print('Position not opened; too expensive')
-            print(f"Available cash: {self.position_df.loc['cash_position', 'Value']}\nPosition cost: {position.cost_basis*(1+position.get_trading_cost(date_opened))} = position_cost ({position.cost_basis}) *(1+ trading_cost ({(position.get_trading_cost(date_opened))}))")
+            print(f"Available cash: {self.get_cash()}\nPosition cost: {cost_basis*(1+trading_cost)} = position_cost ({cost_basis}) *(1+ trading_cost ({trading_cost}))")
         else:
-            # Explicit cast to ensure correct dtype when modifying Value
-            self.position_df.loc['cash_position', 'Value'] = float(self.position_df.loc['cash_position', 'Value']) - (position.cost_basis * (1+position.get_trading_cost(date_opened)))
-            # Add new row for the position
+            slot = self._core.open(ticker_col=self._ticker_cols[ticker], shares=shares, row=row, total_cost=cost_basis*(1+trading_cost),
+                                   initial_theo=self.market_data.array(self.theo_var)[row, self._ticker_cols[ticker]])
             # TODO
             # if we change the model such that it ever makes more than one trade in a day, this WILL cause non-obvious but serious problems. This sets the position info without checking if there already exists one. This isn't a problem now becuase there is never more than one set of trades made in a day, so there is never more than one trade on the same name in the same day.
             # if there were more than one trade in the same day (eg. buy 2 shares AAPL @ $100/share at the open, buy 3 shares AAPL @ $90/share at the close, we would pay $470 but the 3 shares would overwrite the 2 shares, so we'd only have 3 shares of apple)
             # if we do do this, then we need should keep track of trades in the same way as we are now, but with a timestamp
-            # this change would also have to be made in the position class, at least where self.position_name is established, maybe elsewhere
-            # print(str(date_opened.date()))
-            self.position_df.loc[position.get_ticker() + '_' + str(date_opened.date())] = [ticker ,position, position.shares, position.cost_basis, position.date_opened, 0]##### ????? if date_opened is a date object and not a string this won't work, if that's the case, try adding/removing .date() ###???
+            self._position_slots[ticker + '_' + str(date_opened.date())] = slot
+            self._slot_names[slot] = ticker + '_' + str(date_opened.date())
             # log purchase
             if self.recording_trades:
-                self.trading_history_obj.enter_position(date=date_opened.date(), ticker=ticker,shares=shares,share_price=position.cost_basis/position.shares,entry_trading_cost=position.get_trading_cost(date_opened), portfolio=self.portfolio_name, indicator=indicator)
+                self._trade_ids[slot] = self.trading_history_obj.enter_position(date=date_opened.date(), ticker=ticker,shares=shares,share_price=share_price,entry_trading_cost=trading_cost, portfolio=self.portfolio_name, indicator=indicator)
         
 
     def positions_to_close(self, date):
-        return_list = []
-        for position_name in self.get_position_name_list():
-            if self.position_df.at[position_name,'Position_Obj'].is_it_time_to_sell(date):
-                return_list.append(position_name)
-        return(return_list)
+        """names of the positions that should be sold on date, see positions_to_close_with_reasons"""
+        return([position_name for position_name, _ in self.positions_to_close_with_reasons(date)])
+
+    def positions_to_close_with_reasons(self, date):
+        """checks every open position against the too old, stop-loss and take-profit rules in one go
+
+        Returns:
+            list of tuples: (position name, reason) for each position to sell, reason is 'old', 'stop-loss' or 'take-profit'
+        """
+        slots, reasons = self._core.exit_signals(self._row(date), stop_loss_threshold=self.stop_loss_threshold,
+                                                 take_profit_threshold=self.take_profit_threshold, too_old=self.too_old_days)
+        return([(self._slot_names[slot], portfolio_core.exit_reason_names[reason]) for slot, reason in zip(slots, reasons)])
 
     
     def close_position(self, position_name: str, current_date: str):
@@ -262,17 +325,22 @@ class Portfolio:
         if position_name == 'cash_position':
             print('Cannot sell cash position')
         else:
-            position_obj = self.position_df.loc[position_name, 'Position_Obj']
-            ticker = position_obj.ticker
-            position_value = position_obj.get_current_value(current_date)
-            position_share_price = position_obj.get_current_share_price(current_date)
-            position_trading_cost = position_obj.get_trading_cost(current_date)
-            self.position_df.loc['cash_position', 'Value'] += (position_value * (1-position_trading_cost))
+            slot = self._position_slots.pop(position_name)
+            del self._slot_names[slot]
+            row = self._row(current_date)
+            # updates value and water marks of the open positions at today's prices
+            self._core.mark(row)
+            ticker = self._tickers[self._core.ticker_col[slot]]
+            position_value = self._core.value[slot]
+            position_share_price = self._core.adj_close[row, self._core.ticker_col[slot]]
+            position_trading_cost = self.get_trading_cost(current_date, ticker)
             if self.recording_trades:
-                self.trading_history_obj.exit_position(ticker=ticker,date_opened=position_obj.date_opened.date(), date_closed=current_date.date(), share_price=position_share_price, exit_trading_cost=position_trading_cost,
-                                                       high_water_mark=position_obj.high_water_mark,low_water_mark=position_obj.low_water_mark)
+                self.trading_history_obj.exit_position(ticker=ticker,date_opened=self.market_data.dates[self._core.open_row[slot]].date(), date_closed=current_date.date(), share_price=position_share_price, exit_trading_cost=position_trading_cost,
+                                                       high_water_mark=self._water_mark(self._core.high_water_row[slot], self._core.high_water_price[slot]),
+                                                       low_water_mark=self._water_mark(self._core.low_water_row[slot], self._core.low_water_price[slot]),
+                                                       position_id=self._trade_ids.pop(slot, None))
 
-            self.position_df.drop(index=position_name, inplace=True)
+            self._core.close(slot, position_value * (1-position_trading_cost))
     
     def close_positions(self, position_name_list: list, current_date: str):
         for position_name in position_name_list:
@@ -280,38 +348,55 @@ class Portfolio:
 
     def get_portfolio_value(self, date):
         """gets the value of all the positions in the portfolio on the given date"""
-        self.refresh_position_df(date)
         self._last_date_checked = date
-        value = 0
-        for ticker in self.position_df.index:
-            value += self.position_df.loc[ticker, 'Value']
-        return value
+        return self._core.total_value(self._row(date))
     
     def add_value_snapshot(self, date):
-        ##################################
-        self.historical_performance.loc[date] = self.get_portfolio_value(date)
-        # self.historical_performance.loc[self.historical_performance.shape[0]] = {
-        #     self.portfolio_name:self.get_portfolio_value(date),
-        #     'Date':date}
+        """records the portfolio's value, cash, exposure and number of positions on date and returns the value. Taking another snapshot on the same date overwrites it"""
+        self._last_date_checked = date
+        row = self._row(date)
+        slots = self._core.mark(row)
+        exposure = self._core.value[slots].sum()
+        self._snapshot_taken[row] = True
+        self._snapshot_cash[row] = self._core.cash
+        self._snapshot_exposure[row] = exposure
+        self._snapshot_equity[row] = self._core.cash + exposure
+        self._snapshot_position_count[row] = len(slots)
+        return(self._snapshot_equity[row])
+
+    @property
+    def historical_performance(self):
+        """dataframe of the portfolio's value on each day a snapshot was taken, one column named after the portfolio, indexed by 'Date'"""
+        taken = self._snapshot_taken
+        return(pd.DataFrame({self.portfolio_name: self._snapshot_equity[taken]}, index=pd.Index(self.market_data.dates[taken], name='Date')))
+
+    def snapshot_df(self):
+        """dataframe of every snapshot: Equity, Cash, Exposure and Position_Count on each day, indexed by 'Date'"""
+        taken = self._snapshot_taken
+        return(pd.DataFrame({'Equity': self._snapshot_equity[taken], 'Cash': self._snapshot_cash[taken], 'Exposure': self._snapshot_exposure[taken],
+                             'Position_Count': self._snapshot_position_count[taken]}, index=pd.Index(self.market_data.dates[taken], name='Date')))
     
     
     def refresh_position_df(self, date):
         self._last_date_checked = date
-        for ticker in self.position_df.index[1:]:  # Skipping the cash position
-            self.position_df.loc[ticker, 'Value'] = self.position_df.loc[ticker, 'Position_Obj'].get_current_value(date)
-            self.position_df.loc[ticker,'Days_Old'] = self.position_df.loc[ticker, 'Position_Obj'].days_old(date)
+        self._core.mark(self._row(date))
 
     def to_string(self, date: str):
         """returns a string summarizing portfolio's value"""
         self.refresh_position_df(date)
         return_string = f"Current Portfolio Value: {self.get_portfolio_value(date)}\n"
-        return_string += f"Cash: {self.position_df.loc['cash_position', 'Value']}\n"
-        for ticker in self.position_df.index[1:]:
-            return_string += repr(self.position_df.loc[ticker, 'Position_Obj']) +'\n'
+        return_string += f"Cash: {self.get_cash()}\n"
+        for slot in self._position_slots.values():
+            return_string += repr(self._make_position_obj(slot)) +'\n'
         return return_string
 
 
 
+# the Position args are added here once, not as an expression in the method (which ran inspect on every call)
+Portfolio.open_position.__doc__ += inspect.getdoc(Position.__init__)
+
+
+
 #TODO
 '''
 strategy class:
@@ -1,61 +1,223 @@
 import pandas as pd
 import numpy as np
+import warnings
 from data_interaction import Company_Data_Getter, str_to_date_obj
 
 
+# columns of the trades dataframe, in order. each trade is recorded as a list in this order
+trade_columns = ['Ticker', 'Entry_Date', 'Entry_Share_Price', 'Entry_Trading_Cost',  'Shares', 'Exit_Date', 'Exit_Share_Price', 'Exit_Trading_Cost', 'Indicator','High_Water_Share_Price','High_Water_Date','Low_Water_Share_Price','Low_Water_Date', 'Portfolio']
+exit_date_col, exit_share_price_col, exit_trading_cost_col = 5, 6, 7
+high_water_share_price_col, high_water_date_col, low_water_share_price_col, low_water_date_col = 9, 10, 11, 12
+# the columns exit_position fills in
+exit_cols = [exit_date_col, exit_share_price_col, exit_trading_cost_col, high_water_share_price_col, high_water_date_col, low_water_share_price_col, low_water_date_col]
+
+# stats over each position's holding window that add_analytics can add
+holding_window_stat_names = ['Volatility', 'Alpha', 'Beta', 'Sharpe', 'Sortino']
+
+
+def _prefix_sums(values):
+    """cumulative sums down the rows with a row of zeros on top, so the sum of rows a to b-1 is prefix[b] - prefix[a]"""
+    prefix = np.zeros((values.shape[0] + 1,) + values.shape[1:])
+    np.cumsum(values, axis=0, out=prefix[1:])
+    return(prefix)
+
+
+def holding_window_stats(adj_close, entry_rows, exit_rows, cols, benchmark_returns=None, periods=252, block_size=256):
+    """volatility, alpha, beta, sharpe and sortino of the daily returns while each position was held
+
+    Works from prefix sums of the daily returns matrix (count, sum, sum of squares, downside sum of
+    squares and the cross terms with the benchmark), so each trade's stats are a few subtractions
+    instead of slicing its window. Tickers are done block_size columns at a time to bound memory.
+    Same definitions as quantstats with no risk free rate: volatility and sharpe use the sample std dev,
+    sortino divides by the root mean square of the negative returns, and alpha is annualized.
+
+    Args:
+        adj_close (np.ndarray): dates x tickers share prices
+        entry_rows (np.ndarray): row of each trade's entry date, -1 if it isn't in adj_close
+        exit_rows (np.ndarray): row of each trade's exit date, -1 if it isn't in adj_close or the position is still open
+        cols (np.ndarray): ticker column of each trade, -1 if it isn't in adj_close
+        benchmark_returns (np.ndarray, optional): daily benchmark return on each row. Alpha and beta are NaN without it. Defaults to None.
+        periods (int, optional): trading days in a year, for annualizing. Defaults to 252.
+        block_size (int, optional): ticker columns worked on at once. Defaults to 256.
+
+    Returns:
+        dict: {stat name: array with a value for each trade}, NaN where there aren't enough returns
+    """
+    entry_rows, exit_rows, cols = np.asarray(entry_rows), np.asarray(exit_rows), np.asarray(cols)
+    stats = {name: np.full(len(cols), np.nan) for name in holding_window_stat_names}
+    valid = (entry_rows >= 0) & (exit_rows > entry_rows) & (cols >= 0)
+    traded_cols = np.unique(cols[valid])
+
+    for start in range(0, len(traded_cols), block_size):
+        block_cols = traded_cols[start:start+block_size]
+        trades = np.flatnonzero(valid & np.isin(cols, block_cols))
+        local_cols = np.searchsorted(block_cols, cols[trades])
+        # returns[t] is the return from row t-1 to row t, a position held from row a to row b earns returns a+1 to b
+        first = entry_rows[trades] + 1
+        last = exit_rows[trades] + 1
+
+        prices = adj_close[:, block_cols]
+        returns = np.full(prices.shape, np.nan)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            returns[1:] = prices[1:] / prices[:-1] - 1
+        has_return = np.isfinite(returns)
+        filled = np.where(has_return, returns, 0)
+
+        def window(values):
+            prefix = _prefix_sums(values)
+            return(prefix[last, local_cols] - prefix[first, local_cols])
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            count = window(has_return)
+            mean = window(filled) / count
+            variance = np.where(count > 1, (window(filled * filled) - mean * mean * count) / (count - 1), np.nan)
+            # the subtraction can leave a tiny negative number when the price didn't move
+            std_dev = np.sqrt(np.maximum(variance, 0))
+            downside = np.sqrt(window(np.minimum(filled, 0) ** 2) / count)
+            stats['Volatility'][trades] = std_dev * np.sqrt(periods)
+            stats['Sharpe'][trades] = np.where(std_dev > 0, mean / std_dev, np.nan) * np.sqrt(periods)
+            stats['Sortino'][trades] = np.where(downside > 0, mean / downside, np.nan) * np.sqrt(periods)
+
+            if benchmark_returns is not None:
+                # only days with both a return and a benchmark return
+                both = has_return & np.isfinite(benchmark_returns)[:, None]
+                stock_both = np.where(both, returns, 0)
+                benchmark_both = np.where(both, benchmark_returns[:, None], 0)
+                pair_count = window(both)
+                stock_mean = window(stock_both) / pair_count
+                benchmark_mean = window(benchmark_both) / pair_count
+                covariance = (window(stock_both * benchmark_both) - stock_mean * benchmark_mean * pair_count) / (pair_count - 1)
+                benchmark_variance = (window(benchmark_both * benchmark_both) - benchmark_mean * benchmark_mean * pair_count) / (pair_count - 1)
+                beta = covariance / np.where(benchmark_variance > 0, benchmark_variance, np.nan)
+                stats['Beta'][trades] = beta
+                stats['Alpha'][trades] = (stock_mean - beta * benchmark_mean) * periods
+
+    return(stats)
+
+
 class Trading_History:
     def __init__(self, stock_data, company_data):
         """object to keep track of trades and perform trading analysis on them
 
+        Trades are recorded in a ledger with one record (a list in the order of trade_columns) per
+        position, indexed by an integer position id (the order the positions were entered in). The
+        trades dataframe is only built from it when it's asked for, so recording a trade is a list append.
+        After that only the positions entered or exited since are brought over from the ledger, so
+        columns added to the dataframe (eg. by add_analytics) are kept, NaN for positions entered later.
+
         Args:
             stock_data (dataframe): stock data
             company_data (dataframe): data on companies
         """
-        # Added 'Entry_Trading_Cost' and 'Exit_Trading_Cost' columns
-        self.trades = pd.DataFrame(columns=['Ticker', 'Entry_Date', 'Entry_Share_Price', 'Entry_Trading_Cost',  'Shares', 'Exit_Date', 'Exit_Share_Price', 'Exit_Trading_Cost', 'Indicator','High_Water_Share_Price','High_Water_Date','Low_Water_Share_Price','Low_Water_Date'])
-        self.trades.index.name = 'Position_Name'
+        self._ledger = []
+        self._position_names = []
+        # position name (eg. NVDA_1999-01-22) -> position id of the last position entered with that name
+        self._position_ids = {}
+        self._trades = None
+        # position ids entered or exited since the trades dataframe was last brought up to date
+        self._changed_ids = set()
         self.company_data_getter_obj = Company_Data_Getter(stock_data=stock_data,company_data=company_data)
-    
+
+    def _ledger_frame(self, position_ids):
+        return(pd.DataFrame.from_records([self._ledger[i] for i in position_ids], index=pd.Index([self._position_names[i] for i in position_ids], name='Position_Name'),
+                                         columns=trade_columns, coerce_float=True))
+
+    @property
+    def trades(self):
+        """dataframe of every trade, one row per position indexed by position name, kept up to date with the ledger when it's asked for"""
+        if self._trades is None:
+            self._trades = self._ledger_frame(range(len(self._ledger)))
+        elif self._changed_ids:
+            built = len(self._trades)
+            exited = sorted(i for i in self._changed_ids if i < built)
+            for col in exit_cols if exited else []:
+                values = self._trades[trade_columns[col]].to_numpy(dtype=object, copy=True)
+                values[exited] = [self._ledger[i][col] for i in exited]
+                self._trades[trade_columns[col]] = pd.Series(values, index=self._trades.index).infer_objects()
+            if built < len(self._ledger):
+                with warnings.catch_warnings():
+                    # the new rows have no values yet for the columns added to the dataframe
+                    warnings.simplefilter("ignore", category=FutureWarning)
+                    self._trades = pd.concat([self._trades, self._ledger_frame(range(built, len(self._ledger)))])
+        self._changed_ids = set()
+        return(self._trades)
+
+    @trades.setter
+    def trades(self, trades):
+        # the dataframe's rows become the ledger, so positions entered or exited after this are added to it
+        self._ledger = trades.reindex(columns=trade_columns).to_numpy(dtype=object).tolist()
+        self._position_names = list(trades.index)
+        self._position_ids = {position_name: position_id for position_id, position_name in enumerate(self._position_names)}
+        self._trades = trades
+        self._changed_ids = set()
+
+    def trade_count(self):
+        return(len(self._position_names))
+
     def enter_position(self, date, ticker, shares, share_price, entry_trading_cost=0, portfolio = None,indicator=None):
-        # Create the index as a concatenation of ticker and date
+        """records a new position and returns its position id, which can be passed to exit_position"""
+        # Create the name as a concatenation of ticker and date
         position_name = f"{ticker}_{date}"
-        
-        # Define the entry-related columns, including Entry_Trading_Cost
-        entry_data = {
-            'Ticker': ticker,
-            'Entry_Date': date,
-            'Entry_Share_Price': share_price,
-            'Shares': shares,
-            'Entry_Trading_Cost': entry_trading_cost,
-            'Portfolio': portfolio,
-            'Indicator': indicator
-        }
-        
-        # Add the row to the DataFrame, leaving unspecified columns as NaN
-        self.trades = pd.concat([self.trades, pd.DataFrame(entry_data, index=[position_name])])
-    
-    def exit_position(self, ticker, date_opened, date_closed, share_price, exit_trading_cost=0, high_water_mark=None, low_water_mark=None):
-        # Create the index as a concatenation of ticker and date_opened to locate the entry
+        position_id = len(self._position_names)
+
+        # entry-related columns, including Entry_Trading_Cost. exit columns are NaN until the position is exited
+        self._ledger.append([ticker, date, share_price, entry_trading_cost, shares, np.nan, np.nan, np.nan, indicator, np.nan, np.nan, np.nan, np.nan, portfolio])
+        self._position_names.append(position_name)
+        self._position_ids[position_name] = position_id
+        self._changed_ids.add(position_id)
+        return(position_id)
+
+    def exit_position(self, ticker, date_opened, date_closed, share_price, exit_trading_cost=0, high_water_mark=None, low_water_mark=None, position_id=None):
+        """records the exit of a position, found by position_id if given, otherwise by ticker and date_opened"""
+        # Create the name as a concatenation of ticker and date_opened to locate the entry
         position_name = f"{ticker}_{date_opened}"
-        
+        if position_id is None:
+            position_id = self._position_ids.get(position_name)
+
         # Check if the position exists
-        if position_name in self.trades.index:
+        if position_id is not None and 0 <= position_id < len(self._position_names):
             # Update the exit columns for the position, including Exit_Trading_Cost
-            self.trades.at[position_name, 'Exit_Date'] = date_closed
-            self.trades.at[position_name, 'Exit_Share_Price'] = share_price
-            self.trades.at[position_name, 'Exit_Trading_Cost'] = exit_trading_cost
+            record = self._ledger[position_id]
+            record[exit_date_col] = date_closed
+            record[exit_share_price_col] = share_price
+            record[exit_trading_cost_col] = exit_trading_cost
             if high_water_mark != None:
-                self.trades.at[position_name, 'High_Water_Share_Price'] = high_water_mark['share_price']
-                self.trades.at[position_name, 'High_Water_Date'] = high_water_mark['date'].date()
+                record[high_water_share_price_col] = high_water_mark['share_price']
+                record[high_water_date_col] = high_water_mark['date'].date()
             if low_water_mark != None:
-                self.trades.at[position_name, 'Low_Water_Share_Price'] = low_water_mark['share_price']
-                self.trades.at[position_name, 'Low_Water_Date'] = low_water_mark['date'].date()
+                record[low_water_share_price_col] = low_water_mark['share_price']
+                record[low_water_date_col] = low_water_mark['date'].date()
+            self._changed_ids.add(position_id)
         else:
             print(f"Position {position_name} not found. Please check ticker and date_opened.")
 
 
-    def add_analytics(self,to_include = ['Sector', 'Industry', 'Return', 'Annualized_Return','High_Share_Price', 'High_Share_Price_Date', 'Low_Share_Price','Low_Share_Price_Date', 'Volatility', 'Alpha', 'Beta', 'Sharpe', 'Sortino'], to_exclude=[]):
-        # adds data like vol of positions during holding, high/low, high/low date, volatility, alpha, beta, sharpe, sortino
+    def _benchmark_returns(self, benchmark):
+        """daily returns of the benchmark on each row of the market data, see add_analytics"""
+        market_data = self.company_data_getter_obj.market_data
+        if benchmark is None:
+            return(None)
+        if isinstance(benchmark, pd.Series):
+            return(benchmark.reindex(market_data.dates).to_numpy(dtype='float64'))
+        price_var, ticker = benchmark if isinstance(benchmark, tuple) else ('Adj_Close', benchmark)
+        if ticker not in market_data.ticker_cols or price_var not in market_data.price_vars:
+            warnings.warn(f"Benchmark {benchmark} isn't in stock_data, Alpha and Beta will be NaN")
+            return(None)
+        prices = market_data.array(price_var)[:, market_data.col(ticker)]
+        benchmark_returns = np.full(len(prices), np.nan)
+        benchmark_returns[1:] = prices[1:] / prices[:-1] - 1
+        return(benchmark_returns)
+
+    def add_analytics(self,to_include = ['Sector', 'Industry', 'Return', 'Annualized_Return','High_Share_Price', 'High_Share_Price_Date', 'Low_Share_Price','Low_Share_Price_Date', 'Volatility', 'Alpha', 'Beta', 'Sharpe', 'Sortino'], to_exclude=[], benchmark='SPY', periods=252):
+        """adds data like vol of positions during holding, high/low, high/low date, volatility, alpha, beta, sharpe, sortino
+
+        Args:
+            to_include (list, optional): Volatility, Alpha, Beta, Sharpe and Sortino are only worked out if they're in here.
+            to_exclude (list, optional): any of Volatility, Alpha, Beta, Sharpe and Sortino to leave out. Defaults to [].
+            benchmark (str, tuple or series, optional): benchmark for alpha and beta. A ticker in stock_data (uses its Adj_Close), a (price var, ticker)
+                column of stock_data, or a series of daily benchmark returns indexed by date. Defaults to 'SPY'.
+            periods (int, optional): trading days in a year, for annualizing. Defaults to 252.
+        """
         # probably best to run this after 
 
         # add days held
@@ -83,25 +245,31 @@ class Trading_History:
         self.trades['Low_Water_Annualized_Percent_Return'] = (1+ self.trades['Low_Water_Percent_Return']) ** (365/self.trades['Low_Water_Days_After_Purchase']) -1
 
 
-        # uses company_data_getter_obj to add company data
-        self.trades['Name'] = self.company_data_getter_obj.get_name(self.trades['Ticker'])
-        self.trades['Sector'] = self.company_data_getter_obj.get_sector(self.trades['Ticker'])
-        self.trades['Industry'] = self.company_data_getter_obj.get_industry(self.trades['Ticker'])
-        self.trades['Country'] = self.company_data_getter_obj.get_country(self.trades['Ticker'])
-        self.trades['Size_Category_Entry'] = self.company_data_getter_obj.get_size_category(self.trades['Ticker'],self.trades['Entry_Date'])
-        self.trades['Market_Cap_Entry']= self.company_data_getter_obj.get_market_cap(self.trades['Ticker'],self.trades['Entry_Date'])
-        self.trades['CAGR_Bin'] = self.trades['Annualized_Percent_Return'].apply(
-            lambda x: (
-                "negative" if x < 1 
-                else "sub_market" if 1 <= x < 1.1 
-                else "market_beating" if x >= 1.1 
-                else np.nan
-            ))
-        self.trades['Above_Even'] = self.trades['Return'].apply(
-            lambda x: (
-                False if (x <= 1) 
-                else True
-            ))
+        # company data in one join on Ticker, market data on the entry dates gathered by date and ticker position
+        company_attributes = self.company_data_getter_obj.get_attributes(self.trades['Ticker'], ['Name', 'Sector', 'Industry', 'Country'])
+        for column in company_attributes.columns:
+            self.trades[column] = company_attributes[column].to_numpy()
+        self.trades['Size_Category_Entry'] = self.company_data_getter_obj.get_size_categories_on_dates(self.trades['Ticker'],self.trades['Entry_Date'])
+        self.trades['Market_Cap_Entry']= self.company_data_getter_obj.get_market_caps_on_dates(self.trades['Ticker'],self.trades['Entry_Date'])
 
+        annualized_return = self.trades['Annualized_Percent_Return'].to_numpy(dtype='float64')
+        cagr_bin = np.select([annualized_return < 1, annualized_return < 1.1, annualized_return >= 1.1],
+                             ["negative", "sub_market", "market_beating"], default='').astype(object)
+        cagr_bin[cagr_bin == ''] = np.nan
+        self.trades['CAGR_Bin'] = cagr_bin
+        # NaN returns count as above even
+        self.trades['Above_Even'] = ~(self.trades['Return'].to_numpy(dtype='float64') <= 1)
 
-        
+        # stats of the daily returns over each position's holding window, all trades at once
+        window_stats_wanted = [x for x in holding_window_stat_names if x in to_include and x not in to_exclude]
+        if window_stats_wanted:
+            market_data = self.company_data_getter_obj.market_data
+            window_stats = holding_window_stats(
+                market_data.array('Adj_Close'),
+                entry_rows=market_data.dates.get_indexer(self.trades['Entry_Date']),
+                exit_rows=market_data.dates.get_indexer(self.trades['Exit_Date']),
+                cols=pd.Index(market_data.tickers).get_indexer(self.trades['Ticker']),
+                benchmark_returns=self._benchmark_returns(benchmark) if ('Alpha' in window_stats_wanted or 'Beta' in window_stats_wanted) else None,
+                periods=periods)
+            for stat_name in window_stats_wanted:
+                self.trades[stat_name] = window_stats[stat_name]
@@ -0,0 +1,189 @@
+"""times the main steps of the pipeline and a backtest on synthetic data and saves the results as json
+
+    python run_benchmarks.py --tickers 200 --dates 2500
+    python run_benchmarks.py --compare results/old.json results/new.json
+
+Each result file has the commit it was run on, so runs from different commits can be compared.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import datetime
+import platform
+import subprocess
+import tempfile
+import warnings
+import contextlib
+import io
+import numpy as np
+import pandas as pd
+
+# sets up the paths to the backtesting and processing modules, so it's imported first
+import synthetic_data
+import data_interaction
+import stock_picking
+import simulation
+import new_processing_multiprocess_progress_bar_v3 as processing
+from market_data import Market_Data
+from trading_history import Trading_History
+
+benchmarks_dir = os.path.dirname(os.path.abspath(__file__))
+default_results_dir = os.path.join(benchmarks_dir, 'results')
+benchmark_names = ['process_data', 'select_data_subset', 'add_lin_reg_prediction', 'add_price_diff_metric', 'best_on_date', 'portfolio_run', 'add_analytics']
+
+
+def git_commit():
+    """(commit hash, whether the working tree has changes) of the repo, (None, None) outside git"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=benchmarks_dir, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=benchmarks_dir, capture_output=True, text=True, check=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return(None, None)
+    return(commit, dirty)
+
+
+@contextlib.contextmanager
+def _quietly():
+    # the backtest prints and warns about days without enough data, which isn't what's being measured
+    with warnings.catch_warnings(), contextlib.redirect_stdout(io.StringIO()):
+        warnings.simplefilter('ignore')
+        yield
+
+
+def time_call(function, repeats, setup=None):
+    """runs function repeats times (after setup, which isn't timed) and returns the seconds each run took"""
+    times = []
+    for _ in range(repeats):
+        arguments = setup() if setup is not None else ()
+        start = time.perf_counter()
+        function(*arguments)
+        times.append(time.perf_counter() - start)
+    return(times)
+
+
+def run_benchmarks(n_tickers=100, n_dates=2000, repeats=3, pick_dates=50, to_run=benchmark_names, random_state=0):
+    """times each benchmark on synthetic data of the given size
+
+    Args:
+        n_tickers (int, optional): tickers in the synthetic data. Defaults to 100.
+        n_dates (int, optional): trading days in the synthetic data. Defaults to 2000.
+        repeats (int, optional): times each benchmark is run. Defaults to 3.
+        pick_dates (int, optional): dates best_on_date is called on each run. Defaults to 50.
+        to_run (list, optional): names of the benchmarks to run. Defaults to benchmark_names.
+        random_state (int, optional): seed for the synthetic data. Defaults to 0.
+
+    Returns:
+        dict: the run's details and {'benchmarks': {name: {'best', 'median', 'times'}}}
+    """
+    reg_ranges = synthetic_data.default_reg_ranges
+    start = time.perf_counter()
+    raw_stock_data, stock_data, company_data = synthetic_data.make_market(n_tickers=n_tickers, n_dates=n_dates, reg_ranges=reg_ranges, random_state=random_state)
+    generate_seconds = time.perf_counter() - start
+
+    stock_data = pd.concat([stock_data, data_interaction.add_lin_reg_prediction(stock_data, 30, new_multiindex_col_name='Theo_30')], axis=1)
+    stock_data = pd.concat([stock_data, data_interaction.add_price_diff_metric(stock_data, 'Adj_Close', 'Theo_30', 'Std_Dev_30', new_multiindex_col_name='Price_Diff_30')], axis=1)
+    tickers = list(stock_data.xs('Adj_Close', level=0, axis=1).columns)
+    dates = stock_data.index[max(reg_ranges):]
+    picked_dates = dates[np.linspace(0, len(dates) - 1, min(pick_dates, len(dates))).astype(int)]
+
+    def run_portfolio():
+        trading_history_obj = Trading_History(stock_data, company_data)
+        simulation.run_portfolio(Market_Data(stock_data), {}, company_data=company_data, trading_history_obj=trading_history_obj)
+        return(trading_history_obj)
+
+    def pick_on_dates():
+        # one screener for the run like a backtest would use, building it is timed too
+        screener = stock_picking.Stock_Screener(stock_data)
+        for date in picked_dates:
+            stock_picking.best_on_date(stock_data, date, 'Price_Diff_30', how_many=5, screener=screener)
+
+    with _quietly():
+        trading_history_obj = run_portfolio()
+    ledger = trading_history_obj.trades.copy()
+
+    def fresh_trades():
+        trading_history_obj.trades = ledger.copy()
+        return(())
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        output_file_name = os.path.join(temp_dir, 'processed.pkl')
+        benchmarks = {
+            'process_data': (lambda: processing.process_data(raw_stock_data.copy(), output_file_name, reg_ranges=reg_ranges, n_processes=1), None),
+            'select_data_subset': (lambda: data_interaction.select_data_subset(stock_data, std_dev_day_range=[30], reg_day_range=[30]), None),
+            'add_lin_reg_prediction': (lambda: data_interaction.add_lin_reg_prediction(stock_data, 30, new_multiindex_col_name='Theo_30'), None),
+            'add_price_diff_metric': (lambda: data_interaction.add_price_diff_metric(stock_data, 'Adj_Close', 'Theo_30', 'Std_Dev_30', new_multiindex_col_name='Price_Diff_30'), None),
+            'best_on_date': (pick_on_dates, None),
+            'portfolio_run': (run_portfolio, None),
+            'add_analytics': (lambda: trading_history_obj.add_analytics(benchmark=tickers[0]), fresh_trades),
+        }
+        results = {}
+        for name in to_run:
+            function, setup = benchmarks[name]
+            with _quietly():
+                times = time_call(function, repeats, setup)
+            results[name] = {'best': min(times), 'median': float(np.median(times)), 'times': times}
+
+    commit, dirty = git_commit()
+    return({
+        'commit': commit,
+        'dirty': dirty,
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'sizes': {'n_tickers': n_tickers, 'n_dates': n_dates, 'reg_ranges': reg_ranges, 'pick_dates': len(picked_dates), 'repeats': repeats,
+                  'random_state': random_state},
+        'data': {'stock_data_columns': stock_data.shape[1], 'trades': len(ledger)},
+        'versions': {'python': platform.python_version(), 'pandas': pd.__version__, 'numpy': np.__version__, 'machine': platform.machine()},
+        'generate_seconds': generate_seconds,
+        'benchmarks': results,
+    })
+
+
+def save_results(results, output_file_name=None):
+    """writes results to output_file_name, by default results/<commit>_<tickers>x<dates>.json. Returns the path"""
+    if output_file_name is None:
+        os.makedirs(default_results_dir, exist_ok=True)
+        sizes = results['sizes']
+        output_file_name = os.path.join(default_results_dir, f"{(results['commit'] or 'nogit')[:10]}_{sizes['n_tickers']}x{sizes['n_dates']}.json")
+    with open(output_file_name, 'w') as results_file:
+        json.dump(results, results_file, indent=2)
+    return(output_file_name)
+
+
+def compare_results(old_file_name, new_file_name):
+    """dataframe of the best time of each benchmark in two result files and new / old"""
+    with open(old_file_name) as old_file, open(new_file_name) as new_file:
+        old, new = json.load(old_file), json.load(new_file)
+    if old['sizes'] != new['sizes']:
+        print(f"Warning: the runs used different sizes\n{old['sizes']}\n{new['sizes']}")
+    names = [name for name in old['benchmarks'] if name in new['benchmarks']]
+    return_df = pd.DataFrame({
+        'Old_Seconds': [old['benchmarks'][name]['best'] for name in names],
+        'New_Seconds': [new['benchmarks'][name]['best'] for name in names],
+    }, index=pd.Index(names, name='Benchmark'))
+    return_df['Ratio'] = return_df['New_Seconds'] / return_df['Old_Seconds']
+    return_df.attrs['commits'] = (old['commit'], new['commit'])
+    return(return_df)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Times the pipeline and a backtest on synthetic data.')
+    parser.add_argument('--tickers', type=int, default=100)
+    parser.add_argument('--dates', type=int, default=2000)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--pick-dates', type=int, default=50)
+    parser.add_argument('--only', nargs='+', choices=benchmark_names, default=benchmark_names, help='benchmarks to run')
+    parser.add_argument('--output', default=None, help='json file to write, defaults to results/<commit>_<tickers>x<dates>.json')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='compare two result files instead of running')
+    args = parser.parse_args()
+
+    if args.compare:
+        comparison = compare_results(*args.compare)
+        print(f"{comparison.attrs['commits'][0]} -> {comparison.attrs['commits'][1]}")
+        print(comparison.to_string(float_format=lambda x: f'{x:.4f}'))
+        sys.exit(0)
+
+    results = run_benchmarks(n_tickers=args.tickers, n_dates=args.dates, repeats=args.repeats, pick_dates=args.pick_dates, to_run=args.only)
+    for name, result in results['benchmarks'].items():
+        print(f"{name:<25} best {result['best']:.4f}s  median {result['median']:.4f}s")
+    print('saved to', save_results(results, args.output))
@@ -0,0 +1,92 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+# the pipeline modules are imported by name from their folders, like the notebooks do
+repo_dir = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+for folder in ['backtesting', os.path.join('data', 'stock_price_data')]:
+    if os.path.join(repo_dir, folder) not in sys.path:
+        sys.path.append(os.path.join(repo_dir, folder))
+
+import rolling_regression
+import combine
+from stock_data_schema import compact_stock_data
+
+default_reg_ranges = [5, 10, 30, 60, 90]
+
+# roughly the mix of the real company data
+sectors = ['Finance', 'Consumer Discretionary', 'Health Care', 'Technology', 'Industrials', 'Real Estate', 'Energy', 'Utilities',
+           'Consumer Staples', 'Telecommunications', 'Basic Materials', 'Miscellaneous']
+sector_weights = [1522, 1159, 1158, 752, 561, 277, 183, 174, 145, 103, 87, 63]
+countries = ['United States', 'China', 'Canada', 'Israel', 'United Kingdom', 'Singapore', 'Hong Kong', 'Cayman Islands', 'Bermuda', 'Chile']
+country_weights = [4872, 231, 196, 125, 90, 53, 52, 45, 30, 10]
+exchanges = ['NASDAQ', 'NYSE']
+
+
+def _weighted_choice(rng, options, weights, size):
+    weights = np.asarray(weights, dtype=np.float64)
+    return(rng.choice(options, size=size, p=weights / weights.sum()))
+
+
+def make_raw_stock_data(n_tickers=100, n_dates=2000, start_date='1995-01-03', random_state=0):
+    """stock data in the layout process_data takes: Adj_Close and Volume for each ticker plus ('Dates_Numeric', '')
+
+    Prices are random walks with late listings, delistings and single missing days (see
+    rolling_regression.make_random_walk_stock_data). After a ticker lists its price is carried
+    forward over gaps, so positions held through a delisting still have a value.
+    """
+    rng = np.random.default_rng(random_state)
+    stock_data = rolling_regression.make_random_walk_stock_data(n_dates=n_dates, n_tickers=n_tickers, start_date=start_date, random_state=random_state)
+    adj_close = stock_data['Adj_Close'].ffill()
+    volume = pd.DataFrame(np.floor(10 ** rng.uniform(3, 7, adj_close.shape)), index=adj_close.index, columns=adj_close.columns).where(adj_close.notna())
+    return_df = pd.concat({'Adj_Close': adj_close, 'Volume': volume}, axis=1)
+    return_df[('Dates_Numeric', '')] = stock_data[('Dates_Numeric', '')]
+    return(return_df)
+
+
+def make_processed_stock_data(raw_stock_data, reg_ranges=default_reg_ranges, random_state=0):
+    """adds what the processing notebooks add to raw stock data: Intercept_N, Dates_Numeric_N and Std_Dev_N for each
+    regression range, Volume_Value, Market_Cap (price times a fixed number of shares) and Size_Category, in the compact dtypes combine.ipynb saves"""
+    rng = np.random.default_rng(random_state)
+    adj_close = raw_stock_data.xs('Adj_Close', level=0, axis=1)
+    volume = raw_stock_data.xs('Volume', level=0, axis=1)
+    # shares spread so every size category shows up
+    shares = pd.Series(10 ** rng.uniform(6, 10, adj_close.shape[1]), index=adj_close.columns)
+    market_cap = adj_close * shares
+
+    regression_df = rolling_regression.regression_features(raw_stock_data, reg_ranges=reg_ranges)
+    extra = pd.concat({'Volume_Value': volume * adj_close, 'Market_Cap': market_cap,
+                       'Size_Category': combine.categorize_market_caps(market_cap)}, axis=1)
+    return(compact_stock_data(pd.concat([raw_stock_data, regression_df, extra], axis=1)))
+
+
+def make_company_data(tickers, random_state=0):
+    """company data in the layout of company_data_cleaned (indexed by Ticker) for the given tickers"""
+    rng = np.random.default_rng(random_state)
+    n_tickers = len(tickers)
+    sector = _weighted_choice(rng, sectors, sector_weights, n_tickers)
+    return_df = pd.DataFrame({
+        'Name': [ticker + ' Common Stock' for ticker in tickers],
+        'Market_Cap': 10 ** rng.uniform(6, 12, n_tickers),
+        'Country': _weighted_choice(rng, countries, country_weights, n_tickers),
+        'IPO_Year': rng.integers(1970, 2024, n_tickers).astype(float),
+        'Volume': rng.integers(1000, 10000000, n_tickers),
+        'Sector': sector,
+        # a few industries within each sector
+        'Industry': [sector_name + ': Industry ' + str(number) for sector_name, number in zip(sector, rng.integers(0, 6, n_tickers))],
+        'Exchange': rng.choice(exchanges, n_tickers),
+    }, index=pd.Index(tickers, name='Ticker'))
+    return(return_df)
+
+
+def make_market(n_tickers=100, n_dates=2000, reg_ranges=default_reg_ranges, start_date='1995-01-03', random_state=0):
+    """raw stock data, processed stock data and company data of the given size, the same every time for the same arguments
+
+    Returns:
+        tuple: (raw_stock_data, stock_data, company_data)
+    """
+    raw_stock_data = make_raw_stock_data(n_tickers=n_tickers, n_dates=n_dates, start_date=start_date, random_state=random_state)
+    stock_data = make_processed_stock_data(raw_stock_data, reg_ranges=reg_ranges, random_state=random_state)
+    company_data = make_company_data(list(raw_stock_data.xs('Adj_Close', level=0, axis=1).columns), random_state=random_state)
+    return(raw_stock_data, stock_data, company_data)
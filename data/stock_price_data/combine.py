@@ -0,0 +1,83 @@
+# Import libraries
+import numpy as np
+import pandas as pd
+
+# List of default values
+default_price_var = 'Adj_Close'
+
+# Market cap cutoffs for each size category, same as categorize_market_cap in combine.ipynb
+size_category_cutoffs = [(200e9, 'mega'), (10e9, 'large'), (2e9, 'mid'), (250e6, 'small'), (0, 'micro')]
+
+# bin edges for np.digitize in increasing order and the category of each bin, bin 0 (below the
+# smallest cutoff) has no category. Caps of 0 or less are also left without one
+_size_category_bins = np.array([cutoff for cutoff, _ in reversed(size_category_cutoffs)], dtype=np.float64)
+_size_category_by_bin = np.array([np.nan] + [name for _, name in reversed(size_category_cutoffs)], dtype=object)
+
+
+def categorize_market_caps(market_caps):
+    """returns a dataframe of size categories ('mega', 'large', 'mid', 'small', 'micro' or NaN) for a dataframe of market caps"""
+    values = market_caps.to_numpy(dtype=np.float64, na_value=np.nan)
+    bins = np.digitize(values, _size_category_bins)
+    # NaN caps land past the last bin, they and caps of 0 or less get no category
+    bins[~(values > 0)] = 0
+    return(pd.DataFrame(_size_category_by_bin[bins], index=market_caps.index, columns=market_caps.columns))
+
+
+def shares_table(records, date_col='Date', ticker_col='Ticker', shares_col='Shares'):
+    """turns shares outstanding records (one row per ticker and report date) into the dates x tickers table market_caps takes
+
+    Args:
+        records (dataframe, required): shares outstanding records, eg. from quarterly filings
+        date_col (str, optional): column with the date each figure is known from. Defaults to 'Date'.
+        ticker_col (str, optional): column with the ticker. Defaults to 'Ticker'.
+        shares_col (str, optional): column with the number of shares. Defaults to 'Shares'.
+
+    Returns:
+        pandas dataframe: shares indexed by date with one column per ticker, NaN where a ticker didn't report that day.
+            If a ticker has several figures for the same day the last one is kept
+    """
+    records = records.assign(**{date_col: pd.to_datetime(records[date_col])})
+    records = records.drop_duplicates([date_col, ticker_col], keep='last')
+    return_df = records.pivot(index=date_col, columns=ticker_col, values=shares_col).sort_index()
+    return_df.index.name = 'Date'
+    return_df.columns.name = None
+    return(return_df)
+
+
+def market_caps(prices, shares):
+    """Market caps for a dates x tickers dataframe of prices
+
+    Args:
+        prices (dataframe, required): prices indexed by date with one column per ticker, eg. stock_data.xs('Adj_Close', level=0, axis=1)
+        shares (series or dataframe, required): either one snapshot of shares outstanding indexed by ticker (used for every date, like
+            the Shares column of the company data) or a point in time table indexed by date with one column per ticker (see shares_table).
+            A point in time figure is used from its date until the next one, dates before a ticker's first figure have no market cap.
+
+    Returns:
+        pandas dataframe: market caps, the same shape as prices. Tickers without a shares figure are NaN
+    """
+    price_values = prices.to_numpy(dtype=np.float64, na_value=np.nan)
+    if isinstance(shares, pd.Series):
+        shares_values = shares.reindex(prices.columns).to_numpy(dtype=np.float64, na_value=np.nan)[np.newaxis, :]
+    else:
+        # the latest figure known on each price date, without looking ahead
+        shares = shares.sort_index().reindex(columns=prices.columns)
+        shares_values = shares.ffill().reindex(prices.index, method='ffill').to_numpy(dtype=np.float64, na_value=np.nan)
+    return(pd.DataFrame(price_values * shares_values, index=prices.index, columns=prices.columns))
+
+
+def add_market_cap_and_size(stock_data, shares, price_var=default_price_var):
+    """Adds Market_Cap and Size_Category for every ticker to processed stock data, what combine.ipynb used to do cell by cell
+
+    Args:
+        stock_data (dataframe, required): stock data with (price var, ticker) columns. Any Market_Cap and Size_Category columns already in it are replaced.
+        shares (series or dataframe, required): shares outstanding, a snapshot or a point in time table, see market_caps.
+        price_var (str, optional): the price var market caps are worked out from. Defaults to 'Adj_Close'.
+
+    Returns:
+        pandas dataframe: stock_data with the Market_Cap and Size_Category columns at the end
+    """
+    market_cap = market_caps(stock_data.xs(price_var, level=0, axis=1), shares)
+    size_category = categorize_market_caps(market_cap)
+    stock_data = stock_data.loc[:, ~stock_data.columns.get_level_values(0).isin(['Market_Cap', 'Size_Category'])]
+    return(pd.concat([stock_data, pd.concat({'Market_Cap': market_cap, 'Size_Category': size_category}, axis=1)], axis=1))
@@ -0,0 +1,108 @@
+# Import libraries
+import numpy as np
+import pandas as pd
+
+# Import class and functions from other code
+from date_numbers import Date_Numbers
+import rolling_regression
+from combine import categorize_market_caps, market_caps
+
+# List of default values
+default_reg_ranges = [5, 10, 30, 60, 90]
+default_coefficient = 'Dates_Numeric'
+default_to_predict = 'Adj_Close'
+
+# Date converter object
+date_numbers_obj = Date_Numbers()
+
+
+def implied_shares(processed_data, to_predict=default_to_predict):
+    """shares outstanding for each ticker implied by the last row with both a Market_Cap and a price"""
+    market_cap = processed_data.xs('Market_Cap', level=0, axis=1)
+    prices = processed_data.xs(to_predict, level=0, axis=1).reindex(columns=market_cap.columns)
+    shares = (market_cap / prices).replace([np.inf, -np.inf], np.nan)
+    return(shares.ffill().iloc[-1])
+
+
+def new_feature_rows(history, new_price_rows, reg_ranges=default_reg_ranges, coefficient=default_coefficient, to_predict=default_to_predict):
+    """Works out the processed rows for new trading days without redoing the full history
+
+    Only the last max(reg_ranges) rows of the existing processed data are needed: with the
+    one-day shift, the first new day's longest regression ends on the last day already stored.
+
+    Args:
+        history (dataframe, required): the end of the existing processed data, at least the last max(reg_ranges) rows. Passing the whole thing works too.
+        new_price_rows (dataframe, required): new rows in the download format eg. ('Adj_Close', 'AAPL'). Rows on or before the last stored day are ignored.
+        reg_ranges (list, optional): list of regression windows in trading days. Defaults to [5, 10, 30, 60, 90].
+        coefficient (str, optional): name of the general column to regress against. Defaults to 'Dates_Numeric'.
+        to_predict (str, optional): name of the price var being predicted. Defaults to 'Adj_Close'.
+
+    Returns:
+        pandas dataframe: just the new rows with the price data, Dates_Numeric, regression columns and, if the
+            history has them, Market_Cap and Size_Category
+    """
+    new_rows = new_price_rows[new_price_rows.index > history.index[-1]].copy()
+    if new_rows.empty:
+        return(new_rows)
+
+    new_rows.loc[:, coefficient] = date_numbers_obj.date_to_num(new_rows.index.to_series())
+
+    # the trailing window of stored prices followed by the new prices
+    trailing = history.iloc[-max(reg_ranges):]
+    window_data = pd.concat([
+        trailing.loc[:, [x for x in trailing.columns if x[0] == to_predict or x == (coefficient, '')]],
+        new_rows.loc[:, [x for x in new_rows.columns if x[0] == to_predict or x == (coefficient, '')]],
+    ])
+
+    regression_df = rolling_regression.regression_features(window_data, reg_ranges=reg_ranges, coefficient=coefficient, to_predict=to_predict)
+    new_rows = new_rows.join(regression_df.iloc[-len(new_rows):])
+
+    # market cap from the shares implied by the stored data, then size category from market cap
+    if 'Market_Cap' in history.columns.get_level_values(0):
+        shares = implied_shares(history, to_predict=to_predict)
+        market_cap = market_caps(new_rows.xs(to_predict, level=0, axis=1).reindex(columns=shares.index), shares)
+        size_category = categorize_market_caps(market_cap)
+        market_cap.columns = pd.MultiIndex.from_product([['Market_Cap'], market_cap.columns])
+        size_category.columns = pd.MultiIndex.from_product([['Size_Category'], size_category.columns])
+        new_rows = pd.concat([new_rows, market_cap, size_category], axis=1)
+
+    return(new_rows)
+
+
+def append_new_rows(processed_data, new_price_rows, reg_ranges=default_reg_ranges, coefficient=default_coefficient, to_predict=default_to_predict):
+    """returns processed_data with the processed new rows added to the end, see new_feature_rows"""
+    new_rows = new_feature_rows(processed_data.iloc[-max(reg_ranges):], new_price_rows, reg_ranges=reg_ranges, coefficient=coefficient, to_predict=to_predict)
+    new_rows = new_rows.reindex(columns=processed_data.columns.union(new_rows.columns, sort=False))
+
+    # the new rows take the stored dtypes (eg. the compact float32/category layout), otherwise concat would widen the whole history
+    stored_dtypes = processed_data.dtypes
+    new_dtypes = new_rows.dtypes.reindex(stored_dtypes.index)
+    to_cast = {col: dtype for col, dtype, new_dtype in zip(stored_dtypes.index, stored_dtypes, new_dtypes) if dtype != new_dtype}
+    if to_cast:
+        new_rows = new_rows.astype(to_cast)
+    return(pd.concat([processed_data, new_rows]))
+
+
+def update_processed_file(processed_file_name, new_price_rows, output_file_name=None, reg_ranges=default_reg_ranges):
+    """Appends new trading days to a processed .pkl or .parquet file
+
+    Args:
+        processed_file_name (str): the existing processed data eg. 'all_data_processed_2024-09-28.pkl'
+        new_price_rows (dataframe): new rows in the download format, eg. from yf.download(all_tickers_list, start=last_date)
+        output_file_name (str, optional): where to save the result, leave as None to overwrite processed_file_name. Defaults to None.
+        reg_ranges (list, optional): list of regression windows in trading days. Defaults to [5, 10, 30, 60, 90].
+    """
+    if output_file_name is None:
+        output_file_name = processed_file_name
+
+    if processed_file_name.endswith('.parquet'):
+        processed_data = pd.read_parquet(processed_file_name)
+    else:
+        processed_data = pd.read_pickle(processed_file_name)
+
+    processed_data = append_new_rows(processed_data, new_price_rows, reg_ranges=reg_ranges)
+
+    if output_file_name.endswith('.parquet'):
+        processed_data.to_parquet(output_file_name)
+    else:
+        processed_data.to_pickle(output_file_name)
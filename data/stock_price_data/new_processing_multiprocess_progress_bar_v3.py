@@ -1,94 +1,181 @@
 # Import libraries
+import os
+import json
+import time
+import numpy as np
 import pandas as pd
-from statsmodels.regression.rolling import RollingOLS
 from multiprocessing import Pool, cpu_count
 from functools import partial
 from tqdm import tqdm  # Import tqdm for the progress bar
 
 # Import class from other code
 from date_numbers import Date_Numbers
+import rolling_regression
+import shared_stock_matrix
 
 # List of default values
 default_reg_ranges = [5, 10, 30, 60, 90]
 default_coefficient_list = ['Dates_Numeric']
 default_to_predict = 'Adj_Close'
 
+# tickers written to each file in streaming mode, each chunk is all that's held in memory besides the input
+default_stream_chunk_size = 100
+stream_manifest_file_name = 'manifest.json'
+stream_general_file_name = 'general.parquet'
+
 # Date converter object
 date_numbers_obj = Date_Numbers()
 
 
 def process_ticker(ticker, stock_data, reg_ranges, regression_string, coefficient_list, to_predict):
-    regression_df = pd.DataFrame(index=stock_data.index)
+    """Rolling regression columns for one ticker and every window in reg_ranges
+
+    The ticker's slice of the data, the design matrix from regression_string and which rows are
+    missing data are the same for every window, so they're only worked out once. Missing rows are kept
+    and the windows ending on them skipped, like RollingOLS.from_formula. Every window is refit from
+    scratch (reset=1): RollingOLS's running update isn't updated while it skips windows, so after a gap
+    (including a late listing) it gives wrong numbers. With the refit this matches rolling_regression.regression_features.
+
+    Returns:
+        pandas dataframe: 'Intercept_N.ticker', '<coef>_Coeff_N.ticker' and 'Std_Dev_N.ticker' columns with the same index as stock_data,
+            shifted a day. attrs['seconds'] is how long the ticker took and attrs['rows'] how many days it has data for
+    """
+    # statsmodels and patsy are slow to import, so they're only loaded once a ticker actually needs RollingOLS
+    from statsmodels.regression.rolling import RollingOLS
+    from patsy import dmatrices, NAAction
+    start = time.perf_counter()
+
+    # Takes slice of data for the ticker we're looking at and adds general info (e.g., weekday)
+    stock_data_for_ticker = stock_data.xs(ticker, level=1, axis=1).join(stock_data.xs('', level=1, axis=1))
+
+    # Parses the formula and builds the design matrix once, missing values are kept like from_formula does
+    endog, exog = dmatrices(regression_string, stock_data_for_ticker, NA_action=NAAction(on_NA='raise', NA_types=[]), return_type='dataframe')
+    endog_values = endog.to_numpy()[:, 0]
+    exog_values = exog.to_numpy()
+    has_data = ~(np.isnan(endog_values) | np.isnan(exog_values).any(axis=1))
+    to_predict_data = stock_data_for_ticker[to_predict]
+
+    # Intercept and coefficients plus the standard deviation for every window, filled in as each one is done
+    n_params = exog_values.shape[1]
+    results = np.full((len(stock_data_for_ticker), len(reg_ranges) * (n_params + 1)), np.nan)
+    column_names = []
 
     for reg_range in reg_ranges:
-        # Takes slice of data for the ticker we're looking at and adds general info (e.g., weekday)
-        stock_data_for_ticker = stock_data.xs(ticker, level=1, axis=1).join(stock_data.xs('', level=1, axis=1))
-        
         # Check if data for ticker is empty or not sufficient for regression
-        if stock_data_for_ticker.empty or len(stock_data_for_ticker) < reg_range:
+        if not has_data.any() or len(stock_data_for_ticker) < reg_range:
             print(f"Skipping ticker {ticker} for window {reg_range}: insufficient data")
             continue
-        
-        # Debug: Print shape of the data
-        print(f"Processing {ticker}, window {reg_range}, data shape: {stock_data_for_ticker.shape}")
-        
+
         try:
-            # Runs regression
-            ticker_model = RollingOLS.from_formula(regression_string, window=reg_range, data=stock_data_for_ticker)
-            ticker_model_fit = ticker_model.fit()
+            # Runs regression, windows ending on a missing row are skipped and every window is refit
+            params = RollingOLS(endog_values, exog_values, window=reg_range, missing='skip').fit(reset=1, params_only=True).params
+        except ValueError as e:
+            print(f"Error processing {ticker}, window {reg_range}: {e}")
+            continue
 
-            # Sets up dictionary for renaming regression data (intercept and coefficients) column names so they are specific to this ticker
-            intercept_col_name = 'Intercept_' + str(reg_range) + '.' + ticker
-            rename_dict = {'Intercept': intercept_col_name}
+        # Shifts the regression data and the standard deviation down a day
+        first_col = len(column_names)
+        results[1:, first_col:first_col + n_params] = params[:-1]
+        results[1:, first_col + n_params] = to_predict_data.rolling(reg_range).std(ddof=0).to_numpy()[:-1]
 
-            # Uses for loop in case we have many coefficients for many endogenous variables
-            for coef in coefficient_list:
-                rename_dict[coef] = coef + '_Coeff_' + str(reg_range) + '.' + ticker
+        # Column names are specific to this ticker, uses for loop in case we have many coefficients for many endogenous variables
+        for coef in exog.columns:
+            column_names.append(('Intercept' if coef == 'Intercept' else coef + '_Coeff') + '_' + str(reg_range) + '.' + ticker)
+        column_names.append('Std_Dev_' + str(reg_range) + '.' + ticker)
 
-            # Applies rename
-            params = ticker_model_fit.params.rename(columns=rename_dict)
+    regression_df = pd.DataFrame(results[:, :len(column_names)], index=stock_data.index, columns=column_names)
+    regression_df.attrs['seconds'] = time.perf_counter() - start
+    regression_df.attrs['rows'] = int(has_data.sum())
+    return regression_df
 
-            # Calculates standard deviation
-            params['Std_Dev_' + str(reg_range) + '.' + ticker] = stock_data_for_ticker[to_predict].rolling(reg_range).std(ddof=0)
 
-            # Shifts the data and concatenates to regression_df
-            params = params.shift()
-            regression_df = pd.concat([regression_df, params], axis=1)
-        except ValueError as e:
-            print(f"Error processing {ticker}, window {reg_range}: {e}")
+def process_ticker_in_worker(task, reg_ranges, regression_string, coefficient_list, to_predict):
+    """Pool task: runs process_ticker on the ticker's columns of the shared stock matrix
 
-    return regression_df
+    Args:
+        task (tuple): (ticker, column indices in the shared matrix, (price var, ticker) names of those columns)
+    """
+    ticker, column_indices, column_names = task
+    stock_matrix = shared_stock_matrix.get_worker_array('stock_matrix')
+    dates = pd.DatetimeIndex(shared_stock_matrix.get_worker_array('dates'))
 
+    # Only this ticker's columns are copied out of shared memory
+    stock_data = pd.DataFrame(stock_matrix[:, column_indices], index=dates, columns=pd.MultiIndex.from_tuples(column_names))
+    return process_ticker(ticker, stock_data, reg_ranges, regression_string, coefficient_list, to_predict)
 
-def process_data(stock_data, output_file_name, reg_ranges=default_reg_ranges, coefficient_list=default_coefficient_list, to_predict=default_to_predict):
-    stock_data.loc[:, 'Dates_Numeric'] = date_numbers_obj.date_to_num(stock_data.index.to_series())
 
-    # Produces string of the format 'to_predict ~ coef_list[0] + coef_list[1]...'
-    regression_string = to_predict + ' ~ ' + ' + '.join(coefficient_list)
+def save_ticker_timings(timings, file_name, show=5):
+    """writes how long each ticker took in process_ticker to a csv (slowest first) and prints the slowest ones
+
+    Args:
+        timings (dict): {ticker: (seconds, days with data)}
+        file_name (str): csv to write, with Ticker, Seconds and Rows columns
+        show (int, optional): how many of the slowest tickers to print. Defaults to 5.
+    """
+    timings_df = pd.DataFrame([(ticker, seconds, rows) for ticker, (seconds, rows) in timings.items()], columns=['Ticker', 'Seconds', 'Rows'])
+    timings_df = timings_df.sort_values('Seconds', ascending=False)
+    timings_df.to_csv(file_name, index=False)
+    if show and len(timings_df):
+        print(f"Slowest tickers (total {timings_df['Seconds'].sum():.1f}s, median {timings_df['Seconds'].median():.3f}s), see {file_name}")
+        print(timings_df.head(show).to_string(index=False))
+
 
+def _ticker_results(stock_data, reg_ranges, regression_string, coefficient_list, to_predict, n_processes=None, timing_file_name=None):
+    """Runs process_ticker on every ticker in parallel and yields (ticker, regression dataframe) as each one finishes
+
+    The columns the regression needs are copied into shared memory once. Each worker attaches to
+    that one read-only copy when it starts and each task only carries a ticker's column indices,
+    so memory doesn't grow with the number of workers. If timing_file_name is given the time each
+    ticker took is saved there once they're all done, see save_ticker_timings.
+    """
     # List of tickers to process
     tickers = list({x[1] for x in stock_data.columns if x[1] != ''})
 
-    # Use multiprocessing to process each ticker in parallel with a progress bar
-    with Pool(cpu_count()) as pool:
-        partial_process_ticker = partial(
-            process_ticker,
-            stock_data=stock_data,
-            reg_ranges=reg_ranges,
-            regression_string=regression_string,
-            coefficient_list=coefficient_list,
-            to_predict=to_predict
-        )
+    # Only the predicted column, the predictor columns and the general columns (eg. Dates_Numeric) are shared
+    price_vars = [to_predict] + coefficient_list
+    shared_columns = [x for x in stock_data.columns if x[0] in price_vars or x[1] == '']
+    column_numbers = {col: number for number, col in enumerate(shared_columns)}
+    general_columns = [x for x in shared_columns if x[1] == '']
 
-        # Use tqdm to display progress while mapping the function
-        results = list(tqdm(pool.imap(partial_process_ticker, tickers), total=len(tickers), desc="Processing Tickers"))
+    # Each task is just the ticker and where its columns are in the shared matrix
+    tasks = []
+    for ticker in tickers:
+        ticker_columns = [(var, ticker) for var in price_vars if (var, ticker) in column_numbers] + general_columns
+        tasks.append((ticker, [column_numbers[col] for col in ticker_columns], ticker_columns))
+    timings = {}
 
-    # Concatenate all results into a single DataFrame
-    regression_df = pd.concat(results, axis=1)
+    matrix_shm, matrix_spec = shared_stock_matrix.create_shared_array(stock_data[shared_columns].to_numpy(dtype='float64'))
+    dates_shm, dates_spec = shared_stock_matrix.create_shared_array(stock_data.index.to_numpy(dtype='datetime64[ns]'))
+
+    try:
+        # Use multiprocessing to process each ticker in parallel with a progress bar
+        with Pool(n_processes or cpu_count(), initializer=shared_stock_matrix.init_worker,
+                  initargs=({'stock_matrix': matrix_spec, 'dates': dates_spec},)) as pool:
+            partial_process_ticker = partial(
+                process_ticker_in_worker,
+                reg_ranges=reg_ranges,
+                regression_string=regression_string,
+                coefficient_list=coefficient_list,
+                to_predict=to_predict
+            )
+
+            # Use tqdm to display progress while mapping the function
+            for ticker, result in zip(tickers, tqdm(pool.imap(partial_process_ticker, tasks), total=len(tasks), desc="Processing Tickers")):
+                timings[ticker] = (result.attrs.get('seconds'), result.attrs.get('rows'))
+                yield ticker, result
+    finally:
+        shared_stock_matrix.release_shared_array(matrix_shm)
+        shared_stock_matrix.release_shared_array(dates_shm)
 
+    if timing_file_name is not None:
+        save_ticker_timings(timings, timing_file_name)
+
+
+def _to_multiindex_columns(regression_df):
+    """turns process_ticker's 'Intercept_5.AAPL' column names into ('Intercept_5', 'AAPL') multi-index columns"""
     # This renames columns and changes them to multi-index columns so they integrate with the rest of the data
     # Splits ticker-specific data into tuples
-    rename_list = list((x.split('.')[0], x.split('.')[1]) for x in regression_df.columns if '.' in x)
+    rename_list = list((x.split('.', 1)[0], x.split('.', 1)[1]) for x in regression_df.columns if '.' in x)
 
     # Splits general data into tuples and sets the second value to 'empty'. Later we reset it to ''
     rename_commons_list = list((x, 'empty') for x in regression_df.columns if '.' not in x)
@@ -100,6 +187,79 @@ def process_data(stock_data, output_file_name, reg_ranges=default_reg_ranges, co
     # Resets 'empty' to ''
     regression_df = regression_df.rename(columns={'empty': ''})
 
+    return regression_df
+
+
+def process_tickers_in_pool(stock_data, reg_ranges, regression_string, coefficient_list, to_predict, n_processes=None, timing_file_name=None):
+    """Runs process_ticker on every ticker in parallel and puts the results together as multi-index columns, see _ticker_results"""
+    results = [result for _, result in _ticker_results(stock_data, reg_ranges, regression_string, coefficient_list, to_predict, n_processes=n_processes,
+                                                       timing_file_name=timing_file_name)]
+
+    # Concatenate all results into a single DataFrame
+    regression_df = pd.concat(results, axis=1)
+    return _to_multiindex_columns(regression_df)
+
+
+def _write_chunk(output_dir, file_name, ticker_data, regression_df=None):
+    """writes some tickers' columns (and their regression columns if given) to a parquet file and returns its manifest entry
+
+    Column names are flattened to 'price_var.ticker' like process_ticker's, the dates are in the general file.
+    """
+    # pyarrow is only needed here, and going straight from the arrays skips pandas converting each of the thousands of columns on its own
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    frames = [ticker_data] if regression_df is None else [ticker_data, regression_df]
+    columns = [price_var + '.' + ticker for frame in frames for price_var, ticker in frame.columns]
+    arrays = [pa.array(values[:, i]) for values in (frame.to_numpy(dtype='float64') for frame in frames) for i in range(values.shape[1])]
+    pq.write_table(pa.Table.from_arrays(arrays, names=columns), os.path.join(output_dir, file_name))
+    return({'file': file_name, 'tickers': sorted(set(ticker_data.columns.get_level_values(1))), 'columns': columns})
+
+
+def _chunk_file_name(chunk_number):
+    return(f'chunk_{chunk_number:05d}.parquet')
+
+
+def _inputs_file_name(chunk_number):
+    return(f'inputs_{chunk_number:05d}.parquet')
+
+
+def _write_closed_form_chunk(task, output_dir, x, coefficient, reg_ranges, to_predict):
+    """Pool task: regresses one chunk of tickers from the shared to_predict matrix and writes it to disk, only the manifest entry goes back"""
+    chunk_number, column_indices, column_names = task
+    predict_matrix = shared_stock_matrix.get_worker_array('predict_matrix')
+    dates = pd.DatetimeIndex(shared_stock_matrix.get_worker_array('dates'))
+    ticker_data = pd.DataFrame(predict_matrix[:, column_indices], index=dates, columns=pd.MultiIndex.from_tuples(column_names))
+    return(_closed_form_chunk(output_dir, chunk_number, ticker_data, x, coefficient, reg_ranges, to_predict))
+
+
+def _closed_form_chunk(output_dir, chunk_number, ticker_data, x, coefficient, reg_ranges, to_predict):
+    """regresses the to_predict columns of one chunk of tickers and writes them with their regression columns"""
+    regression_input = ticker_data.copy()
+    regression_input[(coefficient, '')] = x
+    regression_df = rolling_regression.regression_features(regression_input, reg_ranges=reg_ranges, coefficient=coefficient, to_predict=to_predict, n_processes=1)
+    return(_write_chunk(output_dir, _chunk_file_name(chunk_number), ticker_data, regression_df))
+
+
+def process_data(stock_data, output_file_name, reg_ranges=default_reg_ranges, coefficient_list=default_coefficient_list, to_predict=default_to_predict, n_processes=None, stream=False, timing_file_name=None):
+    # n_processes: number of worker processes, None uses every core. The workers share one copy of the prices, so the whole universe can go in one call
+    # stream: write the results a chunk of tickers at a time into the folder output_file_name instead of one pickle, see process_data_streaming
+    # timing_file_name: csv to save how long each ticker took in RollingOLS, to find the slow ones. The closed form does every ticker at once so has no per ticker times
+    if stream:
+        return process_data_streaming(stock_data, output_file_name, reg_ranges=reg_ranges, coefficient_list=coefficient_list, to_predict=to_predict, n_processes=n_processes,
+                                      timing_file_name=timing_file_name)
+
+    stock_data.loc[:, 'Dates_Numeric'] = date_numbers_obj.date_to_num(stock_data.index.to_series())
+
+    if len(coefficient_list) == 1 and (coefficient_list[0], '') in stock_data.columns:
+        # One general predictor (eg. Dates_Numeric) has a closed form, so every ticker and window is done at once with numpy
+        regression_df = rolling_regression.regression_features(stock_data, reg_ranges=reg_ranges, coefficient=coefficient_list[0], to_predict=to_predict, n_processes=n_processes)
+    else:
+        # Produces string of the format 'to_predict ~ coef_list[0] + coef_list[1]...'
+        regression_string = to_predict + ' ~ ' + ' + '.join(coefficient_list)
+
+        # Multiple or ticker-specific predictors still go through RollingOLS one ticker at a time
+        regression_df = process_tickers_in_pool(stock_data, reg_ranges, regression_string, coefficient_list, to_predict, n_processes=n_processes, timing_file_name=timing_file_name)
+
     # Joins regression data with stock data
     stock_data = stock_data.join(regression_df)
 
@@ -107,6 +267,143 @@ def process_data(stock_data, output_file_name, reg_ranges=default_reg_ranges, co
     stock_data.to_pickle(output_file_name)
 
 
+def process_data_streaming(stock_data, output_dir, reg_ranges=default_reg_ranges, coefficient_list=default_coefficient_list, to_predict=default_to_predict,
+                           n_processes=None, chunk_size=default_stream_chunk_size, timing_file_name=None):
+    """Same features as process_data, written to disk a chunk of tickers at a time instead of joined into one dataframe
+
+    Each chunk of tickers (their price columns and regression columns) goes to parquet files in
+    output_dir as soon as it's done, so besides the input only about one chunk per worker is ever
+    in memory. With the closed form regression only the to_predict columns are shared with the
+    workers, which write them with the regression columns to chunk_*.parquet, while the chunk's
+    other columns (Close, Volume, ...) are written by this process to inputs_*.parquet. The general columns (eg. Dates_Numeric) are written once to general.parquet with the
+    dates, and manifest.json lists which file has which tickers and columns. Nothing is put together
+    at the end, load_processed reads back just the tickers and price vars asked for.
+
+    Args:
+        stock_data (dataframe, required): multi-index column stock data in the download format eg. ('Adj_Close', 'AAPL')
+        output_dir (str, required): folder to write to, made if it doesn't exist
+        reg_ranges (list, optional): list of regression windows in trading days. Defaults to [5, 10, 30, 60, 90].
+        coefficient_list (list, optional): predictors to regress against. Defaults to ['Dates_Numeric'].
+        to_predict (str, optional): name of the price var being predicted. Defaults to 'Adj_Close'.
+        n_processes (int, optional): number of worker processes, None uses every core. Defaults to None.
+        chunk_size (int, optional): tickers per file. Defaults to 100.
+        timing_file_name (str, optional): csv to save how long each ticker took, only for the RollingOLS path. Defaults to None.
+    """
+    stock_data.loc[:, 'Dates_Numeric'] = date_numbers_obj.date_to_num(stock_data.index.to_series())
+    os.makedirs(output_dir, exist_ok=True)
+
+    general_columns = [x for x in stock_data.columns if x[1] == '']
+    ticker_columns = [x for x in stock_data.columns if x[1] != '']
+    tickers = list(dict.fromkeys(x[1] for x in ticker_columns))
+    columns_by_ticker = {}
+    for col in ticker_columns:
+        columns_by_ticker.setdefault(col[1], []).append(col)
+    ticker_chunks = [tickers[start:start + chunk_size] for start in range(0, len(tickers), chunk_size)]
+
+    general_df = stock_data[general_columns].copy()
+    general_df.columns = [x[0] for x in general_columns]
+    general_df.to_parquet(os.path.join(output_dir, stream_general_file_name))
+
+    if n_processes is None:
+        n_processes = cpu_count()
+
+    if len(coefficient_list) == 1 and (coefficient_list[0], '') in stock_data.columns:
+        # closed form regression, see rolling_regression.regression_features
+        coefficient = coefficient_list[0]
+        x = stock_data[(coefficient, '')].to_numpy(dtype='float64')
+        # only the to_predict columns go through the regression, the rest of each chunk's columns are written straight from stock_data
+        predict_columns = {ticker: [col for col in columns_by_ticker[ticker] if col[0] == to_predict] for ticker in tickers}
+        input_columns = {ticker: [col for col in columns_by_ticker[ticker] if col[0] != to_predict] for ticker in tickers}
+
+        def write_inputs(chunk_number):
+            chunk_input_columns = [col for ticker in ticker_chunks[chunk_number] for col in input_columns[ticker]]
+            if chunk_input_columns:
+                chunks.append(_write_chunk(output_dir, _inputs_file_name(chunk_number), stock_data[chunk_input_columns]))
+
+        chunks = []
+        if n_processes == 1:
+            for chunk_number, chunk in enumerate(tqdm(ticker_chunks, desc="Processing Chunks")):
+                chunks.append(_closed_form_chunk(output_dir, chunk_number, stock_data[[col for ticker in chunk for col in predict_columns[ticker]]], x, coefficient, reg_ranges, to_predict))
+                write_inputs(chunk_number)
+        else:
+            # the workers read their chunk's to_predict columns from one shared copy and write the features file themselves,
+            # while this process writes each chunk's other columns
+            shared_columns = [col for ticker in tickers for col in predict_columns[ticker]]
+            column_numbers = {col: number for number, col in enumerate(shared_columns)}
+            tasks = [(chunk_number, [column_numbers[col] for ticker in chunk for col in predict_columns[ticker]],
+                      [col for ticker in chunk for col in predict_columns[ticker]])
+                     for chunk_number, chunk in enumerate(ticker_chunks)]
+            matrix_shm, matrix_spec = shared_stock_matrix.create_shared_array(stock_data[shared_columns].to_numpy(dtype='float64'))
+            dates_shm, dates_spec = shared_stock_matrix.create_shared_array(stock_data.index.to_numpy(dtype='datetime64[ns]'))
+            try:
+                with Pool(n_processes, initializer=shared_stock_matrix.init_worker,
+                          initargs=({'predict_matrix': matrix_spec, 'dates': dates_spec},)) as pool:
+                    write_chunk = partial(_write_closed_form_chunk, output_dir=output_dir, x=x, coefficient=coefficient, reg_ranges=reg_ranges, to_predict=to_predict)
+                    for chunk_number, chunk_entry in enumerate(tqdm(pool.imap(write_chunk, tasks), total=len(tasks), desc="Processing Chunks")):
+                        chunks.append(chunk_entry)
+                        write_inputs(chunk_number)
+            finally:
+                shared_stock_matrix.release_shared_array(matrix_shm)
+                shared_stock_matrix.release_shared_array(dates_shm)
+    else:
+        # RollingOLS results are written out every chunk_size tickers as they come back from the pool
+        regression_string = to_predict + ' ~ ' + ' + '.join(coefficient_list)
+        chunks = []
+        pending = []
+
+        def flush():
+            chunk_tickers = [ticker for ticker, _ in pending]
+            ticker_data = stock_data[[col for ticker in chunk_tickers for col in columns_by_ticker[ticker]]]
+            regression_df = _to_multiindex_columns(pd.concat([result for _, result in pending], axis=1))
+            chunks.append(_write_chunk(output_dir, _chunk_file_name(len(chunks)), ticker_data, regression_df))
+            pending.clear()
+
+        for ticker, result in _ticker_results(stock_data, reg_ranges, regression_string, coefficient_list, to_predict, n_processes=n_processes, timing_file_name=timing_file_name):
+            pending.append((ticker, result))
+            if len(pending) == chunk_size:
+                flush()
+        if pending:
+            flush()
+
+    # written last, so a folder without a manifest is one that didn't finish
+    manifest = {'general_file': stream_general_file_name, 'general_columns': list(general_df.columns), 'reg_ranges': list(reg_ranges),
+                'coefficient_list': list(coefficient_list), 'to_predict': to_predict, 'chunks': chunks}
+    with open(os.path.join(output_dir, stream_manifest_file_name), 'w') as manifest_file:
+        json.dump(manifest, manifest_file)
+
+
+def load_processed(output_dir, price_vars=None, tickers=None):
+    """reads the output of process_data_streaming back as one multi-index column dataframe
+
+    Only the files holding the wanted tickers are opened and only the wanted columns are read from them.
+
+    Args:
+        output_dir (str, required): folder process_data_streaming wrote to
+        price_vars (list, optional): price vars to read eg. ['Adj_Close', 'Intercept_30'], leave as None for all of them. Defaults to None.
+        tickers (list, optional): tickers to read, leave as None for all of them. The general columns are always included. Defaults to None.
+
+    Returns:
+        pandas dataframe: (price var, ticker) columns indexed by date, general columns have '' as the ticker
+    """
+    with open(os.path.join(output_dir, stream_manifest_file_name)) as manifest_file:
+        manifest = json.load(manifest_file)
+    general_df = pd.read_parquet(os.path.join(output_dir, manifest['general_file']))
+    general_df.columns = pd.MultiIndex.from_tuples([(x, '') for x in general_df.columns])
+
+    wanted_vars = None if price_vars is None else set(price_vars)
+    wanted_tickers = None if tickers is None else set(tickers)
+    frames = [general_df]
+    for chunk in manifest['chunks']:
+        if wanted_tickers is not None and wanted_tickers.isdisjoint(chunk['tickers']):
+            continue
+        columns = [x for x in chunk['columns']
+                   if (wanted_vars is None or x.split('.', 1)[0] in wanted_vars) and (wanted_tickers is None or x.split('.', 1)[1] in wanted_tickers)]
+        if columns:
+            chunk_df = pd.read_parquet(os.path.join(output_dir, chunk['file']), columns=columns)
+            chunk_df.index = general_df.index
+            frames.append(_to_multiindex_columns(chunk_df))
+    return(pd.concat(frames, axis=1))
+
 # Main entry point
 if __name__ == "__main__":
     # Example call to the process_data function; replace stock_data and output_file_name as needed
@@ -0,0 +1,265 @@
+"""builds the processed stock data from scratch, what download.ipynb, process.ipynb and combine.ipynb do by hand
+
+    python pipeline.py --work-dir build --shares ../company_data/company_data_yf_2024-09-29.csv --end 2024-09-29
+    python pipeline.py --source fixtures/sample_download.csv --shares fixtures/sample_shares.csv --work-dir build_fixture
+
+Stages, each one reading the output of the one before:
+    ingest       the yfinance download (or a local csv/parquet/pickle file in the same layout) -> raw.pkl
+    features     process_data adds Dates_Numeric and the regression features -> features.pkl
+    market_cap   Market_Cap and Size_Category from shares outstanding (see combine.py) -> market_cap.pkl
+    store        compact dtypes, saved as <output name>.pkl and .parquet and optionally a feature store
+
+The work dir keeps a manifest.json with a content hash of every stage's inputs, settings and
+outputs. A stage whose inputs and settings haven't changed and whose outputs are still on disk
+untouched is skipped, so rerunning after eg. a new shares file only redoes market_cap and store.
+"""
+import os
+import sys
+import json
+import hashlib
+import argparse
+import datetime
+import pandas as pd
+
+import combine
+import new_processing_multiprocess_progress_bar_v3 as processing
+
+# compact_stock_data and Feature_Store live with the backtesting code
+backtesting_dir = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'backtesting'))
+if backtesting_dir not in sys.path:
+    sys.path.append(backtesting_dir)
+
+from stock_data_schema import compact_stock_data
+from feature_store import Feature_Store
+
+# List of default values
+stock_price_data_dir = os.path.dirname(os.path.abspath(__file__))
+default_tickers_file = os.path.join(stock_price_data_dir, 'allTickers.csv')
+default_output_name = 'all_data_processed'
+stage_names = ['ingest', 'features', 'market_cap', 'store']
+manifest_file_name = 'manifest.json'
+
+# files are hashed a piece at a time so the full universe never has to fit in memory twice
+_hash_chunk_size = 1 << 20
+
+
+def hash_path(path):
+    """sha256 of a file's contents, or of every file in a folder (names and contents, in sorted order)"""
+    digest = hashlib.sha256()
+    if os.path.isdir(path):
+        file_names = sorted(os.path.relpath(os.path.join(folder, name), path) for folder, _, names in os.walk(path) for name in names)
+    else:
+        file_names = [None]
+    for file_name in file_names:
+        if file_name is not None:
+            digest.update(file_name.replace(os.sep, '/').encode())
+        with open(path if file_name is None else os.path.join(path, file_name), 'rb') as file:
+            for chunk in iter(lambda: file.read(_hash_chunk_size), b''):
+                digest.update(chunk)
+    return(digest.hexdigest())
+
+
+def _hash_settings(settings):
+    return(hashlib.sha256(json.dumps(settings, sort_keys=True, default=str).encode()).hexdigest())
+
+
+def read_download(file_name):
+    """reads a saved download (yf.download(...).to_csv / to_parquet / to_pickle) into the layout the notebooks use
+
+    Column names are (price var, ticker) with 'Adj Close' renamed to 'Adj_Close', dates are timezone naive
+    and duplicate columns are dropped.
+    """
+    if file_name.endswith('.csv'):
+        stock_data = pd.read_csv(file_name, header=[0, 1], index_col=0)
+        stock_data.index = pd.to_datetime(stock_data.index)
+    elif file_name.endswith('.parquet'):
+        stock_data = pd.read_parquet(file_name)
+    else:
+        stock_data = pd.read_pickle(file_name)
+    return(_clean_download(stock_data))
+
+
+def _clean_download(stock_data):
+    stock_data = stock_data.rename(columns={'Adj Close': 'Adj_Close'})
+    stock_data.columns = stock_data.columns.set_names([None, None])
+    stock_data.index = pd.DatetimeIndex(stock_data.index).tz_localize(None)
+    stock_data.index.name = 'Date'
+    stock_data = stock_data.loc[:, ~stock_data.columns.duplicated()]
+    return(stock_data.sort_index())
+
+
+def download(tickers_file=default_tickers_file):
+    """downloads every ticker in tickers_file (a csv with a 'tickers' column like allTickers.csv) from yfinance"""
+    # only needed when actually downloading, the fixture runs work without it
+    import yfinance as yf
+    tickers = list(pd.read_csv(tickers_file)['tickers'])
+    return(_clean_download(yf.download(tickers, period='max', auto_adjust=False)))
+
+
+def read_shares(file_name):
+    """shares outstanding for combine.market_caps from a csv
+
+    A file with a Date column (Date, Ticker, Shares records) is read as a point in time table,
+    otherwise it's one snapshot per ticker like the company_data_yf files (Ticker and Shares columns).
+    """
+    shares_data = pd.read_csv(file_name)
+    if 'Date' in shares_data.columns:
+        return(combine.shares_table(shares_data))
+    return(shares_data.set_index('Ticker')['Shares'])
+
+
+class Data_Pipeline:
+    def __init__(self, work_dir, source='yfinance', shares_file=None, tickers_file=default_tickers_file, output_name=default_output_name,
+                 reg_ranges=processing.default_reg_ranges, n_processes=None, start_date=None, end_date=None, feature_store=False):
+        """
+        Args:
+            work_dir (str, required): folder for the stage outputs and the manifest, created if it doesn't exist.
+            source (str, optional): 'yfinance' to download, or a csv/parquet/pickle file in the download layout to run offline. Defaults to 'yfinance'.
+            shares_file (str, optional): csv of shares outstanding, see read_shares. Leave as None to skip Market_Cap and Size_Category. Defaults to None.
+            tickers_file (str, optional): csv with a 'tickers' column, only used when downloading. Defaults to allTickers.csv.
+            output_name (str, optional): file name (without extension) of the final data in work_dir. Defaults to 'all_data_processed'.
+            reg_ranges (list, optional): regression windows in trading days. Defaults to [5, 10, 30, 60, 90].
+            n_processes (int, optional): worker processes for the features stage, None uses every core. Defaults to None.
+            start_date (str, optional): drop days before this date, 'YYYY-MM-DD'. Defaults to None.
+            end_date (str, optional): drop days after this date, 'YYYY-MM-DD'. Defaults to None.
+            feature_store (bool, optional): also write a partitioned Feature_Store folder in the store stage. Defaults to False.
+        """
+        self.work_dir = work_dir
+        self.source = source
+        self.shares_file = shares_file
+        self.tickers_file = tickers_file
+        self.output_name = output_name
+        self.reg_ranges = list(reg_ranges)
+        self.n_processes = n_processes
+        self.start_date = start_date
+        self.end_date = end_date
+        self.feature_store = feature_store
+        os.makedirs(work_dir, exist_ok=True)
+
+        self.manifest_path = os.path.join(work_dir, manifest_file_name)
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as manifest_file:
+                self.manifest = json.load(manifest_file)
+        else:
+            self.manifest = {}
+
+    def path(self, file_name):
+        return(os.path.join(self.work_dir, file_name))
+
+    def stage_plan(self):
+        """{stage name: (input files, settings, output files, function)} for every stage"""
+        if self.source == 'yfinance':
+            # a download changes from day to day, so it's only reused on the day it was made
+            ingest_inputs = [self.tickers_file]
+            ingest_settings = {'source': 'yfinance', 'downloaded': self.end_date or datetime.date.today().isoformat()}
+        else:
+            ingest_inputs = [self.source]
+            ingest_settings = {'source': 'file'}
+        ingest_settings.update({'start_date': self.start_date, 'end_date': self.end_date})
+
+        store_outputs = [self.path(self.output_name + '.pkl'), self.path(self.output_name + '.parquet')]
+        if self.feature_store:
+            store_outputs.append(self.path(self.output_name + '_feature_store'))
+
+        return({
+            'ingest': (ingest_inputs, ingest_settings, [self.path('raw.pkl')], self.ingest),
+            'features': ([self.path('raw.pkl')], {'reg_ranges': self.reg_ranges}, [self.path('features.pkl')], self.features),
+            'market_cap': ([self.path('features.pkl')] + ([self.shares_file] if self.shares_file else []), {'shares': self.shares_file is not None},
+                           [self.path('market_cap.pkl')], self.market_cap),
+            'store': ([self.path('market_cap.pkl')], {'feature_store': self.feature_store}, store_outputs, self.store),
+        })
+
+    def ingest(self):
+        stock_data = download(self.tickers_file) if self.source == 'yfinance' else read_download(self.source)
+        if self.start_date is not None:
+            stock_data = stock_data.loc[stock_data.index >= self.start_date]
+        if self.end_date is not None:
+            stock_data = stock_data.loc[stock_data.index <= self.end_date]
+        stock_data.to_pickle(self.path('raw.pkl'))
+
+    def features(self):
+        processing.process_data(pd.read_pickle(self.path('raw.pkl')), self.path('features.pkl'), reg_ranges=self.reg_ranges, n_processes=self.n_processes)
+
+    def market_cap(self):
+        stock_data = pd.read_pickle(self.path('features.pkl'))
+        if self.shares_file is not None:
+            stock_data = combine.add_market_cap_and_size(stock_data, read_shares(self.shares_file))
+        stock_data.to_pickle(self.path('market_cap.pkl'))
+
+    def store(self):
+        stock_data = compact_stock_data(pd.read_pickle(self.path('market_cap.pkl')))
+        stock_data.to_pickle(self.path(self.output_name + '.pkl'))
+        stock_data.to_parquet(self.path(self.output_name + '.parquet'))
+        if self.feature_store:
+            Feature_Store(self.path(self.output_name + '_feature_store')).write(stock_data)
+
+    def is_up_to_date(self, stage, key, outputs):
+        """True if the stage last ran with the same inputs and settings (key) and its outputs haven't changed since"""
+        record = self.manifest.get(stage)
+        if record is None or record['key'] != key:
+            return(False)
+        return(all(os.path.exists(x) and record['outputs'].get(os.path.basename(x)) == hash_path(x) for x in outputs))
+
+    def run(self, stages=stage_names, force=False, log=print):
+        """Runs the stages in order, skipping the ones that are up to date
+
+        Args:
+            stages (list, optional): names of the stages to run, the outputs of the ones left out must already be in work_dir. Defaults to every stage.
+            force (bool, optional): run the stages even if they're up to date. Defaults to False.
+            log (function, optional): called with a line of progress for each stage. Defaults to print.
+
+        Returns:
+            dict: {stage name: 'ran' or 'skipped'}
+        """
+        plan = self.stage_plan()
+        results = {}
+        for stage in stage_names:
+            if stage not in stages:
+                continue
+            inputs, settings, outputs, function = plan[stage]
+            missing = [x for x in inputs if not os.path.exists(x)]
+            if missing:
+                raise FileNotFoundError(f"{stage} needs {', '.join(missing)}, run the stages before it first")
+
+            input_hashes = {os.path.basename(x): hash_path(x) for x in inputs}
+            key = _hash_settings({'inputs': input_hashes, 'settings': settings})
+            if not force and self.is_up_to_date(stage, key, outputs):
+                log(f'{stage:<12} up to date, skipped')
+                results[stage] = 'skipped'
+                continue
+
+            start = datetime.datetime.now()
+            function()
+            seconds = (datetime.datetime.now() - start).total_seconds()
+            self.manifest[stage] = {'key': key, 'inputs': input_hashes, 'settings': settings,
+                                    'outputs': {os.path.basename(x): hash_path(x) for x in outputs},
+                                    'finished': datetime.datetime.now().isoformat(timespec='seconds'), 'seconds': seconds}
+            # saved after every stage so a failure later on keeps the work already done
+            with open(self.manifest_path, 'w') as manifest_file:
+                json.dump(self.manifest, manifest_file, indent=2)
+            log(f'{stage:<12} ran in {seconds:.1f}s')
+            results[stage] = 'ran'
+        return(results)
+
+
+# Main entry point
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Downloads (or reads) stock prices and builds the processed stock data.')
+    parser.add_argument('--work-dir', required=True, help='folder for the stage outputs and manifest.json')
+    parser.add_argument('--source', default='yfinance', help="'yfinance' or a csv/parquet/pickle file in the download layout, eg. fixtures/sample_download.csv")
+    parser.add_argument('--shares', default=None, help='csv of shares outstanding, Ticker and Shares columns or Date, Ticker, Shares records')
+    parser.add_argument('--tickers', default=default_tickers_file, help='csv with a tickers column, used when downloading')
+    parser.add_argument('--output-name', default=default_output_name)
+    parser.add_argument('--reg-ranges', type=int, nargs='+', default=processing.default_reg_ranges)
+    parser.add_argument('--processes', type=int, default=None, help='worker processes for the features stage, defaults to every core')
+    parser.add_argument('--start', default=None, help='first date to keep, YYYY-MM-DD')
+    parser.add_argument('--end', default=None, help='last date to keep, YYYY-MM-DD')
+    parser.add_argument('--feature-store', action='store_true', help='also write a partitioned feature store')
+    parser.add_argument('--stages', nargs='+', choices=stage_names, default=stage_names)
+    parser.add_argument('--force', action='store_true', help='run the stages even if they are up to date')
+    args = parser.parse_args()
+
+    pipeline = Data_Pipeline(args.work_dir, source=args.source, shares_file=args.shares, tickers_file=args.tickers, output_name=args.output_name,
+                             reg_ranges=args.reg_ranges, n_processes=args.processes, start_date=args.start, end_date=args.end,
+                             feature_store=args.feature_store)
+    pipeline.run(stages=args.stages, force=args.force)
@@ -0,0 +1,303 @@
+# Import libraries
+from multiprocessing import Pool, cpu_count
+from functools import partial
+import numpy as np
+import pandas as pd
+
+import shared_stock_matrix
+
+# List of default values
+default_reg_ranges = [5, 10, 30, 60, 90]
+default_coefficient = 'Dates_Numeric'
+default_to_predict = 'Adj_Close'
+
+# number of tickers handled at once, keeps the temporary arrays to a few hundred MB
+default_chunk_size = 500
+
+# smaller chunks when running in a pool so the scratch memory of all the workers together stays about the same
+default_pool_chunk_size = 100
+
+
+def _rolling_sum(values, window):
+    """Rolling sums down axis 0 built from cumulative sums that restart every `window` rows.
+
+    A single cumulative sum over decades of prices grows so large that subtracting two of
+    its values loses most of the precision of the window sum. Restarting the cumulative sum
+    every `window` rows means every window sum only ever touches two neighbouring blocks.
+
+    Args:
+        values (np.ndarray): 2d array (dates x tickers) with no NaNs
+        window (int): number of rows in each window
+
+    Returns:
+        np.ndarray: same shape as values, row t holds the sum of rows t-window+1 to t. The first window-1 rows are NaN
+    """
+    n_rows = values.shape[0]
+    sums = np.full(values.shape, np.nan)
+    if n_rows < window:
+        return(sums)
+
+    # pads to a whole number of blocks then takes the cumulative sum inside each block
+    n_blocks = -(-n_rows // window)
+    padded = np.zeros((n_blocks * window,) + values.shape[1:])
+    padded[:n_rows] = values
+    local = np.cumsum(padded.reshape((n_blocks, window) + values.shape[1:]), axis=1)
+    block_totals = local[:, -1]
+    local = local.reshape(padded.shape)
+
+    # the first full window is exactly the first block
+    sums[window - 1] = local[window - 1]
+
+    # every later window is the start of its own block plus the end of the block before it
+    previous_totals = np.repeat(block_totals[:-1], window, axis=0)[:n_rows - window]
+    sums[window:] = local[window:n_rows] + (previous_totals - local[:n_rows - window])
+    return(sums)
+
+
+def rolling_ols_moments(y, x, window):
+    """Rolling OLS of y on x with an intercept, for many tickers at once
+
+    Gives the same numbers as statsmodels RollingOLS (missing='skip') refit on every window, and
+    pandas .rolling(window).std(ddof=0) for the standard deviation. Like RollingOLS, a window is
+    only skipped if one of its last window-1 values is missing; if just the first one is missing
+    the regression runs on the other window-1 days. The standard deviation needs the full window.
+
+    Args:
+        y (np.ndarray): 2d array (dates x tickers) of the values being predicted eg. Adj_Close
+        x (np.ndarray): 1d array (dates) of the predictor shared by every ticker eg. Dates_Numeric
+        window (int): number of rows in each regression
+
+    Returns:
+        tuple of np.ndarray: (intercept, slope, std_dev), each the same shape as y and aligned to the last row of each window
+    """
+    y = np.asarray(y, dtype=np.float64)
+    x = np.asarray(x, dtype=np.float64)
+
+    missing = np.isnan(y)
+    y_filled = np.where(missing, 0.0, y)
+
+    # centers x so the squared sums stay small, the offset is added back to the intercept
+    x_offset = x.mean()
+    x_centered = (x - x_offset)[:, None]
+
+    # rolling moments, x only has one column and broadcasts across tickers
+    sum_x = _rolling_sum(x_centered, window)
+    sum_xx = _rolling_sum(x_centered * x_centered, window)
+    sum_y = _rolling_sum(y_filled, window)
+    sum_yy = _rolling_sum(y_filled * y_filled, window)
+    sum_xy = _rolling_sum(x_centered * y_filled, window)
+    missing_count = _rolling_sum(missing.astype(np.float64), window)
+
+    # whether the first day of each window is missing, those days are left out of the regression
+    first_missing = np.zeros(y.shape)
+    first_missing[window - 1:] = missing[:len(y) - window + 1]
+    first_x = np.zeros((len(y), 1))
+    first_x[window - 1:] = x_centered[:len(y) - window + 1]
+
+    reg_nobs = window - first_missing
+    reg_sum_x = sum_x - first_missing * first_x
+    reg_sum_xx = sum_xx - first_missing * first_x * first_x
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_x = reg_sum_x / reg_nobs
+        mean_y = sum_y / reg_nobs
+        cov_xx = reg_sum_xx - reg_sum_x * mean_x
+        cov_xy = sum_xy - reg_sum_x * mean_y
+        slope = cov_xy / cov_xx
+    intercept = mean_y - slope * (mean_x + x_offset)
+
+    std_dev = np.sqrt(np.maximum(sum_yy - sum_y * sum_y / window, 0.0) / window)
+
+    # windows missing any of their last window-1 days don't get a regression, std dev needs every day
+    intercept[missing_count - first_missing != 0] = np.nan
+    slope[missing_count - first_missing != 0] = np.nan
+    std_dev[missing_count != 0] = np.nan
+
+    return(intercept, slope, std_dev)
+
+
+def _shift_rows(values):
+    """same as DataFrame.shift() on a 2d array: moves everything down a row and leaves NaNs in the first row"""
+    shifted = np.empty_like(values)
+    shifted[0] = np.nan
+    shifted[1:] = values[:-1]
+    return(shifted)
+
+
+def feature_column_names(reg_range, coefficient=default_coefficient):
+    """returns the (intercept, coefficient, std dev) price var names for one regression window eg. ('Intercept_5', 'Dates_Numeric_Coeff_5', 'Std_Dev_5')"""
+    return('Intercept_' + str(reg_range), coefficient + '_Coeff_' + str(reg_range), 'Std_Dev_' + str(reg_range))
+
+
+def _fill_feature_chunk(results, y, x, reg_ranges, start, stop):
+    """regresses tickers start to stop-1 of y and writes the shifted results into their columns of results"""
+    features_per_ticker = 3 * len(reg_ranges)
+    for window_number, reg_range in enumerate(reg_ranges):
+        for feature_number, feature in enumerate(rolling_ols_moments(y[:, start:stop], x, reg_range)):
+            # columns are grouped by ticker, then by window, then intercept/coeff/std dev
+            first_col = start * features_per_ticker + window_number * 3 + feature_number
+            results[:, first_col:stop * features_per_ticker:features_per_ticker] = _shift_rows(feature)
+
+
+def _feature_chunk_in_worker(chunk, x, reg_ranges):
+    """pool task: regresses tickers start to stop-1 of the y init_worker attached in shared memory and returns their results columns"""
+    start, stop = chunk
+    y = shared_stock_matrix.get_worker_array('y')
+    chunk_results = np.empty((len(y), 3 * len(reg_ranges) * (stop - start)))
+    _fill_feature_chunk(chunk_results, y[:, start:stop], x, reg_ranges, 0, stop - start)
+    return(start, stop, chunk_results)
+
+
+def regression_features(stock_data, reg_ranges=default_reg_ranges, coefficient=default_coefficient, to_predict=default_to_predict, tickers=None, chunk_size=None, n_processes=1):
+    """Calculates the regression columns for every ticker and window in one pass
+
+    Replaces running RollingOLS.from_formula once per ticker per window. Produces the same
+    columns as process_ticker: 'Intercept_N', '<coefficient>_Coeff_N' and 'Std_Dev_N' for
+    each N in reg_ranges, shifted a day so each row only uses data from before that day.
+
+    Args:
+        stock_data (dataframe, required): multi-index column stock data, must have the (coefficient, '') column eg. ('Dates_Numeric', '')
+        reg_ranges (list, optional): list of regression windows in trading days. Defaults to [5, 10, 30, 60, 90].
+        coefficient (str, optional): name of the general ('' ticker) column to regress against. Defaults to 'Dates_Numeric'.
+        to_predict (str, optional): name of the price var being predicted. Defaults to 'Adj_Close'.
+        tickers (list, optional): tickers to process, leave as None for every ticker with to_predict data. Defaults to None.
+        chunk_size (int, optional): how many tickers to regress at once, lower it if you're short on ram. Defaults to 500, or 100 per worker with n_processes > 1.
+        n_processes (int, optional): number of worker processes. They all read the one copy of the prices in shared memory
+            and send back one chunk of results at a time, so memory doesn't grow with the core count. None uses every core. Defaults to 1.
+
+    Returns:
+        pandas dataframe: regression data with (price var, ticker) multi-index columns and the same index as stock_data
+    """
+    to_predict_data = stock_data.xs(to_predict, level=0, axis=1)
+    if tickers is not None:
+        to_predict_data = to_predict_data.loc[:, list(tickers)]
+
+    # RollingOLS throws an error on tickers with no data at all, so process_ticker never made columns for them
+    to_predict_data = to_predict_data.loc[:, to_predict_data.notna().any(axis=0)]
+
+    # same as process_ticker, windows longer than the data are skipped
+    reg_ranges = [reg_range for reg_range in reg_ranges if reg_range <= len(stock_data.index)]
+
+    y = to_predict_data.to_numpy(dtype=np.float64)
+    x = stock_data[(coefficient, '')].to_numpy(dtype=np.float64)
+    ticker_list = list(to_predict_data.columns)
+    del to_predict_data
+
+    if n_processes is None:
+        n_processes = cpu_count()
+    if chunk_size is None:
+        chunk_size = default_chunk_size if n_processes == 1 else default_pool_chunk_size
+
+    # 3 columns (intercept, coeff, std dev) per window per ticker
+    results_shape = (len(y), 3 * len(reg_ranges) * len(ticker_list))
+    chunks = [(start, min(start + chunk_size, len(ticker_list))) for start in range(0, len(ticker_list), chunk_size)]
+
+    # results go straight into one preallocated array
+    results = np.empty(results_shape)
+    if n_processes == 1:
+        for start, stop in chunks:
+            _fill_feature_chunk(results, y, x, reg_ranges, start, stop)
+    else:
+        # workers get the name of the shared prices once and then only the ticker column ranges, each chunk's
+        # results are copied into place as they come back so there's never a second full size results array
+        features_per_ticker = 3 * len(reg_ranges)
+        y_shm, y_spec = shared_stock_matrix.create_shared_array(y)
+        del y
+        try:
+            with Pool(n_processes, initializer=shared_stock_matrix.init_worker, initargs=({'y': y_spec},)) as pool:
+                for start, stop, chunk_results in pool.imap_unordered(partial(_feature_chunk_in_worker, x=x, reg_ranges=reg_ranges), chunks):
+                    results[:, start * features_per_ticker:stop * features_per_ticker] = chunk_results
+        finally:
+            shared_stock_matrix.release_shared_array(y_shm)
+
+    columns = [(col_name, ticker)
+               for ticker in ticker_list
+               for reg_range in reg_ranges
+               for col_name in feature_column_names(reg_range, coefficient)]
+
+    return(pd.DataFrame(results, index=stock_data.index, columns=pd.MultiIndex.from_tuples(columns)))
+
+
+def check_parity_with_rolling_ols(stock_data, sample_size=20, reg_ranges=default_reg_ranges, coefficient=default_coefficient, to_predict=default_to_predict, random_state=0):
+    """Runs statsmodels RollingOLS on a sample of tickers and compares it to regression_features
+
+    RollingOLS is refit on every window (reset=1). With its default running update the sums
+    aren't updated while it skips windows with missing data, so every regression after a gap
+    in a ticker's data (including a late listing) comes out wrong.
+
+    Args:
+        stock_data (dataframe, required): multi-index column stock data with the (coefficient, '') column already added
+        sample_size (int, optional): number of tickers to compare. Defaults to 20.
+        reg_ranges (list, optional): list of regression windows in trading days. Defaults to [5, 10, 30, 60, 90].
+        coefficient (str, optional): name of the general column to regress against. Defaults to 'Dates_Numeric'.
+        to_predict (str, optional): name of the price var being predicted. Defaults to 'Adj_Close'.
+        random_state (int, optional): seed used to pick the sample. Defaults to 0.
+
+    Returns:
+        pandas dataframe: one row per sampled ticker and regression column with the largest absolute and relative difference
+    """
+    # imported here so the vectorized engine doesn't need statsmodels
+    from statsmodels.regression.rolling import RollingOLS
+
+    tickers = sorted({x[1] for x in stock_data.columns if x[1] != '' and x[0] == to_predict})
+    rng = np.random.default_rng(random_state)
+    sample = list(rng.choice(tickers, size=min(sample_size, len(tickers)), replace=False))
+    sample = [ticker for ticker in sample if stock_data[(to_predict, ticker)].notna().any()]
+
+    vectorized = regression_features(stock_data, reg_ranges=reg_ranges, coefficient=coefficient, to_predict=to_predict, tickers=sample)
+
+    exog = pd.DataFrame({'Intercept': 1.0, coefficient: stock_data[(coefficient, '')]})
+    rows = []
+    for ticker in sample:
+        endog = stock_data[(to_predict, ticker)]
+        for reg_range in reg_ranges:
+            params = RollingOLS(endog, exog, window=reg_range, missing='skip').fit(reset=1, params_only=True).params
+            reference = {
+                'Intercept': params['Intercept'],
+                'Coeff': params[coefficient],
+                'Std_Dev': endog.rolling(reg_range).std(ddof=0),
+            }
+            for ref_name, col_name in zip(reference, feature_column_names(reg_range, coefficient)):
+                expected = reference[ref_name].shift().to_numpy(dtype=np.float64)
+                actual = vectorized[(col_name, ticker)].to_numpy(dtype=np.float64)
+                both = ~np.isnan(expected) & ~np.isnan(actual)
+                diff = np.abs(expected[both] - actual[both])
+                scale = np.maximum(np.abs(expected[both]), 1.0)
+                rows.append({
+                    'Ticker': ticker,
+                    'Column': col_name,
+                    'Same_NaNs': bool(np.array_equal(np.isnan(expected), np.isnan(actual))),
+                    'Max_Abs_Diff': diff.max() if diff.size else 0.0,
+                    'Max_Rel_Diff': (diff / scale).max() if diff.size else 0.0,
+                })
+    return(pd.DataFrame(rows))
+
+
+def make_random_walk_stock_data(n_dates=2000, n_tickers=25, start_date='1995-01-03', random_state=0):
+    """makes stock_data shaped like the yfinance download (Adj_Close for each ticker) with gaps, for trying out the engine"""
+    from date_numbers import Date_Numbers
+
+    rng = np.random.default_rng(random_state)
+    dates = pd.bdate_range(start_date, periods=n_dates)
+    tickers = ['T' + str(i) for i in range(n_tickers)]
+
+    prices = 10 ** rng.uniform(0, 3, n_tickers) * np.exp(np.cumsum(rng.normal(0, 0.02, (n_dates, n_tickers)), axis=0))
+
+    # listings that start late, delistings, and single missing days
+    for col in range(n_tickers):
+        prices[:rng.integers(0, n_dates // 4), col] = np.nan
+        if rng.random() < 0.3:
+            prices[rng.integers(n_dates // 2, n_dates):, col] = np.nan
+    prices[rng.random((n_dates, n_tickers)) < 0.002] = np.nan
+
+    stock_data = pd.DataFrame(prices, index=dates, columns=pd.MultiIndex.from_product([['Adj_Close'], tickers]))
+    stock_data.loc[:, ('Dates_Numeric', '')] = Date_Numbers().date_to_num(stock_data.index.to_series())
+    return(stock_data)
+
+
+if __name__ == "__main__":
+    # Compares the vectorized engine to RollingOLS on random data
+    parity = check_parity_with_rolling_ols(make_random_walk_stock_data())
+    print(parity.groupby('Column')[['Max_Abs_Diff', 'Max_Rel_Diff']].max())
+    print(f"NaNs in the same places for every column: {parity['Same_NaNs'].all()}")
+    print(f"Largest relative difference: {parity['Max_Rel_Diff'].max()}")
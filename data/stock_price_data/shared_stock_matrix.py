@@ -0,0 +1,60 @@
+# Import libraries
+from multiprocessing import shared_memory
+import numpy as np
+
+# Arrays attached by worker processes, filled in by init_worker when the pool starts
+_worker_arrays = {}
+
+# Keeps the worker's shared memory handles open for as long as the worker is alive
+_worker_handles = []
+
+
+def create_shared_array(array):
+    """Copies an array into shared memory once so pool workers can read it without each getting a pickled copy
+
+    Args:
+        array (np.ndarray): array to share, eg. the Adj_Close values of stock_data (dates x tickers)
+
+    Returns:
+        tuple: (SharedMemory, spec) the spec is a small picklable dict that workers use to attach to the array.
+            Call release_shared_array on the SharedMemory when the pool is done with it.
+    """
+    array = np.ascontiguousarray(array)
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    shared = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)
+    shared[...] = array
+    spec = {'name': shm.name, 'shape': array.shape, 'dtype': array.dtype.str}
+    return(shm, spec)
+
+
+def attach_shared_array(spec, read_only=True):
+    """Attaches to an array made by create_shared_array. Returns (SharedMemory, array), keep the SharedMemory alive while using the array"""
+    shm = shared_memory.SharedMemory(name=spec['name'])
+    array = np.ndarray(spec['shape'], dtype=np.dtype(spec['dtype']), buffer=shm.buf)
+    if read_only:
+        array.flags.writeable = False
+    return(shm, array)
+
+
+def release_shared_array(shm, unlink=True):
+    """Closes the shared memory block and, from the process that made it, frees it"""
+    shm.close()
+    if unlink:
+        shm.unlink()
+
+
+def init_worker(specs):
+    """Pool initializer: attaches every shared array once per worker process, read only
+
+    Args:
+        specs (dict): {name: spec} for each array made with create_shared_array
+    """
+    for name, spec in specs.items():
+        shm, array = attach_shared_array(spec)
+        _worker_handles.append(shm)
+        _worker_arrays[name] = array
+
+
+def get_worker_array(name):
+    """returns an array attached by init_worker in this worker process"""
+    return(_worker_arrays[name])
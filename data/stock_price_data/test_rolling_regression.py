@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+
+import rolling_regression
+import new_processing_multiprocess_progress_bar_v3 as processing
+
+# RollingOLS is only the reference here, the engine itself doesn't need it
+pytest.importorskip('statsmodels')
+
+
+@pytest.fixture(scope='module')
+def stock_data():
+    # late listings, delistings and single missing days
+    return(rolling_regression.make_random_walk_stock_data(n_dates=400, n_tickers=10, random_state=1))
+
+
+def test_regression_features_match_rolling_ols(stock_data):
+    parity = rolling_regression.check_parity_with_rolling_ols(stock_data, sample_size=10)
+    assert len(parity) == 10 * len(rolling_regression.default_reg_ranges) * 3
+    assert parity['Same_NaNs'].all()
+    assert parity['Max_Rel_Diff'].max() < 1e-6
+
+
+def test_process_ticker_matches_regression_features(stock_data):
+    # the RollingOLS fallback and the closed form give the same numbers, gaps and late listings included
+    closed_form = rolling_regression.regression_features(stock_data)
+    for ticker in ['T0', 'T3', 'T7']:
+        columns = [x for x in stock_data.columns if x[1] in (ticker, '')]
+        fallback = processing.process_ticker(ticker, stock_data[columns], rolling_regression.default_reg_ranges, 'Adj_Close ~ Dates_Numeric', ['Dates_Numeric'], 'Adj_Close')
+        for column in fallback.columns:
+            price_var, column_ticker = column.split('.', 1)
+            np.testing.assert_allclose(fallback[column].to_numpy(), closed_form[(price_var, column_ticker)].to_numpy(), rtol=1e-6, atol=1e-8, equal_nan=True)